@@ -32,6 +32,8 @@ class Config:
     LOCAL_TTS_DEVICE = os.getenv("LOCAL_TTS_DEVICE", "cuda")
     LOCAL_TTS_SPEAKER = os.getenv("LOCAL_TTS_SPEAKER", "")
     LOCAL_TTS_FORMAT = os.getenv("LOCAL_TTS_FORMAT", "wav")
+    LOCAL_TTS_PRELOAD = os.getenv("LOCAL_TTS_PRELOAD", "false").lower() == "true"  # 启动时加载本地 TTS 模型
+    LOCAL_TTS_CONCURRENCY = int(os.getenv("LOCAL_TTS_CONCURRENCY", 4))  # 同时排队/执行的本地 TTS 请求上限，超出直接返回 503
 
     # AssemblyAI Streaming STT（补充缺失参数）
     ASSEMBLYAI_STREAMING_URL = os.getenv(
@@ -81,6 +83,9 @@ class Config:
         "./backend/models/en_US-lessac-medium.onnx.json"
     )
     PIPER_SAMPLE_RATE = int(os.getenv("PIPER_SAMPLE_RATE", "22050"))
+    PIPER_QUANTIZE = os.getenv("PIPER_QUANTIZE", "false").lower() == "true"  # 使用 int8 动态量化模型
+    PIPER_USE_CUDA = os.getenv("PIPER_USE_CUDA", "false").lower() == "true"  # 需要 onnxruntime-gpu
+    PIPER_PRELOAD = os.getenv("PIPER_PRELOAD", "true").lower() == "true"  # 启动时加载并预热 Piper 模型
 
 
 config = Config()
@@ -46,15 +46,32 @@ from .agent import tea_agent
 from .production import build_order_progress, build_queue_snapshot, find_progress_in_snapshot
 from .pricing import calculate_order_total
 from .time_utils import parse_timestamp
-from voice_service.local_tts import synthesize_local_tts
+from voice_service.local_tts import synthesize_local_tts, warmup_local_tts
 from voice_service.stt import STTBackendRouter
-from voice_service.streaming_tts import get_tts_engine
+from voice_service.streaming_tts import check_dependencies_async, get_tts_engine
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifecycle"""
     print("🚀 Tea Order Agent System started successfully!")
     print(f"📊 Database path: {config.DATABASE_PATH}")
+    if config.LOCAL_TTS_PRELOAD:
+        # 启动阶段加载本地 TTS 模型，首个请求不再承担冷启动
+        await warmup_local_tts()
+        print(f"🔊 Local TTS model loaded: {config.LOCAL_TTS_MODEL}")
+    if config.STREAMING_TTS_ENABLED:
+        # 依赖探测（含 ffmpeg 子进程）在线程中执行，结果缓存供 /ws/tts 复用
+        deps_ok, missing = await check_dependencies_async()
+        if not deps_ok:
+            logger.warning(f"Streaming TTS dependencies missing: {', '.join(missing)}")
+    if config.STREAMING_TTS_ENABLED and config.PIPER_PRELOAD:
+        # 启动阶段加载 Piper 并跑一次推理，首个 /ws/tts 请求不再承担图初始化
+        try:
+            tts_engine = await asyncio.to_thread(get_tts_engine, config)
+            await tts_engine.warmup()
+            print(f"🔊 Piper TTS warmed up: {config.PIPER_MODEL_PATH}")
+        except Exception as e:
+            logger.warning(f"Piper TTS warmup skipped: {e}")
     yield
 
 
@@ -483,9 +500,19 @@ async def streaming_tts_ws(websocket: WebSocket):
         output_format = message.get("format", "mp3")
         logger.info(f"TTS request: {len(text)} chars, format={output_format}")
 
-        # 获取 TTS 引擎
+        # 检查依赖（首次探测后结果已缓存）
+        deps_ok, missing = await check_dependencies_async()
+        if not deps_ok:
+            await websocket.send_json({
+                "message_type": "error",
+                "error": f"TTS dependencies missing: {', '.join(missing)}"
+            })
+            await websocket.close()
+            return
+
+        # 获取 TTS 引擎（未预加载时首次加载模型较慢，放到线程中执行，不阻塞事件循环）
         try:
-            tts_engine = get_tts_engine(config)
+            tts_engine = await asyncio.to_thread(get_tts_engine, config)
         except Exception as e:
             logger.error(f"Failed to initialize TTS engine: {e}")
             await websocket.send_json({
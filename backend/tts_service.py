@@ -5,6 +5,7 @@
 
 API 端点:
     POST /tts - 文本转语音
+    POST /tts/binary - 文本转语音（直接返回音频二进制）
     GET /health - 健康检查
     GET /models - 列出可用模型
 """
@@ -13,10 +14,12 @@ import asyncio
 import base64
 import os
 import tempfile
+from pathlib import Path
 from typing import Optional
 
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 
 try:
@@ -112,6 +115,7 @@ async def root():
         "device": TTS_DEVICE,
         "endpoints": {
             "tts": "POST /tts",
+            "tts_binary": "POST /tts/binary",
             "health": "GET /health",
             "models": "GET /models"
         }
@@ -149,6 +153,43 @@ async def list_models():
     }
 
 
+def _synthesize(request: TTSRequest) -> tuple[bytes, float]:
+    """在后台线程中合成语音，返回音频字节与估算时长"""
+    model = get_tts_model()
+
+    # 创建临时文件
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{request.format}") as tmp_file:
+        tmp_path = tmp_file.name
+
+    try:
+        # 合成语音
+        model.tts_to_file(
+            text=request.text,
+            speaker=request.voice or None,
+            file_path=tmp_path,
+        )
+
+        # 读取音频数据
+        with open(tmp_path, "rb") as f:
+            audio_bytes = f.read()
+
+        # 估算时长（基于文件大小，粗略估计）
+        # WAV: 大约 44100 Hz * 2 bytes/sample = 88200 bytes/sec
+        duration = len(audio_bytes) / 88200.0 if request.format == "wav" else 0.0
+
+        return audio_bytes, duration
+
+    finally:
+        # 清理临时文件（文件不存在时忽略，省去 try/except）
+        Path(tmp_path).unlink(missing_ok=True)
+
+
+async def _synthesize_async(request: TTSRequest) -> tuple[bytes, float]:
+    """在线程池中执行合成（避免阻塞事件循环）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _synthesize, request)
+
+
 @app.post("/tts", response_model=TTSResponse, tags=["TTS"])
 async def text_to_speech(request: TTSRequest):
     """
@@ -169,45 +210,7 @@ async def text_to_speech(request: TTSRequest):
     - duration_sec: 音频时长
     """
     try:
-        # 获取 TTS 模型
-        model = get_tts_model()
-
-        # 运行 TTS（在线程池中执行，避免阻塞）
-        loop = asyncio.get_running_loop()
-
-        def _synthesize() -> tuple[bytes, float]:
-            """在后台线程中合成语音"""
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{request.format}") as tmp_file:
-                tmp_path = tmp_file.name
-
-            try:
-                # 合成语音
-                model.tts_to_file(
-                    text=request.text,
-                    speaker=request.voice or None,
-                    file_path=tmp_path,
-                )
-
-                # 读取音频数据
-                with open(tmp_path, "rb") as f:
-                    audio_bytes = f.read()
-
-                # 估算时长（基于文件大小，粗略估计）
-                # WAV: 大约 44100 Hz * 2 bytes/sample = 88200 bytes/sec
-                duration = len(audio_bytes) / 88200.0 if request.format == "wav" else 0.0
-
-                return audio_bytes, duration
-
-            finally:
-                # 清理临时文件
-                try:
-                    os.remove(tmp_path)
-                except OSError:
-                    pass
-
-        # 在线程池中执行合成（避免阻塞事件循环）
-        audio_bytes, duration = await loop.run_in_executor(None, _synthesize)
+        audio_bytes, duration = await _synthesize_async(request)
 
         # Base64 编码
         audio_base64 = base64.b64encode(audio_bytes).decode("ascii")
@@ -227,6 +230,36 @@ async def text_to_speech(request: TTSRequest):
         )
 
 
+@app.post("/tts/binary", tags=["TTS"])
+async def text_to_speech_binary(request: TTSRequest):
+    """
+    文本转语音 API（二进制）
+
+    直接返回音频字节，省去 Base64 编码/解码；元数据放在响应头中：
+    - X-TTS-Voice: 使用的说话人
+    - X-TTS-Format: 音频格式
+    - X-TTS-Duration: 音频时长（秒）
+    """
+    try:
+        audio_bytes, duration = await _synthesize_async(request)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"TTS 合成失败: {str(e)}"
+        )
+
+    audio_format = request.format or "wav"
+    return Response(
+        content=audio_bytes,
+        media_type=f"audio/{'mpeg' if audio_format == 'mp3' else audio_format}",
+        headers={
+            "X-TTS-Voice": request.voice or "default",
+            "X-TTS-Format": audio_format,
+            "X-TTS-Duration": f"{duration:.3f}",
+        },
+    )
+
+
 # ===== 启动服务 =====
 
 if __name__ == "__main__":
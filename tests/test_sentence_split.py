@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Check PiperTTS._split_sentences against the original regex splitter"""
+
+import random
+import re
+
+from voice_service.streaming_tts import PiperTTS
+
+
+def regex_split_sentences(text: str, max_length: int = 150) -> list[str]:
+    """The original two-pass regex splitter, kept as the reference"""
+    if not text.strip():
+        return []
+
+    sentences = re.split(r'([.!?。！？]+)', text)
+
+    result = []
+    for i in range(0, len(sentences), 2):
+        sentence = sentences[i]
+        if i + 1 < len(sentences):
+            sentence += sentences[i + 1]
+
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+
+        if len(sentence) > max_length:
+            parts = re.split(r'([,，、;；:])', sentence)
+            temp = ""
+            for j in range(0, len(parts), 2):
+                part = parts[j]
+                if j + 1 < len(parts):
+                    part += parts[j + 1]
+
+                if len(temp) + len(part) > max_length and temp:
+                    result.append(temp.strip())
+                    temp = part
+                else:
+                    temp += part
+
+            if temp:
+                result.append(temp.strip())
+        else:
+            result.append(sentence)
+
+    return result
+
+
+def split_sentences(text: str, max_length: int = 150) -> list[str]:
+    # _split_sentences does not touch instance state, so skip loading a model
+    return PiperTTS._split_sentences(object.__new__(PiperTTS), text, max_length)
+
+
+def test_trailing_whitespace_not_counted():
+    text = "a" * 100 + ", " + "b" * 48 + " "
+    assert split_sentences(text) == regex_split_sentences(text) == [text.strip()]
+
+
+def test_matches_regex_splitter():
+    rng = random.Random(0)
+    alphabet = "ab 你好.!?。！？,，、;；:\n\t"
+    for _ in range(20000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 400)))
+        max_length = rng.choice((10, 30, 150))
+        assert split_sentences(text, max_length) == regex_split_sentences(text, max_length), repr(text)
+
+
+if __name__ == "__main__":
+    test_trailing_whitespace_not_counted()
+    test_matches_regex_splitter()
+    print("✓ Splitter matches the regex implementation")
@@ -4,18 +4,20 @@
     python3 test_tts_api.py
 """
 
-import base64
 import requests
 from pathlib import Path
 
 # TTS 服务地址
 TTS_URL = "http://localhost:8002"
 
+# 复用连接
+SESSION = requests.Session()
+
 
 def test_health():
     """测试健康检查"""
     print("\n1️⃣  测试健康检查...")
-    response = requests.get(f"{TTS_URL}/health")
+    response = SESSION.get(f"{TTS_URL}/health")
     print(f"   状态码: {response.status_code}")
     print(f"   响应: {response.json()}")
     return response.status_code == 200
@@ -24,7 +26,7 @@ def test_health():
 def test_models():
     """测试模型列表"""
     print("\n2️⃣  测试模型列表...")
-    response = requests.get(f"{TTS_URL}/models")
+    response = SESSION.get(f"{TTS_URL}/models")
     print(f"   状态码: {response.status_code}")
     data = response.json()
     print(f"   当前模型: {data['current_model']}")
@@ -37,37 +39,42 @@ def test_tts(text: str, output_file: str = "api_test_output.wav"):
     print(f"\n3️⃣  测试 TTS 合成...")
     print(f"   文本: {text}")
 
-    # 发送请求
-    response = requests.post(
-        f"{TTS_URL}/tts",
+    # 请求二进制音频，直接流式写入文件（无需 Base64 解码）
+    response = SESSION.post(
+        f"{TTS_URL}/tts/binary",
         json={
             "text": text,
             "voice": None,
             "format": "wav"
         },
+        headers={"Accept": "application/octet-stream"},
+        stream=True,
         timeout=120  # TTS 可能需要一些时间
     )
 
-    print(f"   状态码: {response.status_code}")
+    with response:
+        print(f"   状态码: {response.status_code}")
+
+        if response.status_code != 200:
+            print(f"   ❌ 错误: {response.text}")
+            return False
 
-    if response.status_code == 200:
-        data = response.json()
-        print(f"   说话人: {data['voice']}")
-        print(f"   格式: {data['format']}")
-        print(f"   时长: {data['duration_sec']:.2f} 秒")
+        print(f"   说话人: {response.headers.get('X-TTS-Voice', 'default')}")
+        print(f"   格式: {response.headers.get('X-TTS-Format', 'wav')}")
+        print(f"   时长: {float(response.headers.get('X-TTS-Duration', 0)):.2f} 秒")
 
-        # 解码并保存音频
-        audio_bytes = base64.b64decode(data['audio_base64'])
+        # 流式保存音频
         output_path = Path(output_file)
-        output_path.write_bytes(audio_bytes)
+        size = 0
+        with output_path.open("wb") as f:
+            for chunk in response.iter_content(65536):
+                f.write(chunk)
+                size += len(chunk)
 
-        print(f"   ✅ 音频已保存到: {output_path.absolute()}")
-        print(f"   文件大小: {len(audio_bytes) / 1024 / 1024:.2f} MB")
+    print(f"   ✅ 音频已保存到: {output_path.absolute()}")
+    print(f"   文件大小: {size / 1024 / 1024:.2f} MB")
 
-        return True
-    else:
-        print(f"   ❌ 错误: {response.text}")
-        return False
+    return True
 
 
 def main():
@@ -3,6 +3,7 @@ VLLM FastAPI 包装服务
 提供简化的对话接口，支持本地和Modal部署
 """
 import os
+import json
 import logging
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
@@ -384,7 +385,6 @@ async def openai_compatible_chat(
             async def generate():
                 try:
                     async for chunk in response:
-                        import json
                         yield f"data: {json.dumps(chunk.model_dump())}\n\n"
                     yield "data: [DONE]\n\n"
                 except Exception as e:
@@ -4,20 +4,76 @@ Modal 部署：分离架构 - Wrapper永远在线，vLLM自动缩放
 架构：
 1. FastAPI Wrapper (无GPU，永远在线) - 处理HTTP请求
 2. vLLM推理函数 (有GPU，自动缩放到0) - 只在推理时使用GPU
+   容器内直接暴露ASGI接口，Wrapper通过HTTP调用（无Modal RPC序列化）
 
 优势：
 - Wrapper永远在线，无冷启动
 - vLLM不用时自动释放GPU，节省成本
 - 可以在wrapper层添加缓存、限流等功能
 """
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import time
+import uuid
+from typing import List, Dict, Any, AsyncIterator, Optional, Union
+
+import httpx
 import modal
-from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 
 # ===== 配置 =====
 VLLM_MODEL = os.environ.get("VLLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct")
-VLLM_MAX_MODEL_LEN = 8192
-VLLM_GPU_MEMORY_UTILIZATION = 0.90
+VLLM_MAX_MODEL_LEN = int(os.environ.get("VLLM_MAX_MODEL_LEN", "8192"))
+# 预期同时在途的会话数，用于估算KV cache预算
+VLLM_EXPECTED_CONCURRENCY = int(os.environ.get("VLLM_EXPECTED_CONCURRENCY", "8"))
+
+# 量化：FP8权重（A100上走Marlin kernel）+ FP8 KV cache，权重带宽减半、KV容量翻倍
+# 设置为空字符串则使用原始bf16
+VLLM_QUANTIZATION = os.environ.get("VLLM_QUANTIZATION", "fp8") or None
+VLLM_KV_CACHE_DTYPE = os.environ.get("VLLM_KV_CACHE_DTYPE", "fp8_e5m2") or "auto"
+
+# 显存预算（A100-80GB + Llama-3.1-8B：bf16权重约16GB，FP8约8GB）
+GPU_MEMORY_GB = 80
+MODEL_WEIGHTS_GB = 8 if VLLM_QUANTIZATION == "fp8" else 16
+# 每token的KV大小：2(K+V) × 32层 × 8个KV头 × 128维 × 每元素字节数（bf16为2，FP8为1）
+KV_BYTES_PER_TOKEN = 2 * 32 * 8 * 128 * (1 if VLLM_KV_CACHE_DTYPE.startswith("fp8") else 2)
+KV_CACHE_BUDGET_GB = KV_BYTES_PER_TOKEN * VLLM_MAX_MODEL_LEN * VLLM_EXPECTED_CONCURRENCY / 1024**3
+# vLLM会把剩余显存全部分给KV cache，按实际并发只申请需要的部分（另留4GB给激活/CUDA graph）
+VLLM_GPU_MEMORY_UTILIZATION = float(os.environ.get(
+    "VLLM_GPU_MEMORY_UTILIZATION",
+    min(0.90, (MODEL_WEIGHTS_GB + KV_CACHE_BUDGET_GB + 4) / GPU_MEMORY_GB),
+))
+
+# GPU容器ASGI地址（留空则部署后自动获取）
+VLLM_GPU_URL = os.environ.get("VLLM_GPU_URL", "")
+
+# 调度参数：max_num_batched_tokens限制每个step的GPU工作量，按P99 TTFT调优
+VLLM_MAX_NUM_SEQS = int(os.environ.get("VLLM_MAX_NUM_SEQS", "128"))
+VLLM_MAX_NUM_BATCHED_TOKENS = int(os.environ.get("VLLM_MAX_NUM_BATCHED_TOKENS", "8192"))
+# 分块prefill：长prompt与正在进行的decode共享step，避免新请求阻塞其他会话
+VLLM_ENABLE_CHUNKED_PREFILL = os.environ.get("VLLM_ENABLE_CHUNKED_PREFILL", "true").lower() == "true"
+VLLM_SWAP_SPACE_GB = int(os.environ.get("VLLM_SWAP_SPACE_GB", "4"))
+
+# 权重在构建镜像时写入此目录
+MODEL_DIR = f"/models/{VLLM_MODEL}"
+
+
+def download_model_weights():
+    """镜像构建阶段下载模型权重（hf-transfer加速）"""
+    from huggingface_hub import snapshot_download
+
+    snapshot_download(
+        VLLM_MODEL,
+        local_dir=MODEL_DIR,
+        ignore_patterns=["*.pth", "original/*"],  # 只需safetensors
+    )
+
 
 # ===== Modal 镜像 =====
 # vLLM镜像（需要GPU）
@@ -30,21 +86,36 @@ vllm_image = (
         "transformers==4.46.0",
         "hf-transfer",
     )
+    .env({
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",
+        # decode期间保持vLLM安静，避免stdout刷写和Modal日志上传拖慢生成循环
+        "VLLM_LOGGING_LEVEL": "WARNING",
+    })
+    # 构建镜像时下载权重，冷启动只需从本地磁盘加载
+    .run_function(
+        download_model_weights,
+        secrets=[modal.Secret.from_name("vllm-secrets")],
+    )
 )
 
 # Wrapper镜像（轻量级，无GPU）
 wrapper_image = (
     modal.Image.debian_slim(python_version="3.10")
     .pip_install(
+        # Modal自带ASGI运行时，无需uvicorn；保持wrapper镜像最小化
         "fastapi>=0.109.0",
-        "uvicorn[standard]>=0.27.0",
         "pydantic>=2.9",
-        "httpx>=0.27.0",
+        "orjson>=3.9",
+        "httpx[http2]>=0.27.0",
     )
+    .env({"LOG_LEVEL": "WARNING"})
 )
 
-# 模型缓存
-weights_volume = modal.Volume.from_name("vllm-llama-cache", create_if_missing=True)
+# GPU容器日志：默认WARNING级别，直接输出（不缓冲，告警即时可见），不向根logger传播
+engine_logger = logging.getLogger("vllm-modal")
+engine_logger.setLevel(os.environ.get("VLLM_MODAL_LOG_LEVEL", "WARNING"))
+engine_logger.propagate = False
+engine_logger.addHandler(logging.StreamHandler())
 
 # Modal App
 app = modal.App("vllm-autoscale")
@@ -54,33 +125,74 @@ app = modal.App("vllm-autoscale")
 @app.cls(
     image=vllm_image,
     gpu="A100-80GB",
-    volumes={"/weights": weights_volume},
     secrets=[modal.Secret.from_name("vllm-secrets")],
     scaledown_window=120,  # 2分钟无请求后释放GPU
 )
+# 单容器同时接收多个请求，交给异步引擎做连续批处理
+@modal.concurrent(max_inputs=64)
 class VLLMInference:
     """vLLM推理服务 - 自动缩放到0"""
 
     @modal.enter()
     def setup(self):
-        """初始化vLLM引擎"""
-        import torch
-        from vllm import LLM, SamplingParams
+        """初始化vLLM异步引擎"""
+        from transformers import AutoTokenizer
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+
+        engine_logger.info("Loading model: %s", VLLM_MODEL)
+
+        # 使用模型自带的chat template直接生成token id，vLLM无需再次分词
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
+
+        # 异步引擎：并发请求在step级别连续批处理，并支持逐token流式输出
+        self.engine = AsyncLLMEngine.from_engine_args(
+            AsyncEngineArgs(
+                model=MODEL_DIR,
+                served_model_name=VLLM_MODEL,
+                gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
+                max_model_len=VLLM_MAX_MODEL_LEN,
+                tensor_parallel_size=1,
+                dtype="auto",
+                quantization=VLLM_QUANTIZATION,
+                kv_cache_dtype=VLLM_KV_CACHE_DTYPE,
+                max_num_seqs=VLLM_MAX_NUM_SEQS,
+                max_num_batched_tokens=VLLM_MAX_NUM_BATCHED_TOKENS,
+                enable_chunked_prefill=VLLM_ENABLE_CHUNKED_PREFILL,
+                swap_space=VLLM_SWAP_SPACE_GB,
+                # 相同前缀（system prompt/历史对话）复用KV block，只prefill新增部分
+                enable_prefix_caching=True,
+                block_size=16,
+            )
+        )
 
-        print(f"🚀 Loading model: {VLLM_MODEL}")
+        engine_logger.info("Model loaded: %s", VLLM_MODEL)
 
-        self.llm = LLM(
-            model=VLLM_MODEL,
-            download_dir="/weights",
-            gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
-            max_model_len=VLLM_MAX_MODEL_LEN,
-            tensor_parallel_size=1,
+    async def _stream(
+        self,
+        prompt: Union[str, Dict[str, List[int]]],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+    ) -> AsyncIterator[Any]:
+        """提交到引擎并逐步产出RequestOutput（文本为累计结果）
+
+        prompt 可以是原始字符串，也可以是 {"prompt_token_ids": [...]}
+        """
+        from uuid import uuid4
+        from vllm import SamplingParams
+
+        sampling_params = SamplingParams(
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
         )
 
-        print(f"✅ Model loaded: {VLLM_MODEL}")
+        async for output in self.engine.generate(
+            prompt, sampling_params, request_id=uuid4().hex
+        ):
+            yield output
 
-    @modal.method()
-    def generate(
+    async def generate(
         self,
         prompt: str,
         max_tokens: int = 2048,
@@ -99,26 +211,15 @@ class VLLMInference:
         Returns:
             生成结果
         """
-        from vllm import SamplingParams
+        final_output = None
+        async for output in self._stream(prompt, max_tokens, temperature, top_p):
+            final_output = output
 
-        sampling_params = SamplingParams(
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-        )
+        if final_output is None:
+            raise RuntimeError("vLLM引擎未返回任何输出")
+        return self._format_output(final_output)
 
-        outputs = self.llm.generate([prompt], sampling_params)
-        output = outputs[0]
-
-        return {
-            "text": output.outputs[0].text,
-            "prompt_tokens": len(output.prompt_token_ids),
-            "completion_tokens": len(output.outputs[0].token_ids),
-            "finish_reason": output.outputs[0].finish_reason,
-        }
-
-    @modal.method()
-    def chat(
+    async def chat(
         self,
         messages: List[Dict[str, str]],
         max_tokens: int = 2048,
@@ -137,206 +238,486 @@ class VLLMInference:
         Returns:
             对话结果
         """
-        # 将消息转换为prompt
-        prompt = self._messages_to_prompt(messages)
-        return self.generate(prompt, max_tokens, temperature, top_p)
+        # 将消息转换为token id
+        prompt = self._encode_messages(messages)
+        return await self.generate(prompt, max_tokens, temperature, top_p)
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+    ) -> AsyncIterator[str]:
+        """
+        流式对话接口 - 以SSE格式逐段产出新增文本
+
+        事件格式:
+            data: {"text": "<增量文本>"}
+            data: {"finish_reason": ..., "prompt_tokens": ..., "completion_tokens": ...}
+            data: [DONE]
+
+        引擎未返回任何输出时，以 data: {"error": "..."} 代替最后的统计事件
+        """
+        prompt = self._encode_messages(messages)
+        sent_len = 0
+        final_output = None
+
+        async for output in self._stream(prompt, max_tokens, temperature, top_p):
+            final_output = output
+            text = output.outputs[0].text
+            if len(text) > sent_len:
+                delta = text[sent_len:]
+                sent_len = len(text)
+                yield f"data: {json.dumps({'text': delta}, ensure_ascii=False)}\n\n"
+
+        if final_output is None:
+            yield f"data: {json.dumps({'error': 'vLLM引擎未返回任何输出'}, ensure_ascii=False)}\n\n"
+        else:
+            result = self._format_output(final_output)
+            del result["text"]
+            yield f"data: {json.dumps(result)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @staticmethod
+    def _format_output(output) -> Dict[str, Any]:
+        """将vLLM输出转换为结果字典"""
+        return {
+            "text": output.outputs[0].text,
+            "prompt_tokens": len(output.prompt_token_ids),
+            "completion_tokens": len(output.outputs[0].token_ids),
+            "finish_reason": output.outputs[0].finish_reason,
+        }
+
+    def _encode_messages(self, messages: List[Dict[str, str]]) -> Dict[str, List[int]]:
+        """用模型的chat template将对话消息编码为token id"""
+        token_ids = self.tokenizer.apply_chat_template(
+            messages, add_generation_prompt=True, tokenize=True
+        )
+        return {"prompt_token_ids": token_ids}
+
+    @modal.asgi_app()
+    def api(self):
+        """
+        GPU容器内的ASGI应用
 
-    def _messages_to_prompt(self, messages: List[Dict[str, str]]) -> str:
-        """将对话消息转换为prompt"""
-        prompt = ""
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
+        Wrapper通过HTTP直接调用，省去Modal RPC的pickle序列化和额外的跨容器往返。
+        """
+        gpu_app = FastAPI(title="VLLM Inference", version="2.0.0")
+
+        class GenerateRequest(BaseModel):
+            prompt: str
+            max_tokens: int = 2048
+            temperature: float = 0.7
+            top_p: float = 0.9
+
+        class ChatRequest(BaseModel):
+            messages: List[Dict[str, str]]
+            max_tokens: int = 2048
+            temperature: float = 0.7
+            top_p: float = 0.9
+
+        @gpu_app.post("/generate")
+        async def generate(request: GenerateRequest):
+            return await self.generate(
+                request.prompt, request.max_tokens, request.temperature, request.top_p
+            )
 
-            if role == "system":
-                prompt += f"<|system|>\n{content}\n"
-            elif role == "user":
-                prompt += f"<|user|>\n{content}\n"
-            elif role == "assistant":
-                prompt += f"<|assistant|>\n{content}\n"
+        @gpu_app.post("/chat")
+        async def chat(request: ChatRequest):
+            return await self.chat(
+                request.messages, request.max_tokens, request.temperature, request.top_p
+            )
 
-        prompt += "<|assistant|>\n"
-        return prompt
+        @gpu_app.post("/chat/stream")
+        async def chat_stream(request: ChatRequest):
+            return StreamingResponse(
+                self.stream_chat(
+                    request.messages, request.max_tokens, request.temperature, request.top_p
+                ),
+                media_type="text/event-stream",
+            )
+
+        return gpu_app
 
 
 # ===== FastAPI Wrapper（永远在线） =====
-@app.function(
-    image=wrapper_image,
-    # 不设置scaledown_window，让wrapper保持运行
-    # Web服务默认行为是保持至少一个实例运行
-    secrets=[modal.Secret.from_name("vllm-secrets")],
+# 应用在模块导入时构建一次，wrapper()直接返回，不在函数体内重复定义模型和注册路由
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+# 在途请求去重：去重键 -> 共享的Future
+inflight_requests: Dict[str, asyncio.Future] = {}
+
+# FastAPI应用
+fastapi_app = FastAPI(
+    title="VLLM Auto-Scale Service",
+    description="FastAPI wrapper (永远在线) + vLLM (自动缩放)",
+    version="2.0.0",
+    # orjson序列化比标准库json快数倍，减轻wrapper的CPU开销
+    default_response_class=ORJSONResponse,
 )
-@modal.asgi_app()
-def wrapper():
-    """FastAPI Wrapper - 永远在线，调用vLLM推理函数"""
-    from fastapi import FastAPI, HTTPException, status
-    from fastapi.middleware.cors import CORSMiddleware
-    from pydantic import BaseModel, Field
-    from typing import List, Dict, Optional
-    import logging
-
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    # 获取vLLM推理类的引用（在应用外部）
-    inference_cls = VLLMInference()
-
-    # FastAPI应用
-    fastapi_app = FastAPI(
-        title="VLLM Auto-Scale Service",
-        description="FastAPI wrapper (永远在线) + vLLM (自动缩放)",
-        version="2.0.0",
-    )
 
-    fastapi_app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
+fastapi_app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+# 请求模型
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    messages: List[Message]
+    max_tokens: Optional[int] = Field(2048, description="最大token数")
+    temperature: Optional[float] = Field(0.7, description="温度参数")
+    top_p: Optional[float] = Field(0.9, description="Top-p采样")
+    stream: bool = Field(False, description="是否以SSE流式返回")
+
+
+class ChatResponse(BaseModel):
+    content: str
+    model: str
+    usage: Dict[str, int]
+    finish_reason: Optional[str] = None
+
+
+class OpenAIChatRequest(BaseModel):
+    # 保留OpenAI SDK附带的其他字段（n、stop、user等）
+    model_config = ConfigDict(extra="allow")
+
+    model: Optional[str] = None
+    messages: List[Message]
+    max_tokens: int = 2048
+    temperature: float = 0.7
+    top_p: float = 0.9
+    stream: bool = False
+
+
+class HealthResponse(BaseModel):
+    status: str
+    wrapper_status: str
+    vllm_status: str
+    model: str
+    architecture: str
+
+
+def request_key(payload: Dict) -> str:
+    """对规范化后的请求参数计算哈希，作为去重键"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+async def submit_chat(messages, max_tokens, temperature, top_p) -> Dict:
+    """
+    提交对话请求到GPU容器，等待结果
+
+    每个请求单独POST /chat，由AsyncLLMEngine在GPU侧做连续批处理；
+    wrapper侧不再攒批，单个请求的失败或长生成不会拖累其他请求。
+    temperature为0时结果确定，相同的在途请求共享同一次GPU推理
+    """
+    # 显式传入的null参数不转发，由GPU侧使用默认值（GPU接口的参数不接受null）
+    payload = {
+        key: value
+        for key, value in (
+            ("messages", messages),
+            ("max_tokens", max_tokens),
+            ("temperature", temperature),
+            ("top_p", top_p),
+        )
+        if value is not None
+    }
+
+    key = request_key(payload) if temperature == 0 else None
+    if key is not None and key in inflight_requests:
+        # shield：某个调用方断开时不取消其他调用方共享的Future
+        return await asyncio.shield(inflight_requests[key])
+
+    future = asyncio.ensure_future(post_chat(payload))
+    if key is not None:
+        inflight_requests[key] = future
+        future.add_done_callback(lambda _: inflight_requests.pop(key, None))
+
+    return await asyncio.shield(future)
+
+
+async def post_chat(payload: Dict) -> Dict:
+    """将单个对话请求发送给vLLM推理函数"""
+    response = await fastapi_app.state.gpu_client.post("/chat", json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+async def open_stream(payload: Dict) -> httpx.Response:
+    """
+    向GPU容器发起流式请求，先检查上游状态码再返回
+
+    在返回StreamingResponse之前调用：上游4xx/5xx转为普通HTTP错误响应，
+    而不是在已发出200响应头之后中断SSE流
+    """
+    client = fastapi_app.state.gpu_client
+    upstream = await client.send(
+        client.build_request("POST", "/chat/stream", json=payload), stream=True
     )
+    if upstream.status_code != 200:
+        detail = (await upstream.aread()).decode("utf-8", "replace")
+        await upstream.aclose()
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"推理失败: {detail}",
+        )
+    return upstream
 
-    # 请求模型
-    class Message(BaseModel):
-        role: str
-        content: str
-
-    class ChatRequest(BaseModel):
-        messages: List[Message]
-        max_tokens: Optional[int] = Field(2048, description="最大token数")
-        temperature: Optional[float] = Field(0.7, description="温度参数")
-        top_p: Optional[float] = Field(0.9, description="Top-p采样")
-
-    class ChatResponse(BaseModel):
-        content: str
-        model: str
-        usage: Dict[str, int]
-        finish_reason: Optional[str] = None
-
-    class HealthResponse(BaseModel):
-        status: str
-        wrapper_status: str
-        vllm_status: str
-        model: str
-        architecture: str
-
-    # 根路径
-    @fastapi_app.get("/")
-    async def root():
-        return {
-            "service": "VLLM Auto-Scale Service",
-            "version": "2.0.0",
-            "architecture": {
-                "wrapper": "Always-on (no GPU)",
-                "vllm": "Auto-scale to zero (with GPU)",
-                "scaledown_window": "2 minutes"
-            },
+
+def sse_error(message: str) -> str:
+    """SSE错误事件（流已开始后发生的错误只能以事件形式告知客户端）"""
+    return f"data: {json.dumps({'error': message}, ensure_ascii=False)}\n\n"
+
+
+async def proxy_stream(upstream: httpx.Response):
+    """透传GPU容器的SSE流，逐块转发给客户端"""
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk
+    except Exception as e:
+        logger.error("流式响应错误: %s", e)
+        yield sse_error(str(e))
+    finally:
+        await upstream.aclose()
+
+
+async def openai_stream(upstream: httpx.Response):
+    """将GPU容器的SSE事件转换为OpenAI chat.completion.chunk格式"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
             "model": VLLM_MODEL,
-            "endpoints": {
-                "POST /chat": "对话接口",
-                "POST /v1/chat/completions": "OpenAI兼容接口",
-                "GET /health": "健康检查",
-            }
+            "choices": [{
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason,
+            }],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def error(message: str) -> str:
+        return f"data: {json.dumps({'error': {'message': message}}, ensure_ascii=False)}\n\n"
+
+    try:
+        yield chunk({"role": "assistant"})
+
+        async for line in upstream.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if "text" in event:
+                yield chunk({"content": event["text"]})
+            elif "error" in event:
+                yield error(event["error"])
+                break
+            else:
+                yield chunk({}, event["finish_reason"])
+    except Exception as e:
+        logger.error("流式响应错误: %s", e)
+        yield error(str(e))
+    finally:
+        await upstream.aclose()
+
+    yield "data: [DONE]\n\n"
+
+
+@fastapi_app.on_event("startup")
+async def startup():
+    # GPU容器的Web地址，所有请求复用同一个HTTP/2连接池（多路复用，免去每次握手）
+    # 异步查询，不阻塞wrapper的事件循环
+    gpu_url = VLLM_GPU_URL or await VLLMInference().api.get_web_url.aio()
+    fastapi_app.state.gpu_client = httpx.AsyncClient(
+        base_url=gpu_url,
+        http2=True,
+        timeout=httpx.Timeout(None, connect=10.0),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+    )
+
+
+@fastapi_app.on_event("shutdown")
+async def shutdown():
+    await fastapi_app.state.gpu_client.aclose()
+
+
+# 根路径
+@fastapi_app.get("/")
+async def root():
+    return {
+        "service": "VLLM Auto-Scale Service",
+        "version": "2.0.0",
+        "architecture": {
+            "wrapper": "Always-on (no GPU)",
+            "vllm": "Auto-scale to zero (with GPU, ASGI over HTTP)",
+            "scaledown_window": "2 minutes"
+        },
+        "model": VLLM_MODEL,
+        "endpoints": {
+            "POST /chat": "对话接口",
+            "POST /v1/chat/completions": "OpenAI兼容接口",
+            "GET /health": "健康检查",
         }
+    }
+
+
+# 健康检查
+@fastapi_app.get("/health", response_model=HealthResponse)
+async def health():
+    return HealthResponse(
+        status="healthy",
+        wrapper_status="running",
+        vllm_status="auto-scaling (idle or active)",
+        model=VLLM_MODEL,
+        architecture="separated"
+    )
 
-    # 健康检查
-    @fastapi_app.get("/health", response_model=HealthResponse)
-    async def health():
-        return HealthResponse(
-            status="healthy",
-            wrapper_status="running",
-            vllm_status="auto-scaling (idle or active)",
+
+# 对话接口
+@fastapi_app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """
+    对话接口 - 调用vLLM推理函数
+
+    注意：首次调用可能需要等待vLLM启动（如果GPU已释放）
+    stream=true 时以SSE逐段返回新生成的文本
+    """
+    try:
+        logger.info("收到对话请求，%d条消息", len(request.messages))
+
+        # 调用vLLM推理函数（model_dump在pydantic-core中一次性完成转换）；
+        # null参数不转发，由GPU侧使用默认值
+        payload = request.model_dump(exclude={"stream"}, exclude_none=True)
+        messages_dict = payload["messages"]
+
+        if request.stream:
+            return StreamingResponse(
+                proxy_stream(await open_stream(payload)),
+                media_type="text/event-stream",
+            )
+
+        logger.info("正在调用vLLM推理函数...")
+        result = await submit_chat(
+            messages=messages_dict,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p,
+        )
+
+        logger.info("推理完成")
+
+        return ChatResponse(
+            content=result["text"],
             model=VLLM_MODEL,
-            architecture="separated"
+            usage={
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+            },
+            finish_reason=result["finish_reason"],
         )
 
-    # 对话接口
-    @fastapi_app.post("/chat", response_model=ChatResponse)
-    async def chat(request: ChatRequest):
-        """
-        对话接口 - 调用vLLM推理函数
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("推理失败: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"推理失败: {str(e)}"
+        )
 
-        注意：首次调用可能需要等待vLLM启动（如果GPU已释放）
-        """
-        try:
-            logger.info(f"收到对话请求，{len(request.messages)}条消息")
-
-            # 调用vLLM推理函数
-            messages_dict = [{"role": m.role, "content": m.content} for m in request.messages]
-
-            logger.info("正在调用vLLM推理函数...")
-            result = inference_cls.chat.remote(
-                messages=messages_dict,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
+
+# OpenAI兼容接口
+@fastapi_app.post("/v1/chat/completions")
+async def openai_chat(request: OpenAIChatRequest):
+    """OpenAI兼容的对话接口"""
+    try:
+        messages = request.model_dump(include={"messages"})["messages"]
+
+        if request.stream:
+            upstream = await open_stream({
+                "messages": messages,
+                "max_tokens": request.max_tokens,
+                "temperature": request.temperature,
+                "top_p": request.top_p,
+            })
+            return StreamingResponse(
+                openai_stream(upstream),
+                media_type="text/event-stream",
             )
 
-            logger.info("推理完成")
+        # 调用vLLM推理函数
+        result = await submit_chat(
+            messages=messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p,
+        )
 
-            return ChatResponse(
-                content=result["text"],
-                model=VLLM_MODEL,
-                usage={
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+        # OpenAI格式响应
+        return {
+            "id": "chatcmpl-vllm",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": VLLM_MODEL,
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": result["text"],
                 },
-                finish_reason=result["finish_reason"],
-            )
+                "finish_reason": result["finish_reason"],
+            }],
+            "usage": {
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+            }
+        }
 
-        except Exception as e:
-            logger.error(f"推理失败: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
-            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"推理失败: {str(e)}"
+        )
 
-    # OpenAI兼容接口
-    @fastapi_app.post("/v1/chat/completions")
-    async def openai_chat(request: Dict):
-        """OpenAI兼容的对话接口"""
-        try:
-            messages = request.get("messages", [])
-            max_tokens = request.get("max_tokens", 2048)
-            temperature = request.get("temperature", 0.7)
-            top_p = request.get("top_p", 0.9)
-
-            # 调用vLLM推理函数
-            result = inference_cls.chat.remote(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-            )
 
-            # OpenAI格式响应
-            return {
-                "id": "chatcmpl-vllm",
-                "object": "chat.completion",
-                "created": int(__import__("time").time()),
-                "model": VLLM_MODEL,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": result["text"],
-                    },
-                    "finish_reason": result["finish_reason"],
-                }],
-                "usage": {
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
-                }
-            }
+# 预先生成OpenAPI schema，避免首个/docs请求时再构建
+fastapi_app.openapi()
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
-            )
 
+@app.function(
+    image=wrapper_image,
+    # 不设置scaledown_window，让wrapper保持运行
+    # Web服务默认行为是保持至少一个实例运行
+    secrets=[modal.Secret.from_name("vllm-secrets")],
+)
+# wrapper只做I/O转发，单容器即可承载大量并发连接
+@modal.concurrent(max_inputs=1000)
+@modal.asgi_app()
+def wrapper():
+    """FastAPI Wrapper - 永远在线，调用vLLM推理函数"""
     return fastapi_app
 
 
@@ -354,7 +735,7 @@ def main():
     print("   │  - 处理HTTP请求                     │")
     print("   │  - 可添加缓存/限流等功能            │")
     print("   └──────────────┬──────────────────────┘")
-    print("                  │ Modal Function Call")
+    print("                  │ HTTP (GPU容器ASGI)")
     print("                  ↓")
     print("   ┌─────────────────────────────────────┐")
     print("   │  vLLM推理函数 (自动缩放)            │")
@@ -379,7 +760,7 @@ def main():
     print()
     print("📝 部署后:")
     print("   - Wrapper立即可用，无冷启动")
-    print("   - 首次推理请求会触发vLLM启动（约1-2分钟）")
+    print("   - 首次推理请求会触发vLLM启动（权重已打包进镜像，约20-30秒）")
     print("   - 后续请求如果在2分钟内，直接使用已加载的模型")
     print("   - 2分钟无请求后，GPU自动释放")
     print("=" * 70)
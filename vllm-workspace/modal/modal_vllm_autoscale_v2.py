@@ -1,16 +1,71 @@
 """
-Modal 部署：分离架构V2 - 使用函数而非类
+Modal 部署：分离架构V2 - Modal RPC批量调用
 
-使用函数更简单，更容易从ASGI应用中调用
+Wrapper逐条通过Modal方法调用，由Modal原生批处理合并后交给GPU，
+GPU容器启动时通过@modal.enter()加载模型
 """
+import asyncio
+import hashlib
+import json
+import logging
 import os
-import modal
+import time
 from typing import List, Dict, Any, Optional
 
+import modal
+from fastapi import FastAPI, HTTPException, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+
 # ===== 配置 =====
 VLLM_MODEL = os.environ.get("VLLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct")
-VLLM_MAX_MODEL_LEN = 8192
-VLLM_GPU_MEMORY_UTILIZATION = 0.90
+VLLM_MAX_MODEL_LEN = int(os.environ.get("VLLM_MAX_MODEL_LEN", "8192"))
+# 预期同时在途的会话数，用于估算KV cache预算
+VLLM_EXPECTED_CONCURRENCY = int(os.environ.get("VLLM_EXPECTED_CONCURRENCY", "8"))
+
+# 量化：FP8权重（A100上走Marlin kernel）+ FP8 KV cache，权重带宽减半、KV容量翻倍
+# 设置为空字符串则使用原始bf16
+VLLM_QUANTIZATION = os.environ.get("VLLM_QUANTIZATION", "fp8") or None
+VLLM_KV_CACHE_DTYPE = os.environ.get("VLLM_KV_CACHE_DTYPE", "fp8_e5m2") or "auto"
+
+# 显存预算（A100-80GB + Llama-3.1-8B：bf16权重约16GB，FP8约8GB）
+GPU_MEMORY_GB = 80
+MODEL_WEIGHTS_GB = 8 if VLLM_QUANTIZATION == "fp8" else 16
+# 每token的KV大小：2(K+V) × 32层 × 8个KV头 × 128维 × 每元素字节数（bf16为2，FP8为1）
+KV_BYTES_PER_TOKEN = 2 * 32 * 8 * 128 * (1 if VLLM_KV_CACHE_DTYPE.startswith("fp8") else 2)
+KV_CACHE_BUDGET_GB = KV_BYTES_PER_TOKEN * VLLM_MAX_MODEL_LEN * VLLM_EXPECTED_CONCURRENCY / 1024**3
+# vLLM会把剩余显存全部分给KV cache，按实际并发只申请需要的部分（另留4GB给激活/CUDA graph）
+VLLM_GPU_MEMORY_UTILIZATION = float(os.environ.get(
+    "VLLM_GPU_MEMORY_UTILIZATION",
+    min(0.90, (MODEL_WEIGHTS_GB + KV_CACHE_BUDGET_GB + 4) / GPU_MEMORY_GB),
+))
+
+# 调度参数：max_num_batched_tokens限制每个step的GPU工作量，按P99 TTFT调优
+VLLM_MAX_NUM_SEQS = int(os.environ.get("VLLM_MAX_NUM_SEQS", "128"))
+VLLM_MAX_NUM_BATCHED_TOKENS = int(os.environ.get("VLLM_MAX_NUM_BATCHED_TOKENS", "8192"))
+# 分块prefill：长prompt与正在进行的decode共享step，避免新请求阻塞其他会话
+VLLM_ENABLE_CHUNKED_PREFILL = os.environ.get("VLLM_ENABLE_CHUNKED_PREFILL", "true").lower() == "true"
+VLLM_SWAP_SPACE_GB = int(os.environ.get("VLLM_SWAP_SPACE_GB", "4"))
+
+# GPU侧微批处理：攒够N个请求或等待M毫秒后合并为一次推理
+VLLM_BATCH_MAX_SIZE = int(os.environ.get("VLLM_BATCH_MAX_SIZE", "32"))
+VLLM_BATCH_WAIT_MS = int(os.environ.get("VLLM_BATCH_WAIT_MS", "10"))
+
+# 权重在构建镜像时写入此目录
+MODEL_DIR = f"/models/{VLLM_MODEL}"
+
+
+def download_model_weights():
+    """镜像构建阶段下载模型权重（hf-transfer加速）"""
+    from huggingface_hub import snapshot_download
+
+    snapshot_download(
+        VLLM_MODEL,
+        local_dir=MODEL_DIR,
+        ignore_patterns=["*.pth", "original/*"],  # 只需safetensors
+    )
+
 
 # ===== Modal 镜像 =====
 vllm_image = (
@@ -22,267 +77,362 @@ vllm_image = (
         "transformers==4.46.0",
         "hf-transfer",
     )
+    .env({
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",
+        # decode期间保持vLLM安静，避免stdout刷写和Modal日志上传拖慢生成循环
+        "VLLM_LOGGING_LEVEL": "WARNING",
+    })
+    # 构建镜像时下载权重，冷启动只需从本地磁盘加载
+    .run_function(
+        download_model_weights,
+        secrets=[modal.Secret.from_name("vllm-secrets")],
+    )
 )
 
 wrapper_image = (
     modal.Image.debian_slim(python_version="3.10")
     .pip_install(
+        # Modal自带ASGI运行时，无需uvicorn；保持wrapper镜像最小化
         "fastapi>=0.109.0",
-        "uvicorn[standard]>=0.27.0",
         "pydantic>=2.9",
+        "orjson>=3.9",
     )
+    .env({"LOG_LEVEL": "WARNING"})
 )
 
-weights_volume = modal.Volume.from_name("vllm-llama-cache", create_if_missing=True)
+# GPU容器日志：默认WARNING级别，直接输出（不缓冲，告警即时可见），不向根logger传播
+engine_logger = logging.getLogger("vllm-modal")
+engine_logger.setLevel(os.environ.get("VLLM_MODAL_LOG_LEVEL", "WARNING"))
+engine_logger.propagate = False
+engine_logger.addHandler(logging.StreamHandler())
 
 app = modal.App("vllm-autoscale-v2")
 
-# ===== vLLM 推理函数（使用全局模型）=====
-vllm_llm = None
-
-
-@app.function(
+# ===== vLLM 推理服务（容器启动时加载模型）=====
+@app.cls(
     image=vllm_image,
     gpu="A100-80GB",
-    volumes={"/weights": weights_volume},
     secrets=[modal.Secret.from_name("vllm-secrets")],
     scaledown_window=120,  # 2分钟后释放GPU
 )
-def generate_text(
-    messages: List[Dict[str, str]],
-    max_tokens: int = 2048,
-    temperature: float = 0.7,
-    top_p: float = 0.9,
-) -> Dict[str, Any]:
-    """
-    vLLM推理函数 - 自动缩放
-
-    Args:
-        messages: 对话历史
-        max_tokens: 最大token数
-        temperature: 温度参数
-        top_p: Top-p采样
-
-    Returns:
-        推理结果
-    """
-    global vllm_llm
+class VLLMService:
+    """vLLM推理服务 - 自动缩放到0"""
 
-    # 首次调用时初始化模型
-    if vllm_llm is None:
-        from vllm import LLM, SamplingParams
+    @modal.enter()
+    def setup(self):
+        """容器启动时初始化vLLM引擎，之后的调用无需再检查"""
+        from transformers import AutoTokenizer
+        from vllm import LLM
 
-        print(f"🚀 Loading model: {VLLM_MODEL}")
+        engine_logger.info("Loading model: %s", VLLM_MODEL)
 
-        vllm_llm = LLM(
-            model=VLLM_MODEL,
-            download_dir="/weights",
+        self.llm = LLM(
+            model=MODEL_DIR,
+            served_model_name=VLLM_MODEL,
             gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
             max_model_len=VLLM_MAX_MODEL_LEN,
             tensor_parallel_size=1,
+            dtype="auto",
+            quantization=VLLM_QUANTIZATION,
+            kv_cache_dtype=VLLM_KV_CACHE_DTYPE,
+            max_num_seqs=VLLM_MAX_NUM_SEQS,
+            max_num_batched_tokens=VLLM_MAX_NUM_BATCHED_TOKENS,
+            enable_chunked_prefill=VLLM_ENABLE_CHUNKED_PREFILL,
+            swap_space=VLLM_SWAP_SPACE_GB,
+            # 相同前缀（system prompt/历史对话）复用KV block，只prefill新增部分
+            enable_prefix_caching=True,
+            block_size=16,
         )
+        # 使用模型自带的chat template直接生成token id，vLLM无需再次分词
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
 
-        print(f"✅ Model loaded: {VLLM_MODEL}")
+        engine_logger.info("Model loaded: %s", VLLM_MODEL)
 
-    # 将消息转换为prompt
-    prompt = ""
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
+    @modal.exit()
+    def teardown(self):
+        """缩容前释放显存"""
+        import torch
 
-        if role == "system":
-            prompt += f"<|system|>\n{content}\n"
-        elif role == "user":
-            prompt += f"<|user|>\n{content}\n"
-        elif role == "assistant":
-            prompt += f"<|assistant|>\n{content}\n"
+        del self.llm
+        torch.cuda.empty_cache()
 
-    prompt += "<|assistant|>\n"
+    # Modal原生动态批处理：调用方逐条.remote()，Modal攒够N条或等待M毫秒后合并为一次调用
+    @modal.batched(max_batch_size=VLLM_BATCH_MAX_SIZE, wait_ms=VLLM_BATCH_WAIT_MS)
+    def generate(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        vLLM推理 - 自动缩放
 
-    # 推理
-    from vllm import SamplingParams
+        Modal合并后的一批请求整批交给llm.generate，由vLLM做连续批处理。
 
-    sampling_params = SamplingParams(
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-    )
+        Args:
+            requests: 请求列表，每项包含messages/max_tokens/temperature/top_p
+
+        Returns:
+            与请求顺序一一对应的推理结果列表
+        """
+        from vllm import SamplingParams
+
+        prompts = [
+            {
+                "prompt_token_ids": self.tokenizer.apply_chat_template(
+                    r["messages"], add_generation_prompt=True, tokenize=True
+                )
+            }
+            for r in requests
+        ]
+        params_list = [
+            SamplingParams(
+                max_tokens=r["max_tokens"],
+                temperature=r["temperature"],
+                top_p=r["top_p"],
+            )
+            for r in requests
+        ]
+
+        outputs = self.llm.generate(prompts, params_list)
+
+        return [
+            {
+                "text": output.outputs[0].text,
+                "prompt_tokens": len(output.prompt_token_ids),
+                "completion_tokens": len(output.outputs[0].token_ids),
+                "finish_reason": output.outputs[0].finish_reason,
+            }
+            for output in outputs
+        ]
+
+
+# ===== FastAPI Wrapper（永远在线）=====
+# 应用在模块导入时构建一次，wrapper()直接返回，不在函数体内重复定义模型和注册路由
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+vllm_service = VLLMService()
+
+# 在途请求去重：去重键 -> 共享的Future
+inflight_requests: Dict[str, asyncio.Future] = {}
+
+# FastAPI应用
+fastapi_app = FastAPI(
+    title="VLLM Auto-Scale Service V2",
+    description="使用函数式架构的自动缩放vLLM服务",
+    version="2.1.0",
+    # orjson序列化比标准库json快数倍，减轻wrapper的CPU开销
+    default_response_class=ORJSONResponse,
+)
+
+fastapi_app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+# 请求/响应模型
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    messages: List[Message]
+    max_tokens: Optional[int] = 2048
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+
+
+class ChatResponse(BaseModel):
+    content: str
+    model: str
+    usage: Dict[str, int]
+    finish_reason: Optional[str] = None
+
+
+class OpenAIChatRequest(BaseModel):
+    # 保留OpenAI SDK附带的其他字段（n、stop、user等）
+    model_config = ConfigDict(extra="allow")
+
+    model: Optional[str] = None
+    messages: List[Message]
+    max_tokens: int = 2048
+    temperature: float = 0.7
+    top_p: float = 0.9
+    stream: bool = False
+
+
+class HealthResponse(BaseModel):
+    status: str
+    wrapper_status: str
+    vllm_status: str
+    model: str
+    architecture: str
+
+
+def request_key(payload: Dict) -> str:
+    """对规范化后的请求参数计算哈希，作为去重键"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+async def submit_chat(messages, max_tokens, temperature, top_p) -> Dict:
+    """
+    提交单个对话请求，由Modal在GPU侧自动攒批
+
+    temperature为0时结果确定，相同的在途请求共享同一次GPU推理
+    """
+    payload = {
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+    }
+
+    key = request_key(payload) if temperature == 0 else None
+    if key is not None and key in inflight_requests:
+        # shield：某个调用方断开时不取消其他调用方共享的调用
+        return await asyncio.shield(inflight_requests[key])
+
+    call = asyncio.ensure_future(vllm_service.generate.remote.aio(payload))
+    if key is not None:
+        inflight_requests[key] = call
+        call.add_done_callback(lambda _: inflight_requests.pop(key, None))
 
-    outputs = vllm_llm.generate([prompt], sampling_params)
-    output = outputs[0]
+    return await asyncio.shield(call)
 
+
+# API端点
+@fastapi_app.get("/")
+async def root():
     return {
-        "text": output.outputs[0].text,
-        "prompt_tokens": len(output.prompt_token_ids),
-        "completion_tokens": len(output.outputs[0].token_ids),
-        "finish_reason": output.outputs[0].finish_reason,
+        "service": "VLLM Auto-Scale Service V2",
+        "version": "2.1.0",
+        "architecture": {
+            "wrapper": "Always-on (no GPU)",
+            "vllm": "Auto-scale function (with GPU)",
+            "scaledown_window": "2 minutes"
+        },
+        "model": VLLM_MODEL,
+        "endpoints": {
+            "POST /chat": "对话接口",
+            "POST /v1/chat/completions": "OpenAI兼容接口",
+            "GET /health": "健康检查",
+        }
     }
 
 
-# ===== FastAPI Wrapper（永远在线）=====
-@app.function(image=wrapper_image)
-@modal.asgi_app()
-def wrapper():
-    """FastAPI Wrapper - 永远在线"""
-    from fastapi import FastAPI, HTTPException, status
-    from fastapi.middleware.cors import CORSMiddleware
-    from pydantic import BaseModel, Field
-    from typing import List, Dict, Optional
-    import logging
-
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    # FastAPI应用
-    fastapi_app = FastAPI(
-        title="VLLM Auto-Scale Service V2",
-        description="使用函数式架构的自动缩放vLLM服务",
-        version="2.1.0",
+@fastapi_app.get("/health", response_model=HealthResponse)
+async def health():
+    return HealthResponse(
+        status="healthy",
+        wrapper_status="running",
+        vllm_status="auto-scaling (idle or active)",
+        model=VLLM_MODEL,
+        architecture="separated-function"
     )
 
-    fastapi_app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
 
-    # 请求/响应模型
-    class Message(BaseModel):
-        role: str
-        content: str
-
-    class ChatRequest(BaseModel):
-        messages: List[Message]
-        max_tokens: Optional[int] = 2048
-        temperature: Optional[float] = 0.7
-        top_p: Optional[float] = 0.9
-
-    class ChatResponse(BaseModel):
-        content: str
-        model: str
-        usage: Dict[str, int]
-        finish_reason: Optional[str] = None
-
-    class HealthResponse(BaseModel):
-        status: str
-        wrapper_status: str
-        vllm_status: str
-        model: str
-        architecture: str
-
-    # API端点
-    @fastapi_app.get("/")
-    async def root():
-        return {
-            "service": "VLLM Auto-Scale Service V2",
-            "version": "2.1.0",
-            "architecture": {
-                "wrapper": "Always-on (no GPU)",
-                "vllm": "Auto-scale function (with GPU)",
-                "scaledown_window": "2 minutes"
-            },
-            "model": VLLM_MODEL,
-            "endpoints": {
-                "POST /chat": "对话接口",
-                "POST /v1/chat/completions": "OpenAI兼容接口",
-                "GET /health": "健康检查",
-            }
-        }
+@fastapi_app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """对话接口"""
+    try:
+        logger.info("收到对话请求，%d条消息", len(request.messages))
+
+        # 转换消息（model_dump在pydantic-core中一次性完成转换）
+        messages_dict = request.model_dump(include={"messages"})["messages"]
 
-    @fastapi_app.get("/health", response_model=HealthResponse)
-    async def health():
-        return HealthResponse(
-            status="healthy",
-            wrapper_status="running",
-            vllm_status="auto-scaling (idle or active)",
+        logger.info("调用vLLM推理函数...")
+
+        # 逐条调用GPU方法，由Modal原生批处理（@modal.batched）合并
+        result = await submit_chat(
+            messages=messages_dict,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p,
+        )
+
+        logger.info("推理完成")
+
+        return ChatResponse(
+            content=result["text"],
             model=VLLM_MODEL,
-            architecture="separated-function"
+            usage={
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+            },
+            finish_reason=result["finish_reason"],
         )
 
-    @fastapi_app.post("/chat", response_model=ChatResponse)
-    async def chat(request: ChatRequest):
-        """对话接口"""
-        try:
-            logger.info(f"收到对话请求，{len(request.messages)}条消息")
+    except Exception as e:
+        logger.error("推理失败: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"推理失败: {str(e)}"
+        )
 
-            # 转换消息
-            messages_dict = [{"role": m.role, "content": m.content} for m in request.messages]
 
-            logger.info("调用vLLM推理函数...")
+@fastapi_app.post("/v1/chat/completions")
+async def openai_chat(request: OpenAIChatRequest):
+    """OpenAI兼容接口"""
+    if request.stream:
+        # V2通过Modal RPC整批返回结果，无法逐token输出
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="V2不支持stream=true，请使用modal_vllm_autoscale.py部署的流式接口"
+        )
 
-            # 调用Modal函数
-            result = generate_text.remote(
-                messages=messages_dict,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-            )
+    try:
+        messages = request.model_dump(include={"messages"})["messages"]
 
-            logger.info("推理完成")
+        # 逐条调用GPU方法，由Modal原生批处理（@modal.batched）合并
+        result = await submit_chat(
+            messages=messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p,
+        )
 
-            return ChatResponse(
-                content=result["text"],
-                model=VLLM_MODEL,
-                usage={
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+        return {
+            "id": "chatcmpl-vllm",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": VLLM_MODEL,
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": result["text"],
                 },
-                finish_reason=result["finish_reason"],
-            )
+                "finish_reason": result["finish_reason"],
+            }],
+            "usage": {
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+            }
+        }
 
-        except Exception as e:
-            logger.error(f"推理失败: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
-            )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"推理失败: {str(e)}"
+        )
 
-    @fastapi_app.post("/v1/chat/completions")
-    async def openai_chat(request: Dict):
-        """OpenAI兼容接口"""
-        try:
-            messages = request.get("messages", [])
-            max_tokens = request.get("max_tokens", 2048)
-            temperature = request.get("temperature", 0.7)
-            top_p = request.get("top_p", 0.9)
-
-            # 调用Modal函数
-            result = generate_text.remote(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-            )
 
-            return {
-                "id": "chatcmpl-vllm",
-                "object": "chat.completion",
-                "created": int(__import__("time").time()),
-                "model": VLLM_MODEL,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": result["text"],
-                    },
-                    "finish_reason": result["finish_reason"],
-                }],
-                "usage": {
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
-                }
-            }
+# 预先生成OpenAPI schema，避免首个/docs请求时再构建
+fastapi_app.openapi()
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
-            )
 
+@app.function(image=wrapper_image)
+# wrapper只做I/O转发，单容器即可承载大量并发连接
+@modal.concurrent(max_inputs=1000)
+@modal.asgi_app()
+def wrapper():
+    """FastAPI Wrapper - 永远在线"""
     return fastapi_app
 
 
@@ -3,10 +3,14 @@ Modal 集成部署：vLLM + FastAPI Wrapper
 
 将vLLM服务器和FastAPI包装层部署在同一个容器中，
 避免冷启动问题，保持服务持续运行。
+
+两个入口：
+- serve_vllm: 直接暴露vLLM的OpenAI兼容服务器（无代理，流式首token最快）
+- serve: vLLM + FastAPI Wrapper（提供简化的 /chat 接口和wrapper层认证）
 """
 import os
+import shutil
 import subprocess
-import time
 import signal
 from pathlib import Path
 import modal
@@ -18,6 +22,8 @@ VLLM_PORT = 8000
 VLLM_MAX_MODEL_LEN = os.environ.get("VLLM_MAX_MODEL_LEN", "8192")
 VLLM_GPU_MEMORY_UTILIZATION = os.environ.get("VLLM_GPU_MEMORY_UTILIZATION", "0.90")
 VLLM_TENSOR_PARALLEL = int(os.environ.get("VLLM_TENSOR_PARALLEL", "1"))  # 8B模型单GPU即可
+# 分块prefill：长prompt切成调度块，与正在进行的decode共享step，避免其他会话停顿
+VLLM_MAX_NUM_BATCHED_TOKENS = os.environ.get("VLLM_MAX_NUM_BATCHED_TOKENS", "8192")
 
 # FastAPI Wrapper 配置
 WRAPPER_PORT = 8001
@@ -29,11 +35,27 @@ GPU_COUNT = int(os.environ.get("VLLM_GPU_COUNT", "1"))  # 8B模型单GPU足够
 # 超时配置
 CONTAINER_IDLE_TIMEOUT = 30 * 60  # 30分钟无请求后休眠
 
+# 模型缓存卷
+weights_volume = modal.Volume.from_name("vllm-llama70b-cache", create_if_missing=True)
+
+
+def download_model_weights():
+    """镜像构建阶段把权重下载到持久卷（与vLLM的download_dir使用相同的HF缓存布局）"""
+    from huggingface_hub import snapshot_download
+
+    snapshot_download(
+        VLLM_MODEL,
+        cache_dir="/weights",
+        ignore_patterns=["*.pth", "original/*"],  # 只需safetensors
+        max_workers=8,
+    )
+
+
 # ===== Modal 镜像 =====
 # 集成镜像：包含vLLM和FastAPI依赖
 integrated_image = (
     modal.Image.debian_slim(python_version="3.10")
-    .apt_install("git", "curl")
+    .apt_install("git", "curl", "numactl")
     .pip_install(
         # vLLM 依赖 (vllm requires pydantic>=2.9)
         "vllm==0.6.6.post1",
@@ -47,28 +69,41 @@ integrated_image = (
         "openai>=1.54.0",
         "httpx>=0.27.0",
     )
+    .env({
+        # hf-transfer多连接并行下载，vLLM子进程继承该环境变量
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",
+        # tokenizer/config也缓存到持久卷，而不是容器的临时文件系统
+        "HF_HOME": "/weights/hf",
+    })
+    # 构建镜像时预下载权重，冷启动只剩引擎初始化和CUDA graph捕获
+    .run_function(
+        download_model_weights,
+        secrets=[modal.Secret.from_name("vllm-secrets")],
+        volumes={"/weights": weights_volume},
+    )
 )
 
-# 模型缓存卷
-weights_volume = modal.Volume.from_name("vllm-llama70b-cache", create_if_missing=True)
-
 # Modal App
 app = modal.App("vllm-integrated")
 
 
 # ===== FastAPI Wrapper 代码（内联版本）=====
 WRAPPER_CODE = """
+import asyncio
 import os
+import json
 import logging
+import time
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Header, status
+import httpx
+from fastapi import FastAPI, HTTPException, Header, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from openai import AsyncOpenAI, OpenAIError
-import uvicorn
+from starlette.background import BackgroundTask
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -83,6 +118,19 @@ SERVICE_API_KEY = os.getenv("VLLM_WRAPPER_API_KEY", "")
 DEFAULT_MAX_TOKENS = 2048
 DEFAULT_TEMPERATURE = 0.7
 
+# vLLM启动等待：后台轮询的总时长上限，以及单个请求等待就绪的最长时间
+STARTUP_MAX_WAIT = 300.0
+READY_WAIT_TIMEOUT = 30.0
+
+# /health 结果缓存时间：负载均衡探针密集时不必每次都打到vLLM
+HEALTH_CACHE_TTL = 5.0
+
+# 同时转发到vLLM的请求上限，与serve()的 @modal.concurrent(max_inputs=100) 一致
+MAX_INFLIGHT_REQUESTS = int(os.getenv("VLLM_WRAPPER_MAX_INFLIGHT", "100"))
+
+# SSE响应头：禁止代理/网关缓冲，保证每个token帧立即送达客户端
+SSE_HEADERS = {"X-Accel-Buffering": "no", "Cache-Control": "no-cache"}
+
 # ===== 请求/响应模型 =====
 class Message(BaseModel):
     role: str = Field(..., description="角色: user, assistant, system")
@@ -110,10 +158,22 @@ class HealthResponse(BaseModel):
 # ===== VLLM 客户端 =====
 class VLLMClient:
     def __init__(self):
+        # 共享连接池：OpenAI SDK与原始流式转发复用同一组keep-alive连接
+        # 连接池大于并发上限，避免请求在pool上排队；read超时覆盖长文本生成
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=512, max_keepalive_connections=256),
+            timeout=httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=5.0),
+        )
+        # 限制在途请求数，超出部分在wrapper内等待，而不是无限堆到vLLM队列
+        self.semaphore = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+        self.headers = {
+            "Authorization": f"Bearer {VLLM_API_KEY or 'EMPTY'}",
+            "Content-Type": "application/json",
+        }
         self.client = AsyncOpenAI(
             base_url=VLLM_BASE_URL,
             api_key=VLLM_API_KEY or "EMPTY",
-            timeout=120.0
+            http_client=self.http_client,
         )
         self.model = VLLM_MODEL
         logger.info(f"初始化VLLM客户端: {VLLM_BASE_URL}, 模型: {self.model}")
@@ -127,7 +187,7 @@ class VLLMClient:
             logger.error(f"VLLM健康检查失败: {e}")
             return False
 
-    async def chat(
+    def build_params(
         self,
         messages: List[Dict[str, str]],
         max_tokens: Optional[int] = None,
@@ -135,7 +195,7 @@ class VLLMClient:
         top_p: Optional[float] = None,
         stream: bool = False,
         model: Optional[str] = None,
-    ):
+    ) -> Dict[str, Any]:
         params = {
             "model": model or self.model,
             "messages": messages,
@@ -145,10 +205,51 @@ class VLLMClient:
         }
         if top_p is not None:
             params["top_p"] = top_p
+        return params
+
+    async def open_stream(self, body: bytes):
+        # 发起流式请求并先拿到上游状态码，再决定返回SSE还是错误响应
+        # 返回 (upstream, release)：release 幂等，负责关闭连接并归还并发名额
+        await self.semaphore.acquire()
+        try:
+            upstream = await self.http_client.send(
+                self.http_client.build_request(
+                    "POST", f"{VLLM_BASE_URL}/chat/completions", content=body, headers=self.headers
+                ),
+                stream=True,
+            )
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        released = False
+
+        async def release():
+            nonlocal released
+            if not released:
+                released = True
+                await upstream.aclose()
+                self.semaphore.release()
+
+        if upstream.status_code != 200:
+            await upstream.aread()
+            await release()
+        return upstream, release
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        model: Optional[str] = None,
+    ):
+        # 仅用于非流式请求；流式请求走 open_stream 原样转发字节
+        params = self.build_params(messages, max_tokens, temperature, top_p, False, model)
 
         try:
-            response = await self.client.chat.completions.create(**params)
-            return response
+            async with self.semaphore:
+                return await self.client.chat.completions.create(**params)
         except OpenAIError as e:
             logger.error(f"VLLM请求失败: {e}")
             raise HTTPException(
@@ -159,28 +260,72 @@ class VLLMClient:
 # ===== FastAPI 应用 =====
 vllm_client: Optional[VLLMClient] = None
 
+# 最近一次vLLM健康检查结果及时间（time.monotonic）
+last_health_ok = False
+last_health_ts = float("-inf")
+health_lock = asyncio.Lock()
+
+# 后台轮询vLLM就绪状态（指数退避），就绪后设置 app.state.ready，超时则设置 app.state.failed
+# /v1/models 在模型加载完成后才返回数据。可选钩子由启动方设置：
+# app.state.on_ready（就绪后调用）、app.state.on_startup_failed（超时后调用）
+async def wait_for_vllm(app: FastAPI):
+    waited = 0.0
+    delay = 0.25  # 0.25s起步，最长4s
+    next_log = 30.0
+
+    while waited < STARTUP_MAX_WAIT:
+        try:
+            response = await vllm_client.http_client.get(
+                f"{VLLM_BASE_URL}/models", headers=vllm_client.headers, timeout=2.0
+            )
+            if response.status_code == 200 and response.json().get("data"):
+                logger.info(f"✅ VLLM 连接成功 ({waited:.1f}s)")
+                app.state.ready.set()
+                on_ready = getattr(app.state, "on_ready", None)
+                if on_ready:
+                    await asyncio.to_thread(on_ready)
+                return
+        except Exception:
+            pass
+
+        await asyncio.sleep(delay)
+        waited += delay
+        delay = min(delay * 1.5, 4.0)
+        if waited >= next_log:
+            logger.info(f"等待vLLM启动... ({waited:.0f}s / {STARTUP_MAX_WAIT:.0f}s)")
+            next_log += 30
+
+    logger.error("❌ VLLM 启动超时")
+    app.state.failed = True
+    on_startup_failed = getattr(app.state, "on_startup_failed", None)
+    if on_startup_failed:
+        on_startup_failed()
+
+# 等待vLLM就绪（最多 READY_WAIT_TIMEOUT 秒），超时返回503
+async def ensure_ready():
+    if app.state.ready.is_set():
+        return
+    if app.state.failed:
+        raise HTTPException(status_code=503, detail="VLLM服务启动失败")
+    try:
+        await asyncio.wait_for(app.state.ready.wait(), timeout=READY_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="VLLM服务启动中，请稍后重试")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global vllm_client
     logger.info("🚀 VLLM Wrapper 服务启动")
 
-    # 等待vLLM服务就绪
-    import asyncio
-    max_retries = 30
-    for i in range(max_retries):
-        try:
-            vllm_client = VLLMClient()
-            if await vllm_client.health_check():
-                logger.info("✅ VLLM 连接成功")
-                break
-        except Exception as e:
-            if i < max_retries - 1:
-                logger.info(f"等待vLLM启动... ({i+1}/{max_retries})")
-                await asyncio.sleep(2)
-            else:
-                logger.warning("⚠️ VLLM 连接失败")
+    # 不阻塞启动：应用立即开始接收请求，vLLM就绪前请求在ensure_ready()中等待
+    vllm_client = VLLMClient()
+    app.state.ready = asyncio.Event()
+    app.state.failed = False
+    ready_task = asyncio.create_task(wait_for_vllm(app))
 
     yield
+    ready_task.cancel()
+    await vllm_client.http_client.aclose()
     logger.info("👋 VLLM Wrapper 服务关闭")
 
 app = FastAPI(
@@ -233,14 +378,27 @@ async def root():
 
 @app.get("/health", response_model=HealthResponse)
 async def health():
-    if not vllm_client:
+    if app.state.failed:
+        return HealthResponse(
+            status="unhealthy",
+            vllm_available=False,
+            model=VLLM_MODEL
+        )
+    if not vllm_client or not app.state.ready.is_set():
         return HealthResponse(
             status="starting",
             vllm_available=False,
             model=VLLM_MODEL
         )
 
-    is_healthy = await vllm_client.health_check()
+    global last_health_ok, last_health_ts
+    # 并发探针只有一个真正访问vLLM，其余在锁上等待后直接使用缓存结果
+    async with health_lock:
+        if time.monotonic() - last_health_ts >= HEALTH_CACHE_TTL:
+            last_health_ok = await vllm_client.health_check()
+            last_health_ts = time.monotonic()
+        is_healthy = last_health_ok
+
     return HealthResponse(
         status="healthy" if is_healthy else "degraded",
         vllm_available=is_healthy,
@@ -251,6 +409,7 @@ async def health():
 async def list_models():
     if not vllm_client:
         raise HTTPException(status_code=503, detail="VLLM客户端未初始化")
+    await ensure_ready()
 
     try:
         models = await vllm_client.client.models.list()
@@ -262,36 +421,48 @@ async def list_models():
 async def chat(request: ChatRequest):
     if not vllm_client:
         raise HTTPException(status_code=503, detail="VLLM客户端未初始化")
+    await ensure_ready()
 
     messages = [{"role": m.role, "content": m.content} for m in request.messages]
 
     if request.stream:
+        params = vllm_client.build_params(
+            messages, request.max_tokens, request.temperature, request.top_p, True, request.model
+        )
+        upstream, release = await vllm_client.open_stream(json.dumps(params).encode())
+        if upstream.status_code != 200:
+            raise HTTPException(status_code=503, detail=f"VLLM服务调用失败: {upstream.text}")
+
+        # 直接解析vLLM的SSE行，只取增量文本，不构造OpenAI SDK的pydantic对象
         async def generate():
             try:
-                stream = await vllm_client.chat(
-                    messages=messages,
-                    max_tokens=request.max_tokens,
-                    temperature=request.temperature,
-                    top_p=request.top_p,
-                    stream=True,
-                    model=request.model
-                )
-                async for chunk in stream:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        yield f"data: {chunk.choices[0].delta.content}\\n\\n"
-                yield "data: [DONE]\\n\\n"
+                async for line in upstream.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    choices = json.loads(line[6:]).get("choices")
+                    content = choices[0].get("delta", {}).get("content") if choices else None
+                    if content:
+                        delta = json.dumps({"content": content}, ensure_ascii=False)
+                        yield f"data: {delta}\\n\\n".encode()
+                yield b"data: [DONE]\\n\\n"
             except Exception as e:
                 logger.error(f"流式响应错误: {e}")
-                yield f"data: [ERROR] {str(e)}\\n\\n"
-
-        return StreamingResponse(generate(), media_type="text/event-stream")
+                yield f"data: [ERROR] {str(e)}\\n\\n".encode()
+            finally:
+                await release()
+
+        return StreamingResponse(
+            generate(),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+            background=BackgroundTask(release),
+        )
 
     response = await vllm_client.chat(
         messages=messages,
         max_tokens=request.max_tokens,
         temperature=request.temperature,
         top_p=request.top_p,
-        stream=False,
         model=request.model
     )
 
@@ -304,34 +475,70 @@ async def chat(request: ChatRequest):
     )
 
 @app.post("/v1/chat/completions")
-async def openai_compatible_chat(request: Dict[str, Any]):
+async def openai_compatible_chat(request: Request):
     if not vllm_client:
         raise HTTPException(status_code=503, detail="VLLM客户端未初始化")
+    await ensure_ready()
 
+    # 直接读取原始请求体，跳过FastAPI的Dict解析；只有需要补全默认参数时才重新序列化
+    body = await request.body()
     try:
-        stream = request.get("stream", False)
-        response = await vllm_client.chat(
-            messages=request.get("messages", []),
-            max_tokens=request.get("max_tokens"),
-            temperature=request.get("temperature"),
-            top_p=request.get("top_p"),
-            stream=stream,
-            model=request.get("model")
-        )
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是合法的JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="请求体必须是JSON对象")
+
+    defaults = {
+        "model": VLLM_MODEL,
+        "max_tokens": DEFAULT_MAX_TOKENS,
+        "temperature": DEFAULT_TEMPERATURE,
+    }
+    missing = {k: v for k, v in defaults.items() if payload.get(k) is None}
+    if missing:
+        payload.update(missing)
+        body = json.dumps(payload, ensure_ascii=False).encode()
 
-        if stream:
+    try:
+        if payload.get("stream", False):
+            upstream, release = await vllm_client.open_stream(body)
+            if upstream.status_code != 200:
+                # 参数错误等由vLLM返回的错误按原状态码和错误体透传
+                return Response(
+                    content=upstream.content,
+                    status_code=upstream.status_code,
+                    media_type="application/json",
+                )
+
+            # vLLM的SSE已是OpenAI格式，原样转发原始字节，不再逐chunk解析和重新序列化
             async def generate():
                 try:
-                    async for chunk in response:
-                        import json
-                        yield f"data: {json.dumps(chunk.model_dump())}\\n\\n"
-                    yield "data: [DONE]\\n\\n"
+                    async for chunk in upstream.aiter_raw():
+                        yield chunk
                 except Exception as e:
                     logger.error(f"流式响应错误: {e}")
+                finally:
+                    await release()
+
+            # background兜底：客户端在流开始前断开时生成器不会执行finally
+            return StreamingResponse(
+                generate(),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS,
+                background=BackgroundTask(release),
+            )
 
-            return StreamingResponse(generate(), media_type="text/event-stream")
+        # 非流式同样透传字节，不经过OpenAI SDK的pydantic对象
+        async with vllm_client.semaphore:
+            upstream = await vllm_client.http_client.post(
+                f"{VLLM_BASE_URL}/chat/completions", content=body, headers=vllm_client.headers
+            )
 
-        return response.model_dump()
+        return Response(
+            content=upstream.content,
+            status_code=upstream.status_code,
+            media_type="application/json",
+        )
 
     except HTTPException:
         raise
@@ -341,31 +548,35 @@ async def openai_compatible_chat(request: Dict[str, Any]):
 """
 
 
-@app.function(
-    image=integrated_image,
-    gpu="A100-80GB",  # 单个A100 GPU for 8B model
-    timeout=24 * 3600,  # 24小时超时
-    scaledown_window=CONTAINER_IDLE_TIMEOUT,  # 30分钟无请求后休眠
-    volumes={"/weights": weights_volume},
-    secrets=[modal.Secret.from_name("vllm-secrets")],
-)
-@modal.concurrent(max_inputs=100)
-@modal.asgi_app()
-def serve():
-    """
-    启动集成服务：在同一个容器中运行vLLM和FastAPI Wrapper
-
-    架构：
-    1. 后台启动vLLM服务器 (localhost:8000)
-    2. 启动FastAPI Wrapper (监听外部请求)
-    3. FastAPI通过localhost调用vLLM，无网络延迟
-    """
-    import sys
-    import logging
-
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
+def numa_bind_prefix(logger):
+    """返回把vLLM绑定到GPU0所在NUMA节点的numactl前缀；环境不支持时返回空列表"""
+    if shutil.which("numactl") is None:
+        return []
 
+    node = 0
+    try:
+        # nvidia-smi输出 00000000:17:00.0，sysfs路径为 0000:17:00.0
+        bus_id = subprocess.run(
+            ["nvidia-smi", "--query-gpu=pci.bus_id", "--format=csv,noheader", "-i", "0"],
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+        numa_node = Path(f"/sys/bus/pci/devices/{bus_id[-12:].lower()}/numa_node")
+        node = max(int(numa_node.read_text()), 0)  # 单NUMA节点机器上为-1
+    except Exception:
+        pass
+
+    prefix = ["numactl", f"--cpunodebind={node}", f"--membind={node}"]
+    # 沙箱可能不支持NUMA系统调用，先试运行一次，失败则不绑定
+    if subprocess.run(prefix + ["true"], capture_output=True).returncode != 0:
+        logger.info("ℹ️  当前环境不支持NUMA绑定，跳过")
+        return []
+
+    logger.info(f"📌 vLLM绑定到NUMA节点 {node}（GPU0本地）")
+    return prefix
+
+
+def start_vllm_server(logger):
+    """在后台启动vLLM OpenAI兼容服务器，返回子进程"""
     # 准备环境变量
     env = os.environ.copy()
     hf_token = env.get("HUGGING_FACE_HUB_TOKEN") or env.get("HF_TOKEN")
@@ -375,7 +586,12 @@ def serve():
     # 设置vLLM模型环境变量供wrapper使用
     env["VLLM_MODEL"] = VLLM_MODEL
 
-    # 1. 在后台启动vLLM服务器
+    # 多GPU tensor parallel初始化：spawn启动worker避免fork后复用CUDA上下文；NCCL走NVLink点对点
+    env["VLLM_WORKER_MULTIPROC_METHOD"] = "spawn"
+    env["NCCL_P2P_LEVEL"] = "NVL"
+    env["NCCL_SHM_DISABLE"] = "0"
+    env["TORCH_NCCL_ASYNC_ERROR_HANDLING"] = "1"
+
     logger.info("=" * 60)
     logger.info("🚀 启动集成服务")
     logger.info("=" * 60)
@@ -385,7 +601,7 @@ def serve():
     logger.info(f"🔧 显存利用率: {VLLM_GPU_MEMORY_UTILIZATION}")
     logger.info("=" * 60)
 
-    vllm_command = [
+    vllm_command = numa_bind_prefix(logger) + [
         "python3", "-m", "vllm.entrypoints.openai.api_server",
         "--model", VLLM_MODEL,
         "--port", str(VLLM_PORT),
@@ -394,6 +610,8 @@ def serve():
         "--tensor-parallel-size", str(VLLM_TENSOR_PARALLEL),
         "--gpu-memory-utilization", str(VLLM_GPU_MEMORY_UTILIZATION),
         "--max-model-len", str(VLLM_MAX_MODEL_LEN),
+        "--enable-chunked-prefill",
+        "--max-num-batched-tokens", str(VLLM_MAX_NUM_BATCHED_TOKENS),
     ]
 
     # 添加API Key（如果配置了）
@@ -403,54 +621,74 @@ def serve():
 
     logger.info(f"🔨 启动vLLM服务器: {' '.join(vllm_command)}")
 
-    # 后台启动vLLM
+    # 后台启动vLLM：直接继承容器的stdout，由Modal日志采集读取，不经过Python线程转发
     vllm_process = subprocess.Popen(
         vllm_command,
         env=env,
-        stdout=subprocess.PIPE,
+        stdout=None,
         stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
     )
 
-    # 2. 等待vLLM服务器就绪
-    logger.info("⏳ 等待vLLM服务器启动...")
-    max_wait = 300  # 5分钟
-    waited = 0
-    vllm_ready = False
+    return vllm_process
 
-    # 在后台线程中读取vLLM输出
-    import threading
-    def log_vllm_output():
-        for line in vllm_process.stdout:
-            print(f"[vLLM] {line.rstrip()}", flush=True)
 
-    log_thread = threading.Thread(target=log_vllm_output, daemon=True)
-    log_thread.start()
+@app.function(
+    image=integrated_image,
+    gpu="A100-80GB",  # 单个A100 GPU for 8B model
+    timeout=24 * 3600,  # 24小时超时
+    scaledown_window=CONTAINER_IDLE_TIMEOUT,  # 30分钟无请求后休眠
+    volumes={"/weights": weights_volume},
+    secrets=[modal.Secret.from_name("vllm-secrets")],
+)
+# vLLM服务器自身做连续批处理：每容器目标64个并发，突发时最多256个
+@modal.concurrent(max_inputs=256, target_inputs=64)
+@modal.web_server(port=VLLM_PORT, startup_timeout=300)
+def serve_vllm():
+    """
+    直接暴露vLLM的OpenAI兼容服务器（推荐给OpenAI客户端使用）
 
-    # 检查vLLM是否就绪
-    while waited < max_wait:
-        try:
-            import httpx
-            response = httpx.get(f"http://localhost:{VLLM_PORT}/health", timeout=5.0)
-            if response.status_code == 200:
-                vllm_ready = True
-                logger.info("✅ vLLM服务器已就绪")
-                break
-        except Exception:
-            pass
+    不经过wrapper代理，省去每个请求/流式chunk的一次JSON解析+序列化和pydantic校验，
+    token直接从vLLM流向客户端。Bearer认证由vLLM的 --api-key 负责
+    （Secret中的 VLLM_SERVER_API_KEY）。Modal在端口可连接后才开始转发请求。
+    """
+    import logging
 
-        time.sleep(5)
-        waited += 5
-        if waited % 30 == 0:
-            logger.info(f"   仍在等待... ({waited}s / {max_wait}s)")
+    logging.basicConfig(level=logging.INFO)
+    start_vllm_server(logging.getLogger(__name__))
 
-    if not vllm_ready:
-        logger.error("❌ vLLM服务器启动超时")
-        vllm_process.kill()
-        raise RuntimeError("vLLM服务器启动失败")
 
-    # 3. 创建并返回FastAPI应用
+@app.function(
+    image=integrated_image,
+    gpu="A100-80GB",  # 单个A100 GPU for 8B model
+    timeout=24 * 3600,  # 24小时超时
+    scaledown_window=CONTAINER_IDLE_TIMEOUT,  # 30分钟无请求后休眠
+    volumes={"/weights": weights_volume},
+    secrets=[modal.Secret.from_name("vllm-secrets")],
+)
+@modal.concurrent(max_inputs=100)
+@modal.asgi_app()
+def serve():
+    """
+    启动集成服务：在同一个容器中运行vLLM和FastAPI Wrapper
+
+    架构：
+    1. 后台启动vLLM服务器 (localhost:8000)
+    2. 启动FastAPI Wrapper (监听外部请求)
+    3. FastAPI通过localhost调用vLLM，无网络延迟
+
+    仅在需要简化的 /chat 接口或wrapper层API Key时使用；
+    OpenAI兼容客户端请直接使用 serve_vllm。
+    """
+    import sys
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    # 1. 在后台启动vLLM服务器
+    vllm_process = start_vllm_server(logger)
+
+    # 2. 立即创建并返回FastAPI应用，vLLM就绪检查在wrapper的lifespan中并发进行
     logger.info("🌐 启动FastAPI Wrapper...")
 
     # 将wrapper代码写入临时文件
@@ -461,6 +699,16 @@ def serve():
     sys.path.insert(0, "/tmp")
     from wrapper_app import app as fastapi_app
 
+    def fail_container():
+        # 启动超时：结束vLLM进程并让容器退出，由Modal回收并换一个新容器，
+        # 而不是留下一个永远无法就绪的wrapper
+        vllm_process.kill()
+        os._exit(1)
+
+    # 就绪后持久化首次下载的权重；启动超时则让容器失败
+    fastapi_app.state.on_ready = weights_volume.commit
+    fastapi_app.state.on_startup_failed = fail_container
+
     logger.info("=" * 60)
     logger.info("✅ 集成服务启动完成！")
     logger.info("=" * 60)
@@ -502,6 +750,10 @@ def main():
     print("   ✓ 统一管理和部署")
     print()
     print("📡 部署后的端点:")
+    print("   serve_vllm（vLLM直连，推荐OpenAI客户端使用）:")
+    print("   - POST /v1/chat/completions - OpenAI兼容接口（无代理开销）")
+    print("   - GET /v1/models - 列出模型")
+    print("   serve（FastAPI Wrapper）:")
     print("   - POST /v1/chat/completions - OpenAI兼容接口")
     print("   - POST /chat - 简化对话接口")
     print("   - GET /health - 健康检查")
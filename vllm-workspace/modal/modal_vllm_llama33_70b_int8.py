@@ -1,24 +1,60 @@
 """
-Modal 部署：Llama 3.3 70B (BF16/FP16) + Tensor Parallelism
+Modal 部署：Llama 3.3 70B (FP8) + Tensor Parallelism
 
 使用Tensor Parallelism，2个A100-80GB运行
-显存需求：每个GPU ~70GB（总共140GB分布式）
-性能损失：0%（原始精度）
+显存需求：FP8权重每个GPU ~35GB（BF16为~70GB），其余留给KV缓存
+性能损失：FP8在Llama-3.3-70B上近乎无损（vLLM公开评测），decode带宽减半
 
 配置：
 - 2个A100-80GB GPU (tensor_parallel_size=2)
-- max_model_len=4096 (充足的context窗口)
+- quantization=fp8 + kv_cache_dtype=fp8_e5m2（VLLM_QUANTIZATION=""回退到BF16/FP16）
+- max_model_len=8192 (FP8 KV缓存减半，context翻倍；BF16下为4096)
 - gpu_memory_utilization=0.90 (每个GPU分担一半负载)
-- dtype=auto (BF16或FP16)
+- AsyncLLMEngine + ASGI同容器：并发HTTP请求直接进入vLLM连续批处理
 """
+import asyncio
+import hashlib
+import json
 import os
 import modal
 from typing import List, Dict, Any, Optional
 
 # ===== 配置 =====
 VLLM_MODEL = os.environ.get("VLLM_MODEL", "meta-llama/Llama-3.3-70B-Instruct")
-VLLM_MAX_MODEL_LEN = 4096  # 使用2个GPU后可以提高context
-VLLM_GPU_MEMORY_UTILIZATION = 0.90  # 2个GPU分担负载
+
+# 量化：FP8权重（A100上走Marlin W8A16 kernel）+ FP8 KV cache，权重显存和带宽减半
+# 设置为空字符串则回退到原始精度（dtype=auto，BF16/FP16）
+VLLM_QUANTIZATION = os.environ.get("VLLM_QUANTIZATION", "fp8") or None
+VLLM_KV_CACHE_DTYPE = os.environ.get("VLLM_KV_CACHE_DTYPE", "fp8_e5m2") or "auto"
+PRECISION = "FP8 (weights + KV cache)" if VLLM_QUANTIZATION == "fp8" else "BF16/FP16 (auto)"
+
+# FP8下权重~70GB，单卡A100-80GB勉强装下但KV空间很小；默认2卡换取并发和长context
+VLLM_GPU_COUNT = int(os.environ.get("VLLM_GPU_COUNT", "2"))
+VLLM_MAX_MODEL_LEN = int(os.environ.get(
+    "VLLM_MAX_MODEL_LEN", "8192" if VLLM_QUANTIZATION == "fp8" else "4096"
+))
+VLLM_GPU_MEMORY_UTILIZATION = float(os.environ.get(
+    "VLLM_GPU_MEMORY_UTILIZATION", "0.92" if VLLM_GPU_COUNT == 1 else "0.90"
+))
+
+# 调度参数：分块prefill让长prompt与正在进行的decode共享step，避免新请求卡住其他会话
+VLLM_MAX_NUM_SEQS = int(os.environ.get("VLLM_MAX_NUM_SEQS", "64"))
+VLLM_MAX_NUM_BATCHED_TOKENS = int(os.environ.get("VLLM_MAX_NUM_BATCHED_TOKENS", "8192"))
+
+weights_volume = modal.Volume.from_name("vllm-llama33-70b-int8", create_if_missing=True)
+
+
+def download_model_weights():
+    """镜像构建阶段把权重下载到持久卷（与vLLM的download_dir使用相同的HF缓存布局）"""
+    from huggingface_hub import snapshot_download
+
+    snapshot_download(
+        VLLM_MODEL,
+        cache_dir="/weights",
+        ignore_patterns=["*.pth", "original/*"],  # 只需safetensors
+        max_workers=8,
+    )
+
 
 # ===== Modal 镜像 =====
 vllm_image = (
@@ -29,68 +65,72 @@ vllm_image = (
         "torch==2.5.1",
         "transformers==4.46.0",
         "hf-transfer",
-        "bitsandbytes>=0.41.0",  # INT8量化支持
+        # FP8量化由vLLM内置kernel实现，无需bitsandbytes
     )
-)
-
-wrapper_image = (
-    modal.Image.debian_slim(python_version="3.10")
-    .pip_install(
-        "fastapi>=0.109.0",
-        "uvicorn[standard]>=0.27.0",
-        "pydantic>=2.9",
+    .env({
+        # hf-transfer多连接并行下载（~70-140GB权重）
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",
+        # tokenizer/config也缓存到持久卷，而不是容器的临时文件系统
+        "HF_HOME": "/weights/hf",
+        # TP=2初始化：spawn启动worker避免fork后复用CUDA上下文；NCCL走NVLink点对点
+        # （在导入vllm前通过镜像环境变量生效，NCCL初始化时读取）
+        "VLLM_WORKER_MULTIPROC_METHOD": "spawn",
+        "NCCL_P2P_LEVEL": "NVL",
+        "NCCL_SHM_DISABLE": "0",
+        "TORCH_NCCL_ASYNC_ERROR_HANDLING": "1",
+    })
+    # 构建镜像时预下载权重，首个用户请求不再承担15-20分钟的下载
+    .run_function(
+        download_model_weights,
+        secrets=[modal.Secret.from_name("vllm-secrets")],
+        volumes={"/weights": weights_volume},
     )
 )
 
-weights_volume = modal.Volume.from_name("vllm-llama33-70b-int8", create_if_missing=True)
-
 app = modal.App("vllm-llama33-70b-int8")
 
-# ===== vLLM 推理函数 =====
-vllm_llm = None
-
 
-@app.function(
+# ===== vLLM 推理服务（GPU容器内直接提供HTTP接口） =====
+@app.cls(
     image=vllm_image,
-    # 使用2个GPU进行tensor parallelism
-    gpu="A100-80GB:2",  # 2个A100-80GB GPU
+    # 使用多个GPU进行tensor parallelism
+    gpu=f"A100-80GB:{VLLM_GPU_COUNT}",  # 默认2个A100-80GB GPU
     volumes={"/weights": weights_volume},
     secrets=[modal.Secret.from_name("vllm-secrets")],
     scaledown_window=180,  # 3分钟后释放GPU
     timeout=900,  # 15分钟超时（首次下载模型较大）
 )
-def generate_text_70b_int8(
-    messages: List[Dict[str, str]],
-    max_tokens: int = 2048,
-    temperature: float = 0.7,
-    top_p: float = 0.9,
-) -> Dict[str, Any]:
+# 单容器同时接收多个请求，交给异步引擎做连续批处理
+# 每容器目标64个并发，突发时最多256个，超过目标才扩容新的2×A100容器
+@modal.concurrent(max_inputs=256, target_inputs=64)
+class Llama33Service:
     """
     Llama 3.3 70B 推理 (Tensor Parallelism)
 
     Tensor Parallelism配置：
-    - 精度：BF16/FP16（自动选择）
-    - 模型权重：~140GB（分布式）
+    - 精度：FP8权重 + FP8 KV缓存（可回退BF16/FP16）
+    - 模型权重：~70GB（FP8，分布式；BF16为~140GB）
     - Tensor Parallelism: 模型分布到2个GPU
-    - 每个GPU: ~70GB模型 + ~10-15GB KV缓存 = ~75-85GB
+    - 每个GPU: ~35GB模型 + ~35GB KV缓存
     - 总需求：2×A100-80GB = 160GB总显存
 
     GPU配置：
     - 2个A100-80GB (tensor_parallel_size=2)
-    - 每个GPU负载~80-90%
-    - 支持4K context窗口
+    - 每个GPU负载~90%
+    - 支持8K context窗口（BF16下4K）
     """
-    global vllm_llm
 
-    if vllm_llm is None:
-        from vllm import LLM, SamplingParams
+    @modal.enter()
+    def setup(self):
+        """初始化vLLM异步引擎（容器生命周期内只加载一次）"""
+        from transformers import AutoTokenizer
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
         import torch
 
         print(f"🚀 Loading Llama 3.3 70B with Tensor Parallelism")
         print(f"📦 Model: {VLLM_MODEL}")
-        print(f"💾 Precision: BF16/FP16 (auto)")
-        print(f"🎮 GPUs: 2×A100-80GB (tensor_parallel_size=2)")
-        print(f"📊 Expected memory per GPU: ~70-85GB")
+        print(f"💾 Precision: {PRECISION}")
+        print(f"🎮 GPUs: {VLLM_GPU_COUNT}×A100-80GB (tensor_parallel_size={VLLM_GPU_COUNT})")
         print(f"🎯 Max context: {VLLM_MAX_MODEL_LEN} tokens")
         print(f"⚙️  GPU memory util: {VLLM_GPU_MEMORY_UTILIZATION}")
 
@@ -101,17 +141,30 @@ def generate_text_70b_int8(
             print(f"🎮 GPU: {gpu_name}")
             print(f"💾 Total VRAM: {total_memory:.1f}GB")
 
-        vllm_llm = LLM(
-            model=VLLM_MODEL,
-            download_dir="/weights",
-            # 不使用量化，依赖tensor parallelism分布模型
-            # quantization="fp8",  # 暂时禁用，与tensor parallelism可能有冲突
-            gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
-            max_model_len=VLLM_MAX_MODEL_LEN,
-            tensor_parallel_size=2,  # 2个GPU进行tensor parallelism
-            dtype="auto",  # 自动选择最佳精度（通常是BF16或FP16）
-            # 额外优化选项
-            enforce_eager=False,  # 使用CUDA graphs加速
+        # 使用模型自带的chat template直接生成token id，vLLM无需再次分词
+        self.tokenizer = AutoTokenizer.from_pretrained(VLLM_MODEL, cache_dir="/weights")
+
+        # 在途请求合并：去重键 -> 共享的推理任务
+        self.inflight: Dict[str, asyncio.Task] = {}
+
+        # 异步引擎：并发请求在step级别连续批处理，每个decode step分摊到所有在途序列
+        self.engine = AsyncLLMEngine.from_engine_args(
+            AsyncEngineArgs(
+                model=VLLM_MODEL,
+                download_dir="/weights",
+                quantization=VLLM_QUANTIZATION,
+                kv_cache_dtype=VLLM_KV_CACHE_DTYPE,
+                gpu_memory_utilization=VLLM_GPU_MEMORY_UTILIZATION,
+                max_model_len=VLLM_MAX_MODEL_LEN,
+                tensor_parallel_size=VLLM_GPU_COUNT,  # 多GPU进行tensor parallelism
+                dtype="auto",  # 激活/非量化层自动选择精度（通常是BF16）
+                # 额外优化选项
+                enforce_eager=False,  # 使用CUDA graphs加速
+                enable_prefix_caching=True,  # 复用相同系统提示词前缀的KV缓存
+                enable_chunked_prefill=True,
+                max_num_batched_tokens=VLLM_MAX_NUM_BATCHED_TOKENS,
+                max_num_seqs=VLLM_MAX_NUM_SEQS,
+            )
         )
 
         # 显示实际显存使用
@@ -122,244 +175,300 @@ def generate_text_70b_int8(
             print(f"💾 Memory allocated: {allocated:.1f}GB")
             print(f"💾 Memory reserved: {reserved:.1f}GB")
 
-    # 构建prompt（Llama 3.3格式）
-    prompt = ""
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
-
-        if role == "system":
-            prompt += f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>"
-        elif role == "user":
-            prompt += f"<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>"
-        elif role == "assistant":
-            prompt += f"<|start_header_id|>assistant<|end_header_id|>\n\n{content}<|eot_id|>"
-
-    prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
-
-    # 推理
-    from vllm import SamplingParams
-
-    sampling_params = SamplingParams(
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-    )
+        # 持久化首次下载的权重，下次冷启动直接从卷加载
+        weights_volume.commit()
+
+    @modal.enter()
+    async def warmup(self):
+        """
+        预热：在接收流量前按不同并发度跑几次极短的生成
+
+        CUDA graph在引擎初始化时已捕获，这里让首批真实请求不再承担
+        引擎后台循环启动、采样器和各batch尺寸kernel的首次调用开销。
+        """
+        import time
+        from uuid import uuid4
+        from vllm import SamplingParams
+
+        sampling_params = SamplingParams(max_tokens=4, temperature=0.0)
+        prompt = self._encode_messages([{"role": "user", "content": "Hi"}])
+
+        async def run_one():
+            async for _ in self.engine.generate(prompt, sampling_params, request_id=uuid4().hex):
+                pass
+
+        start = time.perf_counter()
+        for batch_size in (1, 2, 4, 8, 16):
+            await asyncio.gather(*(run_one() for _ in range(batch_size)))
+        print(f"🔥 Warmup done in {time.perf_counter() - start:.1f}s")
+
+    def _encode_messages(self, messages: List[Dict[str, str]]) -> Dict[str, List[int]]:
+        """用模型的chat template将对话消息编码为token id（Llama 3.3格式）"""
+        # 规范化系统提示词，保证前缀哈希在请求间一致（命中prefix cache）
+        messages = [
+            {"role": m["role"], "content": m["content"].strip()} if m["role"] == "system" else m
+            for m in messages
+        ]
+        token_ids = self.tokenizer.apply_chat_template(
+            messages, add_generation_prompt=True, tokenize=True
+        )
+        return {"prompt_token_ids": token_ids}
+
+    async def generate(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+    ) -> Dict[str, Any]:
+        """
+        提交到异步引擎，等待最终输出
+
+        不同请求由引擎连续批处理共享decode step；temperature为0时结果确定，
+        完全相同的在途请求合并为一次推理。
+        """
+        if temperature != 0:
+            return await self._generate(messages, max_tokens, temperature, top_p)
+
+        canonical = json.dumps(
+            [messages, max_tokens, temperature, top_p], sort_keys=True, ensure_ascii=False
+        )
+        key = hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
 
-    outputs = vllm_llm.generate([prompt], sampling_params)
-    output = outputs[0]
-
-    return {
-        "text": output.outputs[0].text,
-        "prompt_tokens": len(output.prompt_token_ids),
-        "completion_tokens": len(output.outputs[0].token_ids),
-        "finish_reason": output.outputs[0].finish_reason,
-    }
-
-
-# ===== FastAPI Wrapper =====
-@app.function(image=wrapper_image)
-@modal.asgi_app()
-def wrapper():
-    """FastAPI Wrapper - 永远在线"""
-    from fastapi import FastAPI, HTTPException, status
-    from fastapi.middleware.cors import CORSMiddleware
-    from pydantic import BaseModel, Field
-    from typing import List, Dict, Optional
-    import logging
-
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    fastapi_app = FastAPI(
-        title="Llama 3.3 70B INT8 Service",
-        description="Meta Llama 3.3 70B Instruct with INT8 quantization",
-        version="1.0.0",
-    )
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._generate(messages, max_tokens, temperature, top_p)
+            )
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+        # shield：某个调用方断开时不取消其他调用方共享的推理
+        return await asyncio.shield(task)
+
+    async def _generate(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+    ) -> Dict[str, Any]:
+        """单次引擎推理"""
+        from uuid import uuid4
+        from vllm import SamplingParams
+
+        sampling_params = SamplingParams(
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+        )
 
-    fastapi_app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
+        output = None
+        async for output in self.engine.generate(
+            self._encode_messages(messages), sampling_params, request_id=uuid4().hex
+        ):
+            pass
 
-    # 请求/响应模型
-    class Message(BaseModel):
-        role: str
-        content: str
-
-    class ChatRequest(BaseModel):
-        messages: List[Message]
-        max_tokens: Optional[int] = 2048
-        temperature: Optional[float] = 0.7
-        top_p: Optional[float] = 0.9
-
-    class ChatResponse(BaseModel):
-        content: str
-        model: str
-        usage: Dict[str, int]
-        finish_reason: Optional[str] = None
-
-    class HealthResponse(BaseModel):
-        status: str
-        model: str
-        model_version: str
-        quantization: str
-        gpu_requirement: str
-        context_length: int
-
-    # API端点
-    @fastapi_app.get("/")
-    async def root():
         return {
-            "service": "Llama 3.3 70B Service",
-            "version": "1.0.0",
-            "model": VLLM_MODEL,
-            "model_version": "Llama 3.3 (Meta's latest)",
-            "precision": "BF16/FP16 (auto)",
-            "gpu": "2×A100-80GB (Tensor Parallelism)",
-            "memory_per_gpu": "~70-85GB",
-            "context_length": VLLM_MAX_MODEL_LEN,
-            "quality_loss": "0% (original precision)",
-            "endpoints": {
-                "POST /chat": "对话接口",
-                "POST /v1/chat/completions": "OpenAI兼容接口",
-                "GET /health": "健康检查",
-            }
+            "text": output.outputs[0].text,
+            "prompt_tokens": len(output.prompt_token_ids),
+            "completion_tokens": len(output.outputs[0].token_ids),
+            "finish_reason": output.outputs[0].finish_reason,
         }
 
-    @fastapi_app.get("/health", response_model=HealthResponse)
-    async def health():
-        return HealthResponse(
-            status="healthy",
-            model=VLLM_MODEL,
-            model_version="Llama 3.3",
-            quantization="None (BF16/FP16 + Tensor Parallelism)",
-            gpu_requirement="2×A100-80GB",
-            context_length=VLLM_MAX_MODEL_LEN,
+    @modal.asgi_app()
+    def api(self):
+        """FastAPI接口 - 与引擎同容器，请求直接进入连续批处理"""
+        from fastapi import FastAPI, HTTPException, status
+        from fastapi.middleware.cors import CORSMiddleware
+        from pydantic import BaseModel
+        import logging
+        import time
+
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger(__name__)
+
+        fastapi_app = FastAPI(
+            title="Llama 3.3 70B Service",
+            description=f"Meta Llama 3.3 70B Instruct ({PRECISION})",
+            version="1.0.0",
         )
 
-    @fastapi_app.post("/chat", response_model=ChatResponse)
-    async def chat(request: ChatRequest):
-        """对话接口"""
-        try:
-            logger.info(f"收到Llama 3.3 70B请求，{len(request.messages)}条消息")
-
-            messages_dict = [{"role": m.role, "content": m.content} for m in request.messages]
-
-            logger.info("调用Llama 3.3 70B INT8推理...")
-
-            result = generate_text_70b_int8.remote(
-                messages=messages_dict,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-            )
+        fastapi_app.add_middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
 
-            logger.info("推理完成")
+        # 请求/响应模型
+        class Message(BaseModel):
+            role: str
+            content: str
+
+        class ChatRequest(BaseModel):
+            messages: List[Message]
+            max_tokens: Optional[int] = 2048
+            temperature: Optional[float] = 0.7
+            top_p: Optional[float] = 0.9
+
+        class ChatResponse(BaseModel):
+            content: str
+            model: str
+            usage: Dict[str, int]
+            finish_reason: Optional[str] = None
+
+        class HealthResponse(BaseModel):
+            status: str
+            model: str
+            model_version: str
+            quantization: str
+            gpu_requirement: str
+            context_length: int
+            unfinished_requests: int
+
+        # API端点
+        @fastapi_app.get("/")
+        async def root():
+            return {
+                "service": "Llama 3.3 70B Service",
+                "version": "1.0.0",
+                "model": VLLM_MODEL,
+                "model_version": "Llama 3.3 (Meta's latest)",
+                "precision": PRECISION,
+                "gpu": f"{VLLM_GPU_COUNT}×A100-80GB (Tensor Parallelism)",
+                "context_length": VLLM_MAX_MODEL_LEN,
+                "endpoints": {
+                    "POST /chat": "对话接口",
+                    "POST /v1/chat/completions": "OpenAI兼容接口",
+                    "GET /health": "健康检查",
+                }
+            }
 
-            return ChatResponse(
-                content=result["text"],
+        @fastapi_app.get("/health", response_model=HealthResponse)
+        async def health():
+            return HealthResponse(
+                status="healthy",
                 model=VLLM_MODEL,
-                usage={
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
-                },
-                finish_reason=result["finish_reason"],
-            )
-
-        except Exception as e:
-            logger.error(f"推理失败: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
+                model_version="Llama 3.3",
+                quantization=f"{PRECISION} + Tensor Parallelism",
+                gpu_requirement=f"{VLLM_GPU_COUNT}×A100-80GB",
+                context_length=VLLM_MAX_MODEL_LEN,
+                # 引擎内未完成的请求数（运行中+排队），用于观察单容器的批处理饱和度
+                unfinished_requests=self.engine.engine.get_num_unfinished_requests(),
             )
 
-    @fastapi_app.post("/v1/chat/completions")
-    async def openai_chat(request: Dict):
-        """OpenAI兼容接口"""
-        try:
-            messages = request.get("messages", [])
-            max_tokens = request.get("max_tokens", 2048)
-            temperature = request.get("temperature", 0.7)
-            top_p = request.get("top_p", 0.9)
-
-            result = generate_text_70b_int8.remote(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-            )
-
-            return {
-                "id": "chatcmpl-llama33-70b",
-                "object": "chat.completion",
-                "created": int(__import__("time").time()),
-                "model": VLLM_MODEL,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": result["text"],
+        @fastapi_app.post("/chat", response_model=ChatResponse)
+        async def chat(request: ChatRequest):
+            """对话接口"""
+            try:
+                logger.info(f"收到Llama 3.3 70B请求，{len(request.messages)}条消息")
+
+                messages_dict = [{"role": m.role, "content": m.content} for m in request.messages]
+
+                result = await self.generate(
+                    messages=messages_dict,
+                    max_tokens=request.max_tokens,
+                    temperature=request.temperature,
+                    top_p=request.top_p,
+                )
+
+                logger.info("推理完成")
+
+                return ChatResponse(
+                    content=result["text"],
+                    model=VLLM_MODEL,
+                    usage={
+                        "prompt_tokens": result["prompt_tokens"],
+                        "completion_tokens": result["completion_tokens"],
+                        "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
                     },
-                    "finish_reason": result["finish_reason"],
-                }],
-                "usage": {
-                    "prompt_tokens": result["prompt_tokens"],
-                    "completion_tokens": result["completion_tokens"],
-                    "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+                    finish_reason=result["finish_reason"],
+                )
+
+            except Exception as e:
+                logger.error(f"推理失败: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"推理失败: {str(e)}"
+                )
+
+        @fastapi_app.post("/v1/chat/completions")
+        async def openai_chat(request: Dict):
+            """OpenAI兼容接口"""
+            try:
+                result = await self.generate(
+                    messages=request.get("messages", []),
+                    max_tokens=request.get("max_tokens", 2048),
+                    temperature=request.get("temperature", 0.7),
+                    top_p=request.get("top_p", 0.9),
+                )
+
+                return {
+                    "id": "chatcmpl-llama33-70b",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": VLLM_MODEL,
+                    "choices": [{
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": result["text"],
+                        },
+                        "finish_reason": result["finish_reason"],
+                    }],
+                    "usage": {
+                        "prompt_tokens": result["prompt_tokens"],
+                        "completion_tokens": result["completion_tokens"],
+                        "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+                    }
                 }
-            }
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"推理失败: {str(e)}"
-            )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"推理失败: {str(e)}"
+                )
 
-    return fastapi_app
+        return fastapi_app
 
 
 @app.local_entrypoint()
 def main():
     print("=" * 70)
-    print("🚀 Llama 3.3 70B (BF16/FP16) + Tensor Parallelism 部署")
+    print(f"🚀 Llama 3.3 70B ({PRECISION}) + Tensor Parallelism 部署")
     print("=" * 70)
     print()
     print("📦 模型配置:")
     print(f"   - 模型: {VLLM_MODEL}")
     print(f"   - 版本: Llama 3.3 (Meta最新)")
-    print(f"   - 精度: BF16/FP16 (auto，原始精度)")
-    print(f"   - GPU: 2×A100-80GB (Tensor Parallelism)")
-    print(f"   - 每GPU显存: ~70-85GB")
-    print(f"   - 总显存: ~140-170GB (分布式)")
+    print(f"   - 精度: {PRECISION}")
+    print(f"   - GPU: {VLLM_GPU_COUNT}×A100-80GB (Tensor Parallelism)")
     print(f"   - 上下文长度: {VLLM_MAX_MODEL_LEN} tokens")
     print()
     print("⚡ 性能特点:")
-    print("   - 质量损失: 0%（原始精度，无量化）")
-    print("   - 推理速度: ~40-50 tokens/秒")
-    print("   - 精度: 最高（BF16/FP16）")
+    print("   - 质量损失: FP8近乎无损（VLLM_QUANTIZATION=\"\" 可回退原始精度）")
+    print("   - 推理速度: FP8权重带宽减半，decode约为BF16的1.6-1.9倍")
     print("   - 可靠性: 高（tensor parallelism）")
+    print("   - 连续批处理: AsyncLLMEngine（并发请求共享decode step）")
     print()
     print("🎮 GPU配置:")
     print("   - 架构: Tensor Parallelism (模型切分)")
-    print("   - GPUs: 2×A100-80GB")
-    print("   - 每GPU负载: ~80-90%")
-    print("   - tensor_parallel_size: 2")
+    print(f"   - GPUs: {VLLM_GPU_COUNT}×A100-80GB")
+    print("   - 每GPU负载: ~90%")
+    print(f"   - tensor_parallel_size: {VLLM_GPU_COUNT}")
     print()
     print("🔧 部署命令:")
     print("   modal deploy modal_vllm_llama33_70b_int8.py")
     print()
     print("📝 注意事项:")
-    print("   - 首次下载Llama 3.3需要15-20分钟（模型较大）")
+    print("   - 首次部署构建镜像时下载Llama 3.3需要15-20分钟（之后冷启动无需下载）")
     print("   - 需要HuggingFace访问权限（Meta模型需申请）")
-    print("   - 使用原始BF16/FP16精度（无量化）")
-    print("   - tensor_parallel_size=2 确保模型分布到2个GPU")
+    print("   - 默认FP8量化，设置 VLLM_QUANTIZATION=\"\" 使用原始BF16/FP16精度")
+    print("   - tensor_parallel_size 与 VLLM_GPU_COUNT 一致，模型分布到所有GPU")
     print()
     print("💰 成本:")
     print("   - 2×A100-80GB: ~$2.20/小时")
-    print("   - 优势: 原始精度 + Tensor Parallelism + 高可靠性")
+    print("   - 优势: FP8高吞吐 + Tensor Parallelism + 高可靠性")
     print("=" * 70)
@@ -15,6 +15,7 @@ vllm_wrapper_image = (
         "pydantic==2.5.3",
         "openai==1.54.0",
         "httpx==0.27.0",
+        "orjson==3.10.7",
     )
 )
 
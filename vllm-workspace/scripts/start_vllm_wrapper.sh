@@ -17,4 +17,4 @@ echo "Port: $VLLM_WRAPPER_PORT"
 echo ""
 
 export PYTHONPATH="$ROOT_DIR/tools:$PYTHONPATH"
-python -m uvicorn vllm_wrapper:app --host 0.0.0.0 --port $VLLM_WRAPPER_PORT
+python -m uvicorn vllm_wrapper:app --host 0.0.0.0 --port $VLLM_WRAPPER_PORT --loop uvloop --http httptools
@@ -0,0 +1,11 @@
+"""pytest 共享 fixture"""
+import pytest
+
+from test_timeout_fallback import LLMBackendRouter, config, test_config
+
+
+@pytest.fixture(scope="session")
+def router() -> LLMBackendRouter:
+    """整个测试会话只构建一次路由器（先校验配置，再初始化各后端客户端）"""
+    test_config()
+    return LLMBackendRouter(config)
@@ -40,14 +40,12 @@ def test_config():
     print("✅ 配置测试通过\n")
 
 
-def test_backend_initialization():
+def test_backend_initialization(router: LLMBackendRouter):
     """测试 LLMBackend 初始化"""
     print("=" * 70)
     print("测试 2: LLMBackend 初始化")
     print("=" * 70)
 
-    router = LLMBackendRouter(config)
-
     print(f"可用后端数量: {len(router.backends)}")
 
     for backend in router.backends:
@@ -67,14 +65,12 @@ def test_backend_initialization():
     print("\n✅ LLMBackend 初始化测试通过\n")
 
 
-def test_error_classification():
+def test_error_classification(router: LLMBackendRouter):
     """测试错误分类逻辑"""
     print("=" * 70)
     print("测试 3: 错误分类逻辑")
     print("=" * 70)
 
-    router = LLMBackendRouter(config)
-
     # 使用 isinstance 检查来测试错误分类逻辑
     # 创建实际的异常实例需要特殊参数，这里我们测试类型检查
 
@@ -119,14 +115,12 @@ def test_error_classification():
     print("\n✅ 错误分类测试通过\n")
 
 
-async def test_actual_call():
+async def test_actual_call(router: LLMBackendRouter):
     """测试实际 LLM 调用（如果配置了后端）"""
     print("=" * 70)
     print("测试 4: 实际 LLM 调用测试")
     print("=" * 70)
 
-    router = LLMBackendRouter(config)
-
     if not router.backends:
         print("⚠️ 未配置任何 LLM 后端，跳过实际调用测试")
         return
@@ -165,14 +159,17 @@ def main():
         # 测试 1: 配置加载
         test_config()
 
+        # 路由器只构建一次（解析配置 + 初始化各后端客户端），各测试共用
+        router = LLMBackendRouter(config)
+
         # 测试 2: Backend 初始化
-        test_backend_initialization()
+        test_backend_initialization(router)
 
         # 测试 3: 错误分类
-        test_error_classification()
+        test_error_classification(router)
 
         # 测试 4: 实际调用
-        asyncio.run(test_actual_call())
+        asyncio.run(test_actual_call(router))
 
         print("=" * 70)
         print("✅ 所有测试通过！")
@@ -6,7 +6,12 @@ import httpx
 import os
 
 
-async def test_health():
+# 所有测试共用一个客户端，复用 keep-alive 连接（只握手一次）
+CLIENT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30.0)
+CLIENT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+async def test_health(client: httpx.AsyncClient):
     """测试健康检查"""
     print("=" * 60)
     print("测试 1: 健康检查")
@@ -14,18 +19,17 @@ async def test_health():
 
     url = "http://localhost:8001/health"
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=10.0)
-            print(f"状态码: {response.status_code}")
-            print(f"响应: {response.json()}")
-        except Exception as e:
-            print(f"❌ 健康检查失败: {e}")
+    try:
+        response = await client.get(url, timeout=10.0)
+        print(f"状态码: {response.status_code}")
+        print(f"响应: {response.json()}")
+    except Exception as e:
+        print(f"❌ 健康检查失败: {e}")
 
     print()
 
 
-async def test_models():
+async def test_models(client: httpx.AsyncClient):
     """测试模型列表"""
     print("=" * 60)
     print("测试 2: 列出模型")
@@ -33,18 +37,17 @@ async def test_models():
 
     url = "http://localhost:8001/models"
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=30.0)
-            print(f"状态码: {response.status_code}")
-            print(f"响应: {response.json()}")
-        except Exception as e:
-            print(f"❌ 获取模型列表失败: {e}")
+    try:
+        response = await client.get(url, timeout=30.0)
+        print(f"状态码: {response.status_code}")
+        print(f"响应: {response.json()}")
+    except Exception as e:
+        print(f"❌ 获取模型列表失败: {e}")
 
     print()
 
 
-async def test_chat():
+async def test_chat(client: httpx.AsyncClient):
     """测试对话接口（非流式）"""
     print("=" * 60)
     print("测试 3: 对话接口（非流式）")
@@ -67,35 +70,34 @@ async def test_chat():
         "temperature": 0.7
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"发送请求到: {url}")
-            print(f"消息: {payload['messages'][-1]['content']}")
-            print("\n等待VLLM响应...")
+    try:
+        print(f"发送请求到: {url}")
+        print(f"消息: {payload['messages'][-1]['content']}")
+        print("\n等待VLLM响应...")
 
-            response = await client.post(url, json=payload, headers=headers, timeout=60.0)
+        response = await client.post(url, json=payload, headers=headers, timeout=60.0)
 
-            print(f"\n状态码: {response.status_code}")
+        print(f"\n状态码: {response.status_code}")
 
-            if response.status_code == 200:
-                result = response.json()
-                print(f"✅ 对话成功!")
-                print(f"\n回复内容:\n{result['content']}")
-                print(f"\n使用的模型: {result['model']}")
-                if result.get('usage'):
-                    print(f"Token使用: {result['usage']}")
-            else:
-                print(f"❌ 请求失败: {response.text}")
+        if response.status_code == 200:
+            result = response.json()
+            print(f"✅ 对话成功!")
+            print(f"\n回复内容:\n{result['content']}")
+            print(f"\n使用的模型: {result['model']}")
+            if result.get('usage'):
+                print(f"Token使用: {result['usage']}")
+        else:
+            print(f"❌ 请求失败: {response.text}")
 
-        except httpx.TimeoutException:
-            print("❌ 请求超时 - VLLM可能正在冷启动，请等待几分钟后重试")
-        except Exception as e:
-            print(f"❌ 对话请求失败: {e}")
+    except httpx.TimeoutException:
+        print("❌ 请求超时 - VLLM可能正在冷启动，请等待几分钟后重试")
+    except Exception as e:
+        print(f"❌ 对话请求失败: {e}")
 
     print()
 
 
-async def test_chat_stream():
+async def test_chat_stream(client: httpx.AsyncClient):
     """测试对话接口（流式）"""
     print("=" * 60)
     print("测试 4: 对话接口（流式）")
@@ -118,33 +120,45 @@ async def test_chat_stream():
         "temperature": 0.7
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"发送流式请求到: {url}")
-            print(f"消息: {payload['messages'][-1]['content']}")
-            print("\n流式响应:\n")
-
-            async with client.stream("POST", url, json=payload, headers=headers, timeout=60.0) as response:
-                if response.status_code != 200:
-                    print(f"❌ 请求失败: {response.status_code}")
-                    return
-
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        content = line[6:]  # 去掉 "data: " 前缀
-                        if content == "[DONE]":
-                            print("\n\n✅ 流式响应完成!")
-                            break
-                        elif content.startswith("[ERROR]"):
-                            print(f"\n❌ 错误: {content}")
-                            break
-                        else:
-                            print(content, end="", flush=True)
-
-        except httpx.TimeoutException:
-            print("\n❌ 请求超时 - VLLM可能正在冷启动，请等待几分钟后重试")
-        except Exception as e:
-            print(f"\n❌ 流式对话失败: {e}")
+    try:
+        print(f"发送流式请求到: {url}")
+        print(f"消息: {payload['messages'][-1]['content']}")
+        print("\n流式响应:\n")
+
+        async with client.stream("POST", url, json=payload, headers=headers, timeout=60.0) as response:
+            if response.status_code != 200:
+                print(f"❌ 请求失败: {response.status_code}")
+                return
+
+            # 在字节层按 SSE 事件边界 (\n\n) 切分，只解码 data 负载
+            buf = bytearray()
+            done = False
+            async for data in response.aiter_bytes():
+                buf += data
+                while (i := buf.find(b"\n\n")) != -1:
+                    event = bytes(buf[:i])
+                    del buf[:i + 2]
+                    if not event.startswith(b"data: "):
+                        continue
+
+                    content = event[6:].decode("utf-8")  # 去掉 "data: " 前缀
+                    if content == "[DONE]":
+                        print("\n\n✅ 流式响应完成!")
+                        done = True
+                        break
+                    elif content.startswith("[ERROR]"):
+                        print(f"\n❌ 错误: {content}")
+                        done = True
+                        break
+                    else:
+                        print(content, end="", flush=True)
+                if done:
+                    break
+
+    except httpx.TimeoutException:
+        print("\n❌ 请求超时 - VLLM可能正在冷启动，请等待几分钟后重试")
+    except Exception as e:
+        print(f"\n❌ 流式对话失败: {e}")
 
     print()
 
@@ -157,17 +171,18 @@ async def main():
     print(f"VLLM后端: {os.getenv('VLLM_BASE_URL', '未设置')}")
     print()
 
-    # 运行测试
-    await test_health()
+    # 运行测试（共享同一个连接池）
+    async with httpx.AsyncClient(limits=CLIENT_LIMITS, timeout=CLIENT_TIMEOUT) as client:
+        await test_health(client)
 
-    # 询问是否继续
-    print("健康检查完成。如果VLLM可用，我们将继续测试其他接口。")
-    print("按 Enter 继续，或 Ctrl+C 取消...")
-    # input()  # 注释掉，自动继续
+        # 询问是否继续
+        print("健康检查完成。如果VLLM可用，我们将继续测试其他接口。")
+        print("按 Enter 继续，或 Ctrl+C 取消...")
+        # input()  # 注释掉，自动继续
 
-    await test_models()
-    await test_chat()
-    await test_chat_stream()
+        await test_models(client)
+        await test_chat(client)
+        await test_chat_stream(client)
 
     print("=" * 60)
     print("✅ 所有测试完成!")
@@ -3,15 +3,20 @@ VLLM FastAPI 包装服务
 提供简化的对话接口，支持本地和Modal部署
 """
 import os
+import time
+import random
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Mapping
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Header, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
-from openai import AsyncOpenAI, OpenAIError
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from openai import AsyncOpenAI, OpenAIError, APIConnectionError, APIStatusError, APITimeoutError
+import httpx
 import uvicorn
 
 # 配置日志
@@ -21,47 +26,72 @@ logger = logging.getLogger(__name__)
 
 # ===== 配置 =====
 class VLLMConfig:
-    """VLLM 配置"""
+    """VLLM 配置（默认读取 os.environ，也可传入任意映射便于测试）"""
+
+    def __init__(self, env: Optional[Mapping[str, str]] = None):
+        env = os.environ if env is None else env
 
-    def __init__(self):
         # VLLM 后端配置
-        self.VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8000/v1")
-        self.VLLM_MODEL = os.getenv("VLLM_MODEL", "meta-llama/Llama-3.1-70B-Instruct")
-        self.VLLM_API_KEY = os.getenv("VLLM_API_KEY", "")
+        self.VLLM_BASE_URL = env.get("VLLM_BASE_URL", "http://localhost:8000/v1")
+        self.VLLM_MODEL = env.get("VLLM_MODEL", "meta-llama/Llama-3.1-70B-Instruct")
+        self.VLLM_API_KEY = env.get("VLLM_API_KEY", "")
 
         # 服务配置
-        self.HOST = os.getenv("VLLM_WRAPPER_HOST", "0.0.0.0")
-        self.PORT = int(os.getenv("VLLM_WRAPPER_PORT", "8001"))
-        self.SERVICE_API_KEY = os.getenv("VLLM_WRAPPER_API_KEY", "")  # 可选的服务层API Key
+        self.HOST = env.get("VLLM_WRAPPER_HOST", "0.0.0.0")
+        self.PORT = int(env.get("VLLM_WRAPPER_PORT", "8001"))
+        self.SERVICE_API_KEY = env.get("VLLM_WRAPPER_API_KEY", "")  # 可选的服务层API Key
 
         # 默认参数
-        self.DEFAULT_MAX_TOKENS = int(os.getenv("VLLM_DEFAULT_MAX_TOKENS", "2048"))
-        self.DEFAULT_TEMPERATURE = float(os.getenv("VLLM_DEFAULT_TEMPERATURE", "0.7"))
+        self.DEFAULT_MAX_TOKENS = int(env.get("VLLM_DEFAULT_MAX_TOKENS", "2048"))
+        self.DEFAULT_TEMPERATURE = float(env.get("VLLM_DEFAULT_TEMPERATURE", "0.7"))
 
         # 重试配置
-        self.MAX_RETRIES = int(os.getenv("VLLM_MAX_RETRIES", "3"))
-        self.TIMEOUT = int(os.getenv("VLLM_TIMEOUT", "60"))
+        self.MAX_RETRIES = int(env.get("VLLM_MAX_RETRIES", "3"))
+        self.TIMEOUT = int(env.get("VLLM_TIMEOUT", "60"))
+        self.RETRY_BACKOFF_BASE = float(env.get("VLLM_RETRY_BACKOFF_BASE", "0.5"))
+        self.RETRY_BACKOFF_CAP = float(env.get("VLLM_RETRY_BACKOFF_CAP", "30"))
 
+        # 分阶段超时：连接慢/连接池耗尽时几秒内失败，而不是耗满整个 TIMEOUT
+        self.CONNECT_TIMEOUT = float(env.get("VLLM_CONNECT_TIMEOUT", "3"))
+        self.READ_TIMEOUT = float(env.get("VLLM_READ_TIMEOUT", str(self.TIMEOUT)))
+        self.WRITE_TIMEOUT = float(env.get("VLLM_WRITE_TIMEOUT", "10"))
+        self.POOL_TIMEOUT = float(env.get("VLLM_POOL_TIMEOUT", "2"))
 
-config = VLLMConfig()
+        # 熔断配置：连续失败 N 次后熔断，冷却期内直接返回 503
+        self.BREAKER_THRESHOLD = int(env.get("VLLM_BREAKER_THRESHOLD", "5"))
+        self.BREAKER_COOLDOWN = float(env.get("VLLM_BREAKER_COOLDOWN", "30"))
 
 
-# ===== 请求/响应模型 =====
-class Message(BaseModel):
-    """对话消息"""
-    role: str = Field(..., description="角色: user, assistant, system")
-    content: str = Field(..., description="消息内容")
+@lru_cache(maxsize=1)
+def get_config() -> VLLMConfig:
+    """进程内只解析一次配置"""
+    return VLLMConfig()
+
+
+config = get_config()
 
 
+# ===== 请求/响应模型 =====
 class ChatRequest(BaseModel):
     """对话请求"""
-    messages: List[Message] = Field(..., description="对话历史")
+    # 直接使用 dict，省去逐条构造 Message 对象再转回 dict 的开销
+    messages: List[Dict[str, str]] = Field(
+        ..., description="对话历史，每条包含 role (user/assistant/system) 和 content"
+    )
     max_tokens: Optional[int] = Field(None, description="最大生成token数")
     temperature: Optional[float] = Field(None, description="温度参数 (0-2)")
     top_p: Optional[float] = Field(None, description="Top-p采样参数")
     stream: bool = Field(False, description="是否流式返回")
     model: Optional[str] = Field(None, description="模型名称（可选）")
 
+    @field_validator("messages")
+    @classmethod
+    def check_messages(cls, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        for i, message in enumerate(messages):
+            if "role" not in message or "content" not in message:
+                raise ValueError(f"messages[{i}] 缺少 role 或 content 字段")
+        return messages
+
 
 class ChatResponse(BaseModel):
     """对话响应"""
@@ -79,28 +109,217 @@ class HealthResponse(BaseModel):
     base_url: str = Field(..., description="VLLM服务地址")
 
 
+# 预编码的 SSE 结束帧
+SSE_DONE = b"data: [DONE]\n\n"
+
+# 可重试的上游状态码（限流 / 网关 / 暂时不可用）
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+# ===== 熔断器 =====
+class CircuitBreaker:
+    """
+    进程内熔断器（CLOSED -> OPEN -> HALF_OPEN -> CLOSED）
+
+    VLLM 冷启动或挂起时，快速失败而不是让每个请求都等满超时。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self.half_open_probe_inflight = False
+
+    def before_call(self):
+        """请求前检查，熔断时抛出 503"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="circuit_open"
+                )
+            # 冷却结束，放行一个探测请求
+            self.state = self.HALF_OPEN
+            self.half_open_probe_inflight = False
+
+        if self.state == self.HALF_OPEN:
+            if self.half_open_probe_inflight:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="circuit_open"
+                )
+            self.half_open_probe_inflight = True
+
+    def on_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ VLLM 恢复，熔断器关闭")
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.half_open_probe_inflight = False
+
+    def on_failure(self):
+        self.half_open_probe_inflight = False
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN or self.failure_count >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"⚠️ VLLM 连续失败 {self.failure_count} 次，熔断 {self.cooldown}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """请求被取消或结果无法判定时，释放探测名额"""
+        self.half_open_probe_inflight = False
+
+
 # ===== VLLM 客户端 =====
 class VLLMClient:
     """VLLM 客户端包装器"""
 
     def __init__(self):
+        # 共享连接池：默认 transport 只有 100 连接 / 20 keep-alive，并发时成为瓶颈
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=1000,
+                max_keepalive_connections=100,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(
+                connect=config.CONNECT_TIMEOUT,
+                read=config.READ_TIMEOUT,
+                write=config.WRITE_TIMEOUT,
+                pool=config.POOL_TIMEOUT,
+            ),
+        )
         self.client = AsyncOpenAI(
             base_url=config.VLLM_BASE_URL,
-            api_key=config.VLLM_API_KEY or "EMPTY"
+            api_key=config.VLLM_API_KEY or "EMPTY",
+            http_client=self._http,
+            timeout=self._http.timeout,
+            max_retries=0,  # 重试由 _create_with_retry 统一处理
         )
         self.model = config.VLLM_MODEL
+        self.breaker = CircuitBreaker(config.BREAKER_THRESHOLD, config.BREAKER_COOLDOWN)
+
+        # 健康检查缓存：负载均衡探针频繁调用 /health，TTL 内直接返回上次结果
+        self._health_ttl = 5.0
+        self._last_health_at = 0.0
+        self._last_health_ok = False
+        self._health_lock = asyncio.Lock()
+        self._health_task: Optional[asyncio.Task] = None
         logger.info(f"初始化VLLM客户端: {config.VLLM_BASE_URL}, 模型: {self.model}")
 
     async def health_check(self) -> bool:
-        """健康检查"""
+        """健康检查（结果缓存 _health_ttl 秒，并发调用合并为一次探测）"""
+        if time.monotonic() - self._last_health_at < self._health_ttl:
+            return self._last_health_ok
+
+        async with self._health_lock:
+            # 等锁期间可能已有其他调用刷新了缓存
+            if time.monotonic() - self._last_health_at < self._health_ttl:
+                return self._last_health_ok
+
+            try:
+                # 尝试列出模型
+                models = await self.client.models.list()
+                logger.info(f"VLLM健康检查成功，可用模型: {[m.id for m in models.data]}")
+                healthy = True
+            except Exception as e:
+                logger.error(f"VLLM健康检查失败: {e}")
+                healthy = False
+
+            self._last_health_ok = healthy
+            self._last_health_at = time.monotonic()
+            return healthy
+
+    def health_status(self) -> bool:
+        """返回缓存的健康状态；缓存过期时在后台刷新，不阻塞调用方"""
+        stale = time.monotonic() - self._last_health_at >= self._health_ttl
+        if stale and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.create_task(self.health_check())
+        return self._last_health_ok
+
+    async def open_raw_stream(self, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        直接向 VLLM 发起流式请求，返回尚未读取的响应（调用方负责 aclose）
+
+        跳过 SDK 的解析再序列化，SSE 字节原样转发。
+        """
+        self.breaker.before_call()
+        request = self._http.build_request(
+            "POST",
+            f"{config.VLLM_BASE_URL.rstrip('/')}/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {config.VLLM_API_KEY or 'EMPTY'}"},
+        )
         try:
-            # 尝试列出模型
-            models = await self.client.models.list()
-            logger.info(f"VLLM健康检查成功，可用模型: {[m.id for m in models.data]}")
-            return True
-        except Exception as e:
-            logger.error(f"VLLM健康检查失败: {e}")
-            return False
+            response = await self._http.send(request, stream=True)
+        except httpx.HTTPError as e:
+            self.breaker.on_failure()
+            logger.error(f"VLLM流式请求失败: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"VLLM服务调用失败: {str(e)}"
+            )
+        except BaseException:
+            self.breaker.release()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.on_failure()
+        else:
+            self.breaker.on_success()
+        return response
+
+    async def aclose(self):
+        """关闭底层连接池"""
+        if self._health_task and not self._health_task.done():
+            self._health_task.cancel()
+        await self._http.aclose()
+
+    @staticmethod
+    def _retry_delay(error: OpenAIError, attempt: int) -> float:
+        """计算重试等待：优先使用 Retry-After，否则指数退避 + 抖动"""
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(config.RETRY_BACKOFF_CAP, max(0.0, float(retry_after)))
+                except ValueError:
+                    pass  # HTTP-date 格式，退回指数退避
+
+        delay = min(config.RETRY_BACKOFF_CAP, config.RETRY_BACKOFF_BASE * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _create_with_retry(self, params: Dict[str, Any]):
+        """
+        发起请求，对 429/5xx 和连接失败做有限次重试
+
+        流式请求同样只重试建立连接这一步，一旦开始返回数据就不再重试。
+        读超时不重试，避免把单次超时放大成数倍。
+        """
+        for attempt in range(config.MAX_RETRIES + 1):
+            try:
+                return await self.client.chat.completions.create(**params)
+            except (APIConnectionError, APIStatusError) as e:
+                retryable = (
+                    isinstance(e, APIConnectionError) and not isinstance(e, APITimeoutError)
+                ) or (
+                    isinstance(e, APIStatusError) and e.status_code in RETRYABLE_STATUS
+                )
+                if not retryable or attempt >= config.MAX_RETRIES:
+                    raise
+
+                delay = self._retry_delay(e, attempt)
+                logger.warning(
+                    f"VLLM请求失败，{delay:.2f}s 后重试 ({attempt + 1}/{config.MAX_RETRIES}): {e}"
+                )
+                await asyncio.sleep(delay)
 
     async def chat(
         self,
@@ -138,10 +357,18 @@ class VLLMClient:
 
         logger.info(f"发送VLLM请求: {len(messages)}条消息, stream={stream}")
 
+        self.breaker.before_call()
+        healthy = None
         try:
-            response = await self.client.chat.completions.create(**params)
+            response = await self._create_with_retry(params)
+            healthy = True
             return response
         except OpenAIError as e:
+            # 只有连接失败/超时/5xx 才计入熔断，4xx 说明后端仍在正常响应
+            healthy = not (
+                isinstance(e, APIConnectionError)
+                or (isinstance(e, APIStatusError) and e.status_code >= 500)
+            )
             logger.error(f"VLLM请求失败: {e}")
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -153,6 +380,13 @@ class VLLMClient:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"服务内部错误: {str(e)}"
             )
+        finally:
+            if healthy is True:
+                self.breaker.on_success()
+            elif healthy is False:
+                self.breaker.on_failure()
+            else:
+                self.breaker.release()
 
 
 # ===== FastAPI 应用 =====
@@ -170,22 +404,29 @@ async def lifespan(app: FastAPI):
     # 初始化客户端
     vllm_client = VLLMClient()
 
-    # 健康检查
-    if await vllm_client.health_check():
-        logger.info("✅ VLLM 连接成功")
-    else:
-        logger.warning("⚠️ VLLM 连接失败，服务将继续运行但可能无法正常响应")
+    # 健康检查放到后台，VLLM 冷启动时也不阻塞服务就绪
+    async def startup_probe():
+        if await vllm_client.health_check():
+            logger.info("✅ VLLM 连接成功")
+        else:
+            logger.warning("⚠️ VLLM 连接失败，服务将继续运行但可能无法正常响应")
 
-    yield
+    probe_task = asyncio.create_task(startup_probe())
 
-    logger.info("👋 VLLM Wrapper 服务关闭")
+    try:
+        yield
+    finally:
+        probe_task.cancel()
+        await vllm_client.aclose()
+        logger.info("👋 VLLM Wrapper 服务关闭")
 
 
 app = FastAPI(
     title="VLLM Wrapper Service",
     description="VLLM 对话接口包装服务，支持本地和云端部署",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # orjson 序列化，比标准库 json 快数倍
 )
 
 # CORS 配置
@@ -250,7 +491,8 @@ async def health():
             detail="VLLM客户端未初始化"
         )
 
-    is_healthy = await vllm_client.health_check()
+    # 只读缓存状态，过期时由后台任务刷新
+    is_healthy = vllm_client.health_status()
 
     return HealthResponse(
         status="healthy" if is_healthy else "degraded",
@@ -297,8 +539,7 @@ async def chat(
             detail="VLLM客户端未初始化"
         )
 
-    # 转换消息格式
-    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    messages = request.messages
 
     # 流式响应
     if request.stream:
@@ -316,14 +557,15 @@ async def chat(
                 async for chunk in stream:
                     if chunk.choices and chunk.choices[0].delta.content:
                         content = chunk.choices[0].delta.content
-                        # SSE 格式
-                        yield f"data: {content}\n\n"
+                        # SSE 格式，直接产出 bytes，省去 StreamingResponse 逐块 encode
+                        yield b"data: " + content.encode("utf-8") + b"\n\n"
 
-                yield "data: [DONE]\n\n"
+                yield SSE_DONE
 
             except Exception as e:
                 logger.error(f"流式响应错误: {e}")
-                yield f"data: [ERROR] {str(e)}\n\n"
+                # 与其他帧一样直接产出 bytes；错误信息压成单行，不破坏事件边界
+                yield b"data: [ERROR] " + " ".join(str(e).split()).encode("utf-8") + b"\n\n"
 
         return StreamingResponse(
             generate(),
@@ -366,35 +608,52 @@ async def openai_compatible_chat(
             detail="VLLM客户端未初始化"
         )
 
-    try:
-        # 直接转发请求到VLLM
-        stream = request.get("stream", False)
+    # 流式响应：原样转发 VLLM 的 SSE 字节，不逐块解析/序列化
+    if request.get("stream", False):
+        payload = dict(request)
+        if not payload.get("model"):
+            payload["model"] = config.VLLM_MODEL
+        if payload.get("max_tokens") is None:
+            payload["max_tokens"] = config.DEFAULT_MAX_TOKENS
+        if payload.get("temperature") is None:
+            payload["temperature"] = config.DEFAULT_TEMPERATURE
+
+        upstream = await vllm_client.open_raw_stream(payload)
+
+        # 上游报错时透传状态码和错误体
+        if upstream.status_code != 200:
+            body = await upstream.aread()
+            await upstream.aclose()
+            return Response(
+                content=body,
+                status_code=upstream.status_code,
+                media_type=upstream.headers.get("content-type", "application/json")
+            )
+
+        async def relay():
+            try:
+                async for raw in upstream.aiter_raw():
+                    yield raw
+            except Exception as e:
+                logger.error(f"流式响应错误: {e}")
+            finally:
+                await upstream.aclose()
 
+        return StreamingResponse(
+            relay(),
+            media_type="text/event-stream"
+        )
+
+    try:
         response = await vllm_client.chat(
             messages=request.get("messages", []),
             max_tokens=request.get("max_tokens"),
             temperature=request.get("temperature"),
             top_p=request.get("top_p"),
-            stream=stream,
+            stream=False,
             model=request.get("model")
         )
 
-        # 流式响应
-        if stream:
-            async def generate():
-                try:
-                    async for chunk in response:
-                        import json
-                        yield f"data: {json.dumps(chunk.model_dump())}\n\n"
-                    yield "data: [DONE]\n\n"
-                except Exception as e:
-                    logger.error(f"流式响应错误: {e}")
-
-            return StreamingResponse(
-                generate(),
-                media_type="text/event-stream"
-            )
-
         # 非流式响应
         return response.model_dump()
 
@@ -414,6 +673,8 @@ if __name__ == "__main__":
         "vllm_wrapper:app",
         host=config.HOST,
         port=config.PORT,
+        loop="uvloop",       # uvicorn[standard] 自带，事件循环调度更快
+        http="httptools",    # C 实现的 HTTP 解析
         reload=True,
         log_level="info"
     )
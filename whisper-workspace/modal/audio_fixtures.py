@@ -0,0 +1,39 @@
+"""测试脚本共用的 WAV 测试音频加载"""
+
+import os
+import wave
+
+import numpy as np
+
+
+def load_pcm16(path: str, strict: bool = True) -> np.ndarray:
+    """读取 16kHz/单声道/16-bit WAV 的 PCM 采样（int16，只读 memmap）
+
+    每次只解析 WAV 头校验格式：strict=True 时格式不符直接报错，否则打印警告后照常返回。
+    采样在首次调用时缓存到旁边的 `<path>.s16.npy`，之后直接 memmap 加载，
+    不会把整段音频先读进内存。WAV 更新后自动重建缓存。
+    """
+    with wave.open(path, 'rb') as wav_file:
+        sample_rate = wav_file.getframerate()
+        num_channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+
+    problems = []
+    if sample_rate != 16000:
+        problems.append(f"采样率应为 16000Hz，当前为 {sample_rate}Hz")
+    if num_channels != 1:
+        problems.append(f"应为单声道，当前为 {num_channels}声道")
+    if sample_width != 2:
+        problems.append(f"应为 16-bit，当前为 {sample_width*8}-bit")
+    if problems:
+        if strict:
+            raise ValueError("; ".join(problems))
+        for problem in problems:
+            print(f"⚠️  警告: {problem}")
+
+    npy = path + ".s16.npy"
+    if not os.path.exists(npy) or os.path.getmtime(npy) < os.path.getmtime(path):
+        with wave.open(path, 'rb') as wav_file:
+            frames = wav_file.readframes(wav_file.getnframes())
+        np.save(npy, np.frombuffer(frames, dtype=np.int16, count=len(frames) // 2))
+    return np.load(npy, mmap_mode="r")
@@ -0,0 +1,30 @@
+"""测试脚本共用的终端颜色与状态行格式"""
+
+# ANSI 颜色代码
+class Colors:
+    GREEN = '\033[92m'
+    BLUE = '\033[94m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    CYAN = '\033[96m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+
+# 预先拼好的状态模板，每行只做一次 str.format
+_OK = f"{Colors.GREEN}✓ {{}}{Colors.RESET}"
+_FAIL = f"{Colors.RED}✗ {{}}{Colors.RESET}"
+
+# 测试摘要中的通过/失败标记（常量，不必每行重新拼接）
+PASSED = _OK.format("通过")
+FAILED = _FAIL.format("失败")
+
+
+def ok(msg: str) -> str:
+    """绿色 ✓ 成功行"""
+    return _OK.format(msg)
+
+
+def fail(msg: str) -> str:
+    """红色 ✗ 失败行"""
+    return _FAIL.format(msg)
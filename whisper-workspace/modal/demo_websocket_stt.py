@@ -2,15 +2,25 @@
 实时显示转录结果的命令行工具
 """
 
+import argparse
 import asyncio
 import websockets
 import json
-import base64
 import wave
 import sys
-from datetime import datetime
+import time
+
+# orjson 为可选依赖，解析更快；未安装时退回标准库
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
 
 WS_URL = "wss://yuanbopang--whisper-stt-wrapper.modal.run/ws/stt"
+DRAW_INTERVAL = 0.2  # 进度刷新最多 5Hz
+DRAIN_IDLE_SEC = 5.0  # 发送完成后，连续这么久没有新结果即结束
+BYTES_PER_MS = 32  # 16kHz * 16bit 单声道
+DEFAULT_BATCH_MS = 500  # 每条消息携带的音频时长
 
 
 class LiveTranscription:
@@ -19,62 +29,98 @@ class LiveTranscription:
     def __init__(self):
         self.results = []
         self.start_time = None
+        self._last_draw = 0.0
+        self._last_ts = 0
+        self._ts_str = ""
+        self._screen_cleared = False
 
     def clear_screen(self):
         """清屏"""
         print("\033[2J\033[H", end='')
 
-    def draw_ui(self, status="连接中...", progress=0, current_text=""):
-        """绘制用户界面"""
-        self.clear_screen()
+    def _clock(self) -> str:
+        """当前时间 HH:MM:SS，按秒缓存格式化结果"""
+        now = int(time.time())
+        if now != self._last_ts:
+            self._ts_str = time.strftime("%H:%M:%S", time.localtime(now))
+            self._last_ts = now
+        return self._ts_str
+
+    def draw_ui(self, status="连接中...", progress=0, current_text="", throttle=False):
+        """绘制用户界面
+
+        只把光标移回左上角并逐行覆盖（行尾 \033[K 清除残留），整屏一次写出；
+        throttle=True 时最多 5Hz 刷新，用于发送循环中的高频进度更新。
+        """
+        now = time.monotonic()
+        if throttle and now - self._last_draw < DRAW_INTERVAL:
+            return
+        self._last_draw = now
+
+        if not self._screen_cleared:
+            self.clear_screen()
+            self._screen_cleared = True
 
         # 标题栏
-        print("=" * 80)
-        print(" " * 25 + "🎙️  实时语音识别演示")
-        print("=" * 80)
-        print()
+        lines = [
+            "=" * 80,
+            " " * 25 + "🎙️  实时语音识别演示",
+            "=" * 80,
+            "",
+        ]
 
         # 状态信息
-        print(f"📡 状态: {status}")
-        print(f"⏱️  时间: {datetime.now().strftime('%H:%M:%S')}")
-        print()
+        lines.append(f"📡 状态: {status}")
+        lines.append(f"⏱️  时间: {self._clock()}")
+        lines.append("")
 
         # 进度条
         if progress > 0:
             bar_length = 50
             filled = int(bar_length * progress / 100)
             bar = "█" * filled + "░" * (bar_length - filled)
-            print(f"进度: [{bar}] {progress:.1f}%")
-            print()
+            lines.append(f"进度: [{bar}] {progress:.1f}%")
+            lines.append("")
 
         # 当前识别中的文本
         if current_text:
-            print("🔄 识别中:")
-            print("-" * 80)
-            print(f"  {current_text}")
-            print("-" * 80)
-            print()
+            lines.append("🔄 识别中:")
+            lines.append("-" * 80)
+            lines.append(f"  {current_text}")
+            lines.append("-" * 80)
+            lines.append("")
 
         # 历史结果
         if self.results:
-            print(f"📝 已识别结果 ({len(self.results)}):")
-            print("-" * 80)
+            lines.append(f"📝 已识别结果 ({len(self.results)}):")
+            lines.append("-" * 80)
             for i, result in enumerate(self.results[-5:], 1):  # 只显示最后5个
-                print(f"{i}. {result}")
+                lines.append(f"{i}. {result}")
             if len(self.results) > 5:
-                print(f"   ... (还有 {len(self.results) - 5} 条)")
-            print("-" * 80)
+                lines.append(f"   ... (还有 {len(self.results) - 5} 条)")
+            lines.append("-" * 80)
 
-        print()
-        print("💡 提示: 按 Ctrl+C 停止")
+        lines.append("")
+        lines.append("💡 提示: 按 Ctrl+C 停止")
+
+        # 光标归位 + 逐行覆盖，最后 \033[J 清掉上一帧多出来的行
+        sys.stdout.write("\033[H" + "\033[K\n".join(lines) + "\033[K\n\033[J")
+        sys.stdout.flush()
 
-    async def run_demo(self, audio_file: str):
-        """运行演示"""
+    async def run_demo(self, audio_file: str, realtime: bool = True, batch_ms: int = DEFAULT_BATCH_MS):
+        """运行演示
+
+        Args:
+            audio_file: 16kHz 单声道 WAV 文件
+            realtime: 按实时速度发送；关闭后尽快发送，由服务端缓冲
+            batch_ms: 每条 WebSocket 消息携带的音频时长（毫秒），100 即旧版逐块发送
+        """
         self.draw_ui("正在连接服务器...")
 
         try:
             # 连接 WebSocket
-            async with websockets.connect(WS_URL) as ws:
+            # PCM 几乎无法压缩：关闭 permessage-deflate 省去每帧 zlib 开销
+            async with websockets.connect(WS_URL, compression=None, max_size=None) as ws:
                 self.start_time = asyncio.get_event_loop().time()
                 self.draw_ui("✅ 已连接，开始发送音频...")
 
@@ -84,19 +130,24 @@ class LiveTranscription:
                     total_frames = wav_file.getnframes()
                     total_duration = total_frames / sample_rate
 
+                    # 一次性读取全部音频，按 memoryview 切片（不复制），
+                    # 避免发送循环中穿插文件 I/O；切片直接作为二进制帧发送（原始 PCM，
+                    # 无 Base64/JSON 封装）。多个 100ms 块合并成一帧发送
+                    # （服务端按字节缓冲，任意长度均可），减少帧数
+                    chunk_size = BYTES_PER_MS * batch_ms
+                    audio_view = memoryview(wav_file.readframes(total_frames))
+                    chunks = [
+                        audio_view[offset:offset + chunk_size]
+                        for offset in range(0, len(audio_view), chunk_size)
+                    ]
+
                     # 流式发送和接收
                     async def send_audio():
-                        chunk_size = 3200  # 100ms
                         sent_bytes = 0
                         total_bytes = total_frames * 2
 
-                        while True:
-                            chunk = wav_file.readframes(int(chunk_size / 2))
-                            if not chunk:
-                                break
-
-                            audio_b64 = base64.b64encode(chunk).decode()
-                            await ws.send(json.dumps({"audio_data": audio_b64}))
+                        for chunk in chunks:
+                            await ws.send(chunk)
 
                             sent_bytes += len(chunk)
                             progress = (sent_bytes / total_bytes) * 100
@@ -104,17 +155,28 @@ class LiveTranscription:
                             # 更新UI
                             elapsed = asyncio.get_event_loop().time() - self.start_time
                             status = f"🎤 发送中 ({elapsed:.1f}秒)"
-                            self.draw_ui(status, progress)
+                            self.draw_ui(status, progress, throttle=True)
 
-                            await asyncio.sleep(0.1)  # 100ms 延迟
+                            # 实时模式模拟采集间隔；否则仅让出事件循环
+                            await asyncio.sleep(batch_ms / 1000 if realtime else 0)
 
+                        # 通知服务端音频结束（文本控制消息，当前服务端会直接忽略）
+                        await ws.send('{"eof":true}')
                         self.draw_ui("✅ 音频发送完成，等待结果...", 100)
 
+                        # 排空：直到一段时间内没有新结果，再结束接收，而不是等满 30 秒超时
+                        last_count = -1
+                        while last_count != len(self.results):
+                            last_count = len(self.results)
+                            await asyncio.sleep(DRAIN_IDLE_SEC)
+                        recv_task.cancel()
+
                     async def receive_results():
+                        ws_recv = ws.recv
                         try:
                             while True:
-                                result = await asyncio.wait_for(ws.recv(), timeout=30.0)
-                                result_data = json.loads(result)
+                                result = await asyncio.wait_for(ws_recv(), timeout=30.0)
+                                result_data = json_loads(result)
 
                                 text = result_data.get('text', '')
                                 self.results.append(text)
@@ -126,16 +188,22 @@ class LiveTranscription:
 
                                 await asyncio.sleep(0.5)  # 短暂显示
 
-                        except asyncio.TimeoutError:
+                        except (asyncio.TimeoutError, asyncio.CancelledError):
+                            # 被 send_audio 取消属于正常结束
                             self.draw_ui("✅ 识别完成", 100)
 
                     # 并行执行
-                    await asyncio.gather(send_audio(), receive_results())
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(send_audio())
+                        recv_task = tg.create_task(receive_results())
 
         except KeyboardInterrupt:
             self.draw_ui("⚠️  用户中断", 0)
 
         except Exception as e:
+            # TaskGroup 会把子任务异常包装成 ExceptionGroup，取出第一个展示
+            if isinstance(e, ExceptionGroup):
+                e = e.exceptions[0]
             self.draw_ui(f"❌ 错误: {str(e)}", 0)
 
         # 显示最终结果
@@ -153,16 +221,35 @@ class LiveTranscription:
 
 async def main():
     """主函数"""
-    if len(sys.argv) < 2:
-        print("用法: python demo_websocket_stt.py <audio_file.wav>")
-        print("示例: python demo_websocket_stt.py test_audio_16k.wav")
-        sys.exit(1)
-
-    audio_file = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        description="WebSocket 语音识别交互式演示",
+        epilog="示例: python demo_websocket_stt.py test_audio_16k.wav --no-realtime",
+    )
+    parser.add_argument("audio_file", help="16kHz 单声道 WAV 文件")
+    parser.add_argument(
+        "--realtime",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="按实时速度发送音频（默认开启；--no-realtime 尽快发送）",
+    )
+    parser.add_argument(
+        "--batch-ms",
+        type=int,
+        default=DEFAULT_BATCH_MS,
+        help=f"每条消息携带的音频毫秒数（默认 {DEFAULT_BATCH_MS}；100 为逐块发送）",
+    )
+    args = parser.parse_args()
 
     demo = LiveTranscription()
-    await demo.run_demo(audio_file)
+    await demo.run_demo(args.audio_file, realtime=args.realtime, batch_ms=args.batch_ms)
 
 
 if __name__ == "__main__":
+    # uvloop 为可选依赖：基于 libuv 的事件循环，调度开销更低；未安装时使用默认循环
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     asyncio.run(main())
@@ -9,16 +9,43 @@
 
 import modal
 import base64
+import os
+import hashlib
 import io
+import re
+from collections import OrderedDict
 from typing import Optional
 
 # ===== 配置 =====
 APP_NAME = "coqui-xtts-tts"
 GPU_TYPE = "T4"  # T4 ($0.24/h) 对 XTTS 足够，A10G 会更快但贵
 SCALEDOWN_WINDOW = 300  # 5 分钟无请求后释放 GPU
+# 对 GPT 解码器做 torch.compile（首次编译耗时较长，默认关闭）
+XTTS_TORCH_COMPILE = os.getenv("XTTS_TORCH_COMPILE", "0") == "1"
+# torch.compile 模式："default"，或 "reduce-overhead"（用 CUDA graphs 重放逐 token 解码步，
+# 省去 T4 上每 token 数十次 kernel launch 的开销；每个 KV 长度各录制一张图，显存占用更高）
+XTTS_COMPILE_MODE = os.getenv("XTTS_COMPILE_MODE", "default")
+# GPT 解码器权重转 FP16 + autocast 推理（显存带宽减半，启用 Tensor Core）；音质异常时设为 0
+XTTS_FP16 = os.getenv("XTTS_FP16", "1") == "1"
+
+XTTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+WEIGHTS_DIR = "/weights"
+# ModelManager 的目录布局：模型名中的 "/" 替换为 "--"
+XTTS_MODEL_DIR = f"{WEIGHTS_DIR}/{XTTS_MODEL_NAME.replace('/', '--')}"
 
 app = modal.App(APP_NAME)
 
+# 模型权重持久卷：构建镜像时下载一次，冷启动直接从卷加载（~1.8GB，免去 HF 下载）
+weights_volume = modal.Volume.from_name("tts-weights", create_if_missing=True)
+
+
+def download_xtts():
+    """镜像构建阶段把 XTTS-v2 权重下载到持久卷"""
+    from TTS.utils.manage import ModelManager
+
+    ModelManager(output_prefix=WEIGHTS_DIR).download_model(XTTS_MODEL_NAME)
+
+
 # ===== 镜像定义 =====
 
 # 1. XTTS 推理镜像 (GPU)
@@ -31,116 +58,306 @@ xtts_image = (
         "torchaudio==2.1.0",
         "numpy==1.24.3",
         "scipy",
+        "soundfile",
     )
+    # XTTS-v2 使用 CPML 许可，非交互环境下载需预先确认
+    .env({"COQUI_TOS_AGREED": "1"})
+    .run_function(download_xtts, volumes={WEIGHTS_DIR: weights_volume})
 )
 
 # 2. API Wrapper 镜像 (CPU, 轻量)
 wrapper_image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install(
-        "fastapi[standard]==0.115.4",
-        "numpy==1.24.3",
+        "fastapi==0.115.4",  # Modal 直接托管 ASGI 应用，无需 [standard] 附带的 uvicorn/CLI 等
+        "python-multipart==0.0.9",  # /tts/clone 的 multipart 上传
     )
 )
 
-# ===== GPU 推理函数 =====
+# ===== GPU 推理配置 =====
+
+XTTS_SAMPLE_RATE = 24000
+XTTS_COND_SAMPLE_RATE = 22050  # 参考音频（说话人条件）的输入采样率
+MAX_REF_SECONDS = 30  # 参考音频最多使用 30 秒
+DEFAULT_SPEAKER = "Ana Florence"  # 未提供参考音频时使用的内置说话人
+STREAM_CHUNK_SIZE = 20  # inference_stream 每次解码的 GPT token 数，越小首包越快
+SPEAKER_CACHE_SIZE = 64  # 缓存的参考音频条件数
+FIRST_CHUNK_CHARS = 120  # 长文本分段：首段较短，尽快出声
+CHUNK_CHARS = 200  # 之后每段的目标长度（XTTS 单次输入过长时质量下降、延迟超线性增长）
+# 句子边界：英文标点后需有空白（避免切开 "3.5"），中文标点后直接切分
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])")
+
+
+def split_sentences(text: str) -> list[str]:
+    """按句子边界把长文本合并成若干段，首段不超过 FIRST_CHUNK_CHARS，之后约 CHUNK_CHARS"""
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END_RE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        limit = CHUNK_CHARS if chunks else FIRST_CHUNK_CHARS
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def concat_wavs(wavs: list) -> bytes:
+    """拼接多个相同格式的 WAV（只保留第一个文件头）"""
+    import wave
+
+    frames = []
+    params = None
+    for data in wavs:
+        with wave.open(io.BytesIO(data), "rb") as wav_file:
+            params = params or wav_file.getparams()
+            frames.append(wav_file.readframes(wav_file.getnframes()))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setparams(params)
+        wav_file.writeframes(b"".join(frames))
+    return buffer.getvalue()
+
+
+def precision_context():
+    """XTTS 推理的混合精度上下文（XTTS_FP16=0 时不生效）"""
+    import torch
 
-xtts_model = None  # 全局模型缓存
+    return torch.autocast("cuda", dtype=torch.float16, enabled=XTTS_FP16)
 
 
-@app.function(
+def load_xtts_model():
+    """加载 XTTS-v2（底层 Xtts 接口，支持 inference_stream）"""
+    import torch
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.models.xtts import Xtts
+
+    print(f"加载 XTTS-v2 模型...")
+    print(f"CUDA 可用: {torch.cuda.is_available()}")
+
+    # 权重已在镜像构建阶段写入持久卷，直接从本地目录加载
+    config = XttsConfig()
+    config.load_json(os.path.join(XTTS_MODEL_DIR, "config.json"))
+
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(config, checkpoint_dir=XTTS_MODEL_DIR, use_deepspeed=False)
+
+    if torch.cuda.is_available():
+        model.cuda()
+
+    if XTTS_FP16:
+        # GPT 解码器是逐 token 的带宽瓶颈，权重转 FP16；HiFi-GAN 保留 FP32 权重，
+        # 由 autocast 决定算子精度（卷积走 FP16，归一化等易溢出的算子仍走 FP32）
+        model.gpt.half()
+        print("已启用 FP16 (GPT 解码器)")
+
+    # Ampere 及以上 (A10G/A100) 允许 TF32 矩阵乘；T4 上无影响
+    torch.set_float32_matmul_precision("high")
+
+    if XTTS_TORCH_COMPILE:
+        # KV cache 长度逐 token 变化，使用 dynamic=True 避免每个长度重新编译；
+        # reduce-overhead 模式下 CUDA graph 按形状录制，首次遇到的长度仍走普通执行
+        gpt_inference = model.gpt.gpt_inference
+        gpt_inference.forward = torch.compile(
+            gpt_inference.forward, dynamic=True, mode=XTTS_COMPILE_MODE
+        )
+        print(f"已启用 torch.compile (GPT 解码器, mode={XTTS_COMPILE_MODE})")
+
+    return model
+
+
+def conditioning_latents_from_bytes(model, wav_bytes: bytes):
+    """内存中解码参考音频并计算说话人条件（不落盘）
+
+    TTS 0.22 的 get_conditioning_latents 只接受文件路径，这里按其实现
+    直接调用 get_speaker_embedding / get_gpt_cond_latents，输入为张量。
+    """
+    from fractions import Fraction
+
+    import numpy as np
+    import soundfile as sf
+    import torch
+    from scipy.signal import resample_poly
+
+    audio, sr = sf.read(io.BytesIO(wav_bytes), dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)  # 多声道混为单声道
+
+    if sr != XTTS_COND_SAMPLE_RATE:
+        ratio = Fraction(XTTS_COND_SAMPLE_RATE, sr).limit_denominator(1000)
+        audio = resample_poly(audio, ratio.numerator, ratio.denominator).astype(np.float32)
+
+    audio = np.clip(audio[: XTTS_COND_SAMPLE_RATE * MAX_REF_SECONDS], -1.0, 1.0)
+    audio = torch.from_numpy(audio).unsqueeze(0).to(model.device)
+
+    with torch.inference_mode(), precision_context():
+        speaker_embedding = model.get_speaker_embedding(audio, XTTS_COND_SAMPLE_RATE)
+        gpt_cond_latent = model.get_gpt_cond_latents(
+            audio, XTTS_COND_SAMPLE_RATE, length=6, chunk_length=6
+        )
+    return gpt_cond_latent, speaker_embedding
+
+
+def to_pcm16(wav) -> bytes:
+    """float 波形 (torch.Tensor / np.ndarray, [-1, 1]) → 16-bit PCM bytes"""
+    import numpy as np
+
+    if hasattr(wav, "cpu"):
+        wav = wav.squeeze().cpu().numpy()
+    wav = np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0)
+    return (wav * 32767).astype(np.int16).tobytes()
+
+
+# ===== GPU 推理服务 =====
+
+# 不加 @modal.concurrent：XTTS 推理不可重入（GPT 前缀嵌入存放在共享的
+# gpt_inference.cached_prefix_emb 上），同一容器内并发请求会串用彼此的文本/说话人。
+# 长文本的分段 fan-out 由 Modal 扩容到多个容器承接
+@app.cls(
     image=xtts_image,
     gpu=GPU_TYPE,
-    min_containers=0,  # 成本优化：按需启动
+    volumes={WEIGHTS_DIR: weights_volume},
+    min_containers=1,     # 首包延迟 (TTFA) 敏感：常驻一个已加载模型的 GPU 容器
+    buffer_containers=1,  # 忙碌时额外预热一个容器，吸收突发请求
     scaledown_window=SCALEDOWN_WINDOW,
     timeout=300,  # TTS 可能需要更长时间
 )
-def synthesize_speech(
-    text: str,
-    language: str = "en",
-    speaker_wav_b64: Optional[str] = None,
-) -> bytes:
-    """
-    XTTS-v2 语音合成
+class XTTSService:
+    """XTTS-v2 推理服务（模型在容器启动时加载一次，整个容器生命周期内常驻）"""
 
-    Args:
-        text: 要合成的文本
-        language: 语言代码 (en, zh-cn, ja, etc.)
-        speaker_wav_b64: 可选的参考音频 (Base64 编码的 WAV)，用于声音克隆
-
-    Returns:
-        合成的音频数据 (WAV 格式, 24kHz, 16-bit)
-    """
-    global xtts_model
-
-    # 延迟加载模型
-    if xtts_model is None:
+    @modal.enter()
+    def load(self):
+        """加载模型、准备默认说话人并预热"""
         import torch
-        from TTS.api import TTS
 
-        print(f"加载 XTTS-v2 模型...")
-        print(f"CUDA 可用: {torch.cuda.is_available()}")
+        self.model = load_xtts_model()
 
-        # 加载 XTTS-v2 模型
-        xtts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2")
+        # 内置说话人的条件张量默认在 CPU，预先搬到 GPU，热路径上不再逐请求拷贝
+        speaker = self.model.speaker_manager.speakers[DEFAULT_SPEAKER]
+        self.default_latents = (
+            speaker["gpt_cond_latent"].to(self.model.device),
+            speaker["speaker_embedding"].to(self.model.device),
+        )
 
-        if torch.cuda.is_available():
-            xtts_model = xtts_model.to("cuda")
+        # 参考音频哈希 → (gpt_cond_latent, speaker_embedding)，热容器内跨请求复用
+        self.speaker_latents_cache: "OrderedDict[str, tuple]" = OrderedDict()
 
-        print("✅ XTTS-v2 模型加载完成")
+        # 预热：触发 CUDA 上下文、cuBLAS/cuDNN 初始化（以及 torch.compile 编译），
+        # 避免首个用户请求承担这部分延迟
+        with torch.inference_mode(), precision_context():
+            self.model.inference("Warm up.", "en", *self.default_latents)
 
-    import tempfile
-    import wave
-    import numpy as np
+        print("✅ XTTS-v2 模型加载完成")
 
-    print(f"开始合成: 文本长度={len(text)}, 语言={language}")
+    def get_speaker_latents(self, speaker_wav_b64: Optional[str]):
+        """获取说话人条件 (gpt_cond_latent, speaker_embedding)"""
+        if not speaker_wav_b64:
+            return self.default_latents
 
-    # 如果提供了参考音频，使用声音克隆
-    speaker_wav_path = None
-    if speaker_wav_b64:
         # 解码参考音频
         speaker_wav_bytes = base64.b64decode(speaker_wav_b64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            f.write(speaker_wav_bytes)
-            speaker_wav_path = f.name
+        speaker_hash = hashlib.blake2b(speaker_wav_bytes, digest_size=16).hexdigest()
+
+        # 相同参考音频直接复用，跳过 speaker encoder + GPT conditioning
+        cached = self.speaker_latents_cache.get(speaker_hash)
+        if cached is not None:
+            self.speaker_latents_cache.move_to_end(speaker_hash)
+            print(f"使用声音克隆（缓存命中）: {speaker_hash}")
+            return cached
+
         print(f"使用声音克隆，参考音频: {len(speaker_wav_bytes)} bytes")
+        latents = conditioning_latents_from_bytes(self.model, speaker_wav_bytes)
+
+        self.speaker_latents_cache[speaker_hash] = latents
+        if len(self.speaker_latents_cache) > SPEAKER_CACHE_SIZE:
+            self.speaker_latents_cache.popitem(last=False)
+        return latents
+
+    @modal.method()
+    def synthesize_speech(
+        self,
+        text: str,
+        language: str = "en",
+        speaker_wav_b64: Optional[str] = None,
+    ) -> bytes:
+        """
+        XTTS-v2 语音合成
 
-    # 合成音频
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as output_file:
-        output_path = output_file.name
-
-    try:
-        # XTTS API
-        if speaker_wav_path:
-            # 声音克隆模式
-            xtts_model.tts_to_file(
-                text=text,
-                speaker_wav=speaker_wav_path,
-                language=language,
-                file_path=output_path,
-            )
-        else:
-            # 使用默认说话人
-            xtts_model.tts_to_file(
-                text=text,
-                language=language,
-                file_path=output_path,
-            )
+        Args:
+            text: 要合成的文本
+            language: 语言代码 (en, zh-cn, ja, etc.)
+            speaker_wav_b64: 可选的参考音频 (Base64 编码的 WAV)，用于声音克隆
+
+        Returns:
+            合成的音频数据 (WAV 格式, 24kHz, 16-bit)
+        """
+        import wave
 
-        # 读取合成的音频
-        with open(output_path, 'rb') as f:
-            audio_data = f.read()
+        print(f"开始合成: 文本长度={len(text)}, 语言={language}")
 
+        gpt_cond_latent, speaker_embedding = self.get_speaker_latents(speaker_wav_b64)
+        with precision_context():
+            out = self.model.inference(text, language, gpt_cond_latent, speaker_embedding)
+
+        # 直接在内存中封装 WAV，不经过临时文件
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(XTTS_SAMPLE_RATE)
+            wav_file.writeframes(to_pcm16(out["wav"]))
+
+        audio_data = buffer.getvalue()
         print(f"✅ 合成完成: {len(audio_data)} bytes")
         return audio_data
 
-    finally:
-        # 清理临时文件
-        import os
-        if speaker_wav_path and os.path.exists(speaker_wav_path):
-            os.remove(speaker_wav_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+    @modal.method()
+    def synthesize_speech_stream(
+        self,
+        text: str,
+        language: str = "en",
+        speaker_wav_b64: Optional[str] = None,
+    ):
+        """
+        XTTS-v2 流式语音合成（生成器）
+
+        边生成边返回，首包延迟只取决于前 STREAM_CHUNK_SIZE 个 token，而不是整句长度。
+        长文本按句子分段依次合成，首段较短，首包不受全文长度影响。
+
+        Yields:
+            原始 PCM 音频块 (24kHz, 16-bit, 单声道, 小端)
+        """
+        print(f"开始流式合成: 文本长度={len(text)}, 语言={language}")
+
+        # 说话人条件每个请求只算一次，所有句子分段在同一容器内复用；
+        # GPT 前缀的 KV cache 不跨段保留（XTTS 每段以 [条件, 文本] 为前缀重新 prefill，前缀很短）
+        gpt_cond_latent, speaker_embedding = self.get_speaker_latents(speaker_wav_b64)
+
+        total_bytes = 0
+        for sentence_chunk in split_sentences(text):
+            stream = self.model.inference_stream(
+                sentence_chunk,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                stream_chunk_size=STREAM_CHUNK_SIZE,
+            )
+            while True:
+                # autocast 只包住每一步生成，不跨越 yield 泄漏到调用方
+                with precision_context():
+                    chunk = next(stream, None)
+                if chunk is None:
+                    break
+                pcm = to_pcm16(chunk)
+                total_bytes += len(pcm)
+                yield pcm
+
+        print(f"✅ 流式合成完成: {total_bytes} bytes")
 
 
 # ===== FastAPI REST 服务器 =====
@@ -149,11 +366,13 @@ def synthesize_speech(
 @modal.asgi_app()
 def wrapper():
     """永远在线的 REST API 服务器"""
-    from fastapi import FastAPI, HTTPException
+    from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+    from fastapi.responses import Response, StreamingResponse
     from pydantic import BaseModel
     from typing import Optional
 
     api = FastAPI(title="Coqui XTTS-v2 TTS Service")
+    tts_service = XTTSService()
 
     class TTSRequest(BaseModel):
         text: str
@@ -166,6 +385,32 @@ def wrapper():
         text: str
         language: str
 
+    async def synthesize_wav(text: str, language: str, speaker_wav_b64: Optional[str]) -> bytes:
+        """校验文本并调用 GPU 推理服务，返回完整 WAV"""
+        if len(text) > 5000:
+            raise HTTPException(status_code=400, detail="文本过长 (最多 5000 字符)")
+
+        if not text.strip():
+            raise HTTPException(status_code=400, detail="文本不能为空")
+
+        # 长文本按句子分段，用 map 并行分发后拼接
+        chunks = split_sentences(text)
+        if len(chunks) == 1:
+            return await tts_service.synthesize_speech.remote.aio(
+                text=chunks[0],
+                language=language,
+                speaker_wav_b64=speaker_wav_b64,
+            )
+
+        wavs = [
+            wav
+            async for wav in tts_service.synthesize_speech.map.aio(
+                chunks,
+                kwargs={"language": language, "speaker_wav_b64": speaker_wav_b64},
+            )
+        ]
+        return concat_wavs(wavs)
+
     @api.get("/health")
     async def health():
         return {"status": "ok", "service": "xtts-tts"}
@@ -203,18 +448,8 @@ def wrapper():
         - ko (Korean)
         """
         try:
-            # 验证文本长度
-            if len(request.text) > 5000:
-                raise HTTPException(status_code=400, detail="文本过长 (最多 5000 字符)")
-
-            if not request.text.strip():
-                raise HTTPException(status_code=400, detail="文本不能为空")
-
-            # 调用 GPU 推理函数
-            audio_bytes = synthesize_speech.remote(
-                text=request.text,
-                language=request.language,
-                speaker_wav_b64=request.speaker_wav_b64,
+            audio_bytes = await synthesize_wav(
+                request.text, request.language, request.speaker_wav_b64
             )
 
             # Base64 编码音频
@@ -227,10 +462,94 @@ def wrapper():
                 language=request.language,
             )
 
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"❌ TTS 错误: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
+    @api.post("/tts/binary")
+    async def text_to_speech_binary(request: TTSRequest):
+        """
+        文本转语音 API（二进制）
+
+        直接返回 WAV 字节（audio/wav），省去 Base64 编码/解码和 JSON 封装。
+        """
+        try:
+            audio_bytes = await synthesize_wav(
+                request.text, request.language, request.speaker_wav_b64
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"❌ TTS 错误: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+        return Response(
+            content=audio_bytes,
+            media_type="audio/wav",
+            headers={"X-Sample-Rate": str(XTTS_SAMPLE_RATE)},
+        )
+
+    @api.post("/tts/clone")
+    async def text_to_speech_clone(
+        text: str = Form(...),
+        language: str = Form("en"),
+        reference_audio: UploadFile = File(...),
+    ):
+        """
+        声音克隆 API（multipart/form-data）
+
+        参考音频以原始 WAV 文件上传（不做 Base64），返回 WAV 字节（audio/wav）。
+        """
+        reference_bytes = await reference_audio.read()
+        if not reference_bytes:
+            raise HTTPException(status_code=400, detail="参考音频不能为空")
+
+        try:
+            audio_bytes = await synthesize_wav(
+                text, language, base64.b64encode(reference_bytes).decode("ascii")
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"❌ TTS 错误: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+        return Response(
+            content=audio_bytes,
+            media_type="audio/wav",
+            headers={"X-Sample-Rate": str(XTTS_SAMPLE_RATE)},
+        )
+
+    @api.post("/tts/stream")
+    async def text_to_speech_stream(request: TTSRequest):
+        """
+        流式文本转语音 API
+
+        边合成边返回原始 PCM（24kHz, 16-bit, 单声道, 小端），
+        客户端收到首个音频块即可开始播放。
+        """
+        if len(request.text) > 5000:
+            raise HTTPException(status_code=400, detail="文本过长 (最多 5000 字符)")
+
+        if not request.text.strip():
+            raise HTTPException(status_code=400, detail="文本不能为空")
+
+        async def audio_chunks():
+            async for chunk in tts_service.synthesize_speech_stream.remote_gen.aio(
+                text=request.text,
+                language=request.language,
+                speaker_wav_b64=request.speaker_wav_b64,
+            ):
+                yield chunk
+
+        return StreamingResponse(
+            audio_chunks(),
+            media_type="audio/L16; rate=24000; channels=1",
+            headers={"X-Sample-Rate": "24000"},
+        )
+
     @api.get("/languages")
     async def list_languages():
         """列出支持的语言"""
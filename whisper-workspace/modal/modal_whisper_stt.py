@@ -10,93 +10,194 @@ import modal
 import base64
 import json
 import struct
-import numpy as np
 from typing import Optional
 
 # ===== 配置 =====
 WHISPER_MODEL = "medium"  # 平衡准确性和速度
 GPU_TYPE = "A10G"         # $0.6/h, whisper-medium 足够
 SCALEDOWN_WINDOW = 180    # 3 分钟无请求后释放 GPU
+MAX_BATCH_SIZE = 8        # 并发会话的语音段合并为一次前向
+BATCH_WAIT_MS = 50        # 凑批最多等待 50ms
+INT16_SCALE = 1.0 / 32768.0
+MIN_AUDIO_SEC = 0.3       # 短于 300ms 的音频段（多为 VAD 误触发）直接返回空结果
 APP_NAME = "whisper-stt"
 
+WEIGHTS_DIR = "/weights"
+
 app = modal.App(APP_NAME)
 
+# 模型权重持久卷：构建镜像时下载一次，冷启动直接从卷加载（~1.5GB）
+weights_volume = modal.Volume.from_name("whisper-weights", create_if_missing=True)
+
+
+def download_whisper():
+    """镜像构建阶段把 faster-whisper 权重下载到持久卷"""
+    from faster_whisper.utils import download_model
+
+    download_model(WHISPER_MODEL, cache_dir=WEIGHTS_DIR)
+
+
 # ===== 镜像定义 =====
 
-# 1. Whisper 推理镜像 (GPU) - 使用官方 OpenAI Whisper
+# 1. Whisper 推理镜像 (GPU) - faster-whisper (CTranslate2, INT8 权重 + FP16 计算)
+CUDA_LIBS = "/usr/local/lib/python3.11/site-packages/nvidia"
 whisper_image = (
     modal.Image.debian_slim(python_version="3.11")
-    .apt_install("ffmpeg")  # OpenAI Whisper 需要 ffmpeg
     .pip_install(
-        "openai-whisper==20231117",  # 官方实现，更稳定
+        "faster-whisper==1.0.3",
+        "ctranslate2==4.4.0",
+        "nvidia-cublas-cu12",       # CTranslate2 GPU 推理所需的 CUDA 库
+        "nvidia-cudnn-cu12==9.*",
         "numpy==1.24.3",
     )
+    .env({"LD_LIBRARY_PATH": f"{CUDA_LIBS}/cublas/lib:{CUDA_LIBS}/cudnn/lib"})
+    .run_function(download_whisper, volumes={WEIGHTS_DIR: weights_volume})
 )
 
 # 2. Wrapper 镜像 (CPU, 轻量) - FastAPI + VAD
 wrapper_image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install(
-        "fastapi[standard]==0.115.4",
+        "fastapi==0.115.4",  # Modal 直接托管 ASGI 应用，无需 [standard] 附带的 uvicorn/CLI 等
         "webrtcvad==2.0.10",
-        "numpy==1.24.3",
     )
 )
 
-# ===== GPU 推理函数 =====
+# ===== GPU 推理服务 =====
 
-whisper_model = None  # 全局模型缓存
-
-
-@app.function(
+@app.cls(
     image=whisper_image,
     gpu=GPU_TYPE,
-    min_containers=0,  # 成本优化：按需启动
+    volumes={WEIGHTS_DIR: weights_volume},
+    min_containers=0,  # 成本优化：按需启动（STT 有 AssemblyAI 主链路，不常驻）
     scaledown_window=SCALEDOWN_WINDOW,
 )
-def transcribe_audio(audio_bytes: bytes, sample_rate: int = 16000) -> dict:
-    """Whisper 音频转录（OpenAI Whisper 官方实现）
-
-    Args:
-        audio_bytes: PCM 16-bit 音频数据
-        sample_rate: 采样率（默认 16kHz）
+class WhisperService:
+    """Whisper 推理服务（模型在容器启动时加载一次，整个容器生命周期内常驻）"""
 
-    Returns:
-        {"text": str, "language": str, "language_probability": float}
-    """
-    global whisper_model
+    @modal.enter()
+    def load(self):
+        """加载 faster-whisper 模型"""
+        from faster_whisper import WhisperModel
 
-    # 延迟加载模型（仅在 GPU 容器中）
-    if whisper_model is None:
-        import whisper
-        import torch
-
-        print(f"加载 Whisper {WHISPER_MODEL} 模型...")
-        print(f"CUDA 可用: {torch.cuda.is_available()}")
-
-        whisper_model = whisper.load_model(
+        print(f"加载 Whisper {WHISPER_MODEL} 模型 (int8_float16)...")
+        self.model = WhisperModel(
             WHISPER_MODEL,
-            device="cuda" if torch.cuda.is_available() else "cpu"
+            device="cuda",
+            compute_type="int8_float16",
+            num_workers=2,
+            download_root=WEIGHTS_DIR,
+            local_files_only=True,
         )
         print("✅ 模型加载完成")
 
-    # PCM bytes → numpy float32 array
-    audio_int16 = np.frombuffer(audio_bytes, dtype=np.int16)
-    audio_float32 = audio_int16.astype(np.float32) / 32768.0  # 归一化到 [-1, 1]
+    @modal.batched(max_batch_size=MAX_BATCH_SIZE, wait_ms=BATCH_WAIT_MS)
+    def transcribe_audio(self, audio_bytes: list[bytes], sample_rate: list[int]) -> list[dict]:
+        """Whisper 音频转录（faster-whisper INT8，动态批处理）
+
+        调用方仍按单条调用 `WhisperService().transcribe_audio.remote(audio_bytes, 16000)`，
+        Modal 会把并发到达的请求合并成列表传入。
+
+        Args:
+            audio_bytes: PCM 16-bit 音频数据（每条一段）
+            sample_rate: 采样率（默认 16kHz）
+
+        Returns:
+            每段一个 {"text": str, "language": str, "language_probability": float}
+        """
+        import numpy as np
+
+        # 过短的段跳过特征提取与 GPU 编解码
+        results = [
+            {"text": "", "language": "en", "language_probability": 0.0}
+            for _ in audio_bytes
+        ]
+        active = [
+            i for i, (pcm, sr) in enumerate(zip(audio_bytes, sample_rate))
+            if len(pcm) >= 2 * sr * MIN_AUDIO_SEC
+        ]
+        if not active:
+            return results
+
+        # PCM bytes → numpy float32 array，归一化到 [-1, 1]
+        # 类型转换与缩放合并为一次运算，只分配一个 float32 数组（astype + 除法会分配两次）
+        audios = [
+            np.multiply(np.frombuffer(audio_bytes[i], dtype=np.int16), INT16_SCALE, dtype=np.float32)
+            for i in active
+        ]
+        for i, result in zip(active, transcribe_batch(self.model, audios)):
+            results[i] = result
+        return results
+
+
+def transcribe_batch(model, audios: list) -> list[dict]:
+    """对一批 float32 音频做一次编码、一次解码"""
+    import ctranslate2
+    import numpy as np
+    from faster_whisper.tokenizer import Tokenizer
+
+    print(f"开始转录: {len(audios)} 段, {sum(len(a) for a in audios)} 样本")
+
+    extractor = model.feature_extractor
+    window = extractor.n_samples  # 30s
+
+    # 超过一个 30s 窗口的音频无法放进同一批，逐条走完整 transcribe
+    if any(len(a) > window for a in audios):
+        results = []
+        for a in audios:
+            segments, info = model.transcribe(
+                a,
+                language="en",
+                beam_size=1,
+                vad_filter=False,  # 分段已由 wrapper 的 webrtcvad 完成
+                condition_on_previous_text=False,
+            )
+            results.append({
+                "text": "".join(seg.text for seg in segments).strip(),
+                "language": info.language,
+                "language_probability": info.language_probability,
+            })
+        return results
+
+    # 每段补齐到 30s 后提取特征，堆叠成 (N, n_mels, 3000) 一次编码、一次解码
+    # 复用同一个 30s 缓冲区补零，避免每段 np.pad 重新分配
+    padded = np.zeros(window, dtype=np.float32)
+    features = []
+    for a in audios:
+        padded[:len(a)] = a
+        padded[len(a):] = 0.0
+        features.append(extractor(padded, padding=False)[:, :extractor.nb_max_frames])
+    features = np.stack(features)
+    encoder_output = model.model.encode(
+        ctranslate2.StorageView.from_array(np.ascontiguousarray(features))
+    )
+
+    # 英语的置信度：取语言检测中 <|en|> 的概率，替代固定的 1.0
+    language_probs = [dict(pairs) for pairs in model.model.detect_language(encoder_output)]
 
-    # Inference
-    print(f"开始转录: {len(audio_float32)} 样本")
-    result = whisper_model.transcribe(
-        audio_float32,
-        language="en",  # English
-        fp16=True,  # 使用 FP16 加速
+    tokenizer = Tokenizer(
+        model.hf_tokenizer,
+        model.model.is_multilingual,
+        task="transcribe",
+        language="en",
+    )
+    prompt = list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+    outputs = model.model.generate(
+        encoder_output,
+        [prompt] * len(audios),
+        beam_size=1,
+        suppress_blank=True,
+        suppress_tokens=[-1],
     )
 
-    return {
-        "text": result["text"].strip(),
-        "language": result.get("language", "en"),
-        "language_probability": 1.0,  # OpenAI Whisper 不提供此字段
-    }
+    return [
+        {
+            "text": tokenizer.decode(out.sequences_ids[0]).strip(),
+            "language": "en",
+            "language_probability": float(probs.get("<|en|>", 0.0)),
+        }
+        for out, probs in zip(outputs, language_probs)
+    ]
 
 
 # ===== FastAPI WebSocket 服务器 =====
@@ -105,10 +206,12 @@ def transcribe_audio(audio_bytes: bytes, sample_rate: int = 16000) -> dict:
 @modal.asgi_app()
 def wrapper():
     """永远在线的 WebSocket 服务器 + VAD 分段"""
+    import asyncio
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect
     import webrtcvad
 
     api = FastAPI(title="Whisper STT Service")
+    whisper_service = WhisperService()
 
     # VAD 配置
     VAD_AGGRESSIVENESS = 2  # 0-3, 2 = 中等敏感度
@@ -120,6 +223,7 @@ def wrapper():
     MIN_SEGMENT_DURATION_SEC = 1.0  # 最小段长 1 秒
     MAX_SEGMENT_DURATION_SEC = 5.0  # 最大段长 5 秒
     SILENCE_THRESHOLD_FRAMES = 30   # 静音 30 帧（~1 秒）后分段
+    MAX_INFLIGHT_SEGMENTS = 2       # 每个连接最多同时进行的 GPU 转录数
 
     @api.get("/health")
     async def health():
@@ -127,35 +231,96 @@ def wrapper():
 
     @api.websocket("/ws/stt")
     async def websocket_stt(websocket: WebSocket):
-        """WebSocket STT 端点（兼容前端格式）"""
+        """WebSocket STT 端点（兼容前端格式）
+
+        客户端 → 服务器:
+        - 二进制帧: 原始 PCM（16kHz, 16-bit 小端, 单声道），长度任意（推荐）
+        - 文本帧: {"config": {"sr": 16000, "encoding": "pcm_s16le"}}（可选握手，连接后发送一次，
+          声明后续二进制帧的格式；与服务端不一致时返回 error 并关闭连接）
+        - 文本帧: {"audio_data": "<base64 PCM>"}（旧格式，保持兼容）；
+          其他 JSON 控制消息（如 {"eof": true}）忽略
+
+        服务器 → 客户端:
+        - {"message_type": "final_transcript", "text": ..., "language": ..., "confidence": ...}
+        """
         await websocket.accept()
 
         vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
         incoming_buffer = bytearray()  # 接收数据缓冲区
-        audio_segment = bytearray()    # 累积的音频段
+        segment_frames = []            # 累积的音频段（按帧保存，分段时一次 join）
+        segment_bytes = 0
         silence_frames = 0
         speech_frames = 0
 
-        try:
-            while True:
-                # 接收音频数据（Base64 编码的 PCM）
-                message = await websocket.receive_text()
-                data = json.loads(message)
+        # 接收/VAD 与 GPU 转录解耦：分段后立即创建转录任务放入队列，接收循环不等待 GPU；
+        # 发送协程按入队顺序等待结果，保证转录文本顺序与语音顺序一致
+        pending: asyncio.Queue = asyncio.Queue()
+        inflight = asyncio.Semaphore(MAX_INFLIGHT_SEGMENTS)
 
-                if "audio_data" not in data:
+        async def transcribe_segment(audio_data: bytes) -> dict:
+            async with inflight:
+                # 异步调用，不阻塞其他会话，多会话的请求才能被合并成一批
+                return await whisper_service.transcribe_audio.remote.aio(audio_data, SAMPLE_RATE)
+
+        async def send_results():
+            while True:
+                task = await pending.get()
+                try:
+                    result = await task
+                except Exception as exc:
+                    print(f"❌ 转录失败: {exc}")
                     continue
 
-                # 解码 Base64 音频
-                audio_chunk = base64.b64decode(data["audio_data"])
-                incoming_buffer.extend(audio_chunk)
+                # 返回识别结果（兼容 AssemblyAI 格式）
+                if result["text"]:
+                    await websocket.send_json({
+                        "message_type": "final_transcript",
+                        "text": result["text"],
+                        "language": result.get("language", "en"),
+                        "confidence": result.get("language_probability", 1.0),
+                    })
+                    print(f"✅ 识别完成: {result['text']}")
+
+        sender = asyncio.create_task(send_results())
+
+        try:
+            while True:
+                # 底层 receive() 同时接收二进制帧（原始 PCM）与文本帧（JSON）
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+
+                if message.get("bytes") is not None:
+                    incoming_buffer.extend(message["bytes"])
+                else:
+                    data = json.loads(message.get("text") or "{}")
+                    if "config" in data:
+                        config = data["config"]
+                        if (config.get("sr", SAMPLE_RATE) != SAMPLE_RATE
+                                or config.get("encoding", "pcm_s16le") != "pcm_s16le"):
+                            await websocket.send_json({
+                                "message_type": "error",
+                                "error": f"仅支持 {SAMPLE_RATE}Hz pcm_s16le 音频，收到: {config}",
+                            })
+                            await websocket.close(code=1003)
+                            return
+                        continue
+                    if "audio_data" not in data:
+                        continue
+                    # 旧格式：Base64 编码的 PCM
+                    incoming_buffer.extend(base64.b64decode(data["audio_data"]))
 
                 # VAD 检测（每 30ms 一帧）
-                while len(incoming_buffer) >= BYTES_PER_FRAME:
-                    frame = bytes(incoming_buffer[:BYTES_PER_FRAME])
-                    incoming_buffer = incoming_buffer[BYTES_PER_FRAME:]
+                # 用读指针 + memoryview 取帧，避免每帧重切 bytearray（O(n) 拷贝）
+                read_pos = 0
+                view = memoryview(incoming_buffer)
+                while len(incoming_buffer) - read_pos >= BYTES_PER_FRAME:
+                    frame = view[read_pos:read_pos + BYTES_PER_FRAME].tobytes()
+                    read_pos += BYTES_PER_FRAME
 
                     # 将帧添加到音频段
-                    audio_segment.extend(frame)
+                    segment_frames.append(frame)
+                    segment_bytes += BYTES_PER_FRAME
 
                     # VAD 判断是否有语音
                     is_speech = vad.is_speech(frame, SAMPLE_RATE)
@@ -167,7 +332,7 @@ def wrapper():
                         silence_frames += 1
 
                     # 分段条件
-                    segment_duration = len(audio_segment) / (SAMPLE_RATE * 2)  # 秒
+                    segment_duration = segment_bytes / (SAMPLE_RATE * 2)  # 秒
                     should_segment = False
 
                     if speech_frames > 0:
@@ -179,34 +344,32 @@ def wrapper():
                             should_segment = True
 
                     if should_segment and segment_duration >= MIN_SEGMENT_DURATION_SEC:
-                        # 调用 GPU 推理
-                        audio_data = bytes(audio_segment)
+                        # 提交 GPU 推理（不等待结果，继续 VAD 分段）
+                        audio_data = b"".join(segment_frames)
                         if len(audio_data) > 0:
                             print(f"处理音频段: {len(audio_data)} bytes, {segment_duration:.1f}秒")
-
-                            # 远程调用 GPU 函数
-                            result = transcribe_audio.remote(audio_data, SAMPLE_RATE)
-
-                            # 返回识别结果（兼容 AssemblyAI 格式）
-                            if result["text"]:
-                                await websocket.send_json({
-                                    "message_type": "final_transcript",
-                                    "text": result["text"],
-                                    "language": result.get("language", "en"),
-                                    "confidence": result.get("language_probability", 1.0),
-                                })
-                                print(f"✅ 识别完成: {result['text']}")
+                            pending.put_nowait(asyncio.create_task(transcribe_segment(audio_data)))
 
                         # 重置音频段缓冲区
-                        audio_segment.clear()
+                        segment_frames = []
+                        segment_bytes = 0
                         speech_frames = 0
                         silence_frames = 0
 
+                # 释放视图后一次性丢弃已处理的字节（剩余不足一帧，拷贝量很小）
+                view.release()
+                del incoming_buffer[:read_pos]
+
         except WebSocketDisconnect:
             print("WebSocket 连接断开")
         except Exception as exc:
             print(f"❌ WebSocket 错误: {exc}")
             await websocket.close()
+        finally:
+            # 连接已断开，结果无法再发送：取消发送协程与未完成的转录
+            sender.cancel()
+            while not pending.empty():
+                pending.get_nowait().cancel()
 
     return api
 
@@ -73,19 +73,28 @@ def record_audio(duration=5, output_file=None, device_index=None):
             frames_per_buffer=CHUNK
         )
 
-        frames = []
+        # 预分配整段录音缓冲区，逐块原地写入，无需最后 join
+        n_chunks = int(RATE / CHUNK * duration)
+        chunk_bytes = CHUNK * p.get_sample_size(FORMAT) * CHANNELS
+        buffer = bytearray(n_chunks * chunk_bytes)
+        view = memoryview(buffer)
+
+        # 进度条最多刷新 20 次
+        progress_every = max(1, n_chunks // 20)
+        bar_length = 30
 
         # 录音
-        for i in range(0, int(RATE / CHUNK * duration)):
-            data = stream.read(CHUNK)
-            frames.append(data)
+        for i in range(n_chunks):
+            # 输入溢出时不抛异常，避免长时间录音中途失败
+            data = stream.read(CHUNK, exception_on_overflow=False)
+            view[i * chunk_bytes:(i + 1) * chunk_bytes] = data
 
             # 显示进度
-            progress = (i + 1) / (RATE / CHUNK * duration)
-            bar_length = 30
-            filled = int(bar_length * progress)
-            bar = '=' * filled + '-' * (bar_length - filled)
-            print(f'\r[{bar}] {int(progress * 100)}%', end='', flush=True)
+            if (i + 1) % progress_every == 0 or i + 1 == n_chunks:
+                progress = (i + 1) / n_chunks
+                filled = int(bar_length * progress)
+                bar = '=' * filled + '-' * (bar_length - filled)
+                print(f'\r[{bar}] {int(progress * 100)}%', end='', flush=True)
 
         print("\n\n录音完成!")
 
@@ -99,7 +108,7 @@ def record_audio(duration=5, output_file=None, device_index=None):
             wf.setnchannels(CHANNELS)
             wf.setsampwidth(p.get_sample_size(FORMAT))
             wf.setframerate(RATE)
-            wf.writeframes(b''.join(frames))
+            wf.writeframes(buffer)
 
         # 获取文件信息
         file_size = os.path.getsize(output_file)
@@ -1,9 +1,18 @@
 """将音频文件重采样到 16kHz"""
 
 import wave
+from fractions import Fraction
+
 import numpy as np
 from scipy import signal
 
+
+def to_dtype(audio, dtype):
+    """浮点结果四舍五入并裁剪到整数类型范围，避免回绕溢出"""
+    info = np.iinfo(dtype)
+    return np.clip(np.rint(audio), info.min, info.max).astype(dtype)
+
+
 def resample_wav(input_file, output_file, target_rate=16000):
     """将 WAV 文件重采样到目标采样率"""
 
@@ -37,16 +46,20 @@ def resample_wav(input_file, output_file, target_rate=16000):
 
         # 如果是立体声，转换为单声道
         if n_channels == 2:
-            audio_array = audio_array.reshape(-1, 2).mean(axis=1).astype(dtype)
+            audio_array = to_dtype(audio_array.reshape(-1, 2).mean(axis=1), dtype)
             n_channels = 1
             print(f"\n转换立体声为单声道")
 
         # 重采样
         if framerate != target_rate:
             print(f"\n重采样: {framerate} Hz -> {target_rate} Hz")
-            num_samples = int(len(audio_array) * target_rate / framerate)
-            audio_resampled = signal.resample(audio_array, num_samples)
-            audio_resampled = audio_resampled.astype(dtype)
+            # 多相 FIR 重采样 (如 44.1k -> 16k 即 up=160, down=441)：
+            # 线性时间和内存，比对整段做 FFT 的 signal.resample 快得多，抗混叠也更好
+            frac = Fraction(target_rate, framerate).limit_denominator(1000)
+            audio_resampled = signal.resample_poly(
+                audio_array.astype(np.float32), frac.numerator, frac.denominator
+            )
+            audio_resampled = to_dtype(audio_resampled, dtype)
         else:
             audio_resampled = audio_array
 
@@ -1,72 +1,91 @@
 """测试 Modal XTTS-v2 TTS 服务"""
 
-import requests
-import base64
+import aiohttp
+import asyncio
+import os
 import wave
 import time
 from datetime import datetime
 
+from colors import Colors, FAILED, PASSED, fail, ok
+
 # Modal REST API URL
-TTS_URL = "https://yuanbopang--coqui-xtts-tts-wrapper.modal.run/tts"
+TTS_URL = "https://yuanbopang--coqui-xtts-tts-wrapper.modal.run/tts/binary"  # 直接返回 WAV 字节
+CLONE_URL = "https://yuanbopang--coqui-xtts-tts-wrapper.modal.run/tts/clone"  # multipart 上传参考音频
 HEALTH_URL = "https://yuanbopang--coqui-xtts-tts-wrapper.modal.run/health"
 LANGUAGES_URL = "https://yuanbopang--coqui-xtts-tts-wrapper.modal.run/languages"
 
-# ANSI 颜色代码
-class Colors:
-    GREEN = '\033[92m'
-    BLUE = '\033[94m'
-    YELLOW = '\033[93m'
-    RED = '\033[91m'
-    CYAN = '\033[96m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
+
+def make_session() -> aiohttp.ClientSession:
+    """创建共享会话：同一个连接池内复用 keep-alive 连接、TLS 会话与 DNS 缓存"""
+    connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300, enable_cleanup_closed=True)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=180))
+
+
+async def post_audio(session: aiohttp.ClientSession, url: str, output_file: str, timeout: float, **kwargs) -> int:
+    """POST 请求并把返回的 WAV 流式写入文件（不在内存中缓冲整段音频），返回字节数"""
+    size = 0
+    async with session.post(
+        url,
+        headers={"Accept": "audio/wav"},
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        **kwargs,
+    ) as response:
+        response.raise_for_status()
+        with open(output_file, 'wb') as f:
+            async for chunk in response.content.iter_chunked(16384):
+                f.write(chunk)
+                size += len(chunk)
+    return size
+
+
+async def get_json(session: aiohttp.ClientSession, url: str, timeout: float = 10) -> dict:
+    """GET 请求并解析 JSON 响应"""
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        response.raise_for_status()
+        return await response.json()
 
 
-def test_health_check():
+async def test_health_check(session: aiohttp.ClientSession):
     """测试健康检查"""
     print(f"\n{Colors.BLUE}📡 测试健康检查...{Colors.RESET}")
 
     try:
-        response = requests.get(HEALTH_URL, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-        print(f"{Colors.GREEN}✓ 健康检查通过{Colors.RESET}")
+        data = await get_json(session, HEALTH_URL)
+        print(ok("健康检查通过"))
         print(f"  状态: {data.get('status')}")
         print(f"  服务: {data.get('service')}")
         return True
 
     except Exception as e:
-        print(f"{Colors.RED}✗ 健康检查失败: {e}{Colors.RESET}")
+        print(fail(f"健康检查失败: {e}"))
         return False
 
 
-def test_list_languages():
+async def test_list_languages(session: aiohttp.ClientSession):
     """列出支持的语言"""
     print(f"\n{Colors.BLUE}🌍 获取支持的语言列表...{Colors.RESET}")
 
     try:
-        response = requests.get(LANGUAGES_URL, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
+        data = await get_json(session, LANGUAGES_URL)
         languages = data.get('languages', {})
 
-        print(f"{Colors.GREEN}✓ 支持 {len(languages)} 种语言:{Colors.RESET}")
+        print(ok(f"支持 {len(languages)} 种语言:"))
         for code, name in languages.items():
             print(f"  {code}: {name}")
         return True
 
     except Exception as e:
-        print(f"{Colors.RED}✗ 获取语言列表失败: {e}{Colors.RESET}")
+        print(fail(f"获取语言列表失败: {e}"))
         return False
 
 
-def test_tts_synthesis(text: str, language: str = "en", output_file: str = "output_tts.wav"):
+async def test_tts_synthesis(session: aiohttp.ClientSession, text: str, language: str = "en", output_file: str = "output_tts.wav"):
     """
     测试 TTS 合成
 
     Args:
+        session: 共享的 aiohttp 会话
         text: 要合成的文本
         language: 语言代码
         output_file: 输出文件名
@@ -86,27 +105,14 @@ def test_tts_synthesis(text: str, language: str = "en", output_file: str = "outp
         }
 
         print(f"\n{Colors.YELLOW}⏳ 发送请求到 GPU 服务器...{Colors.RESET}")
-        response = requests.post(TTS_URL, json=payload, timeout=120)  # TTS 可能需要较长时间
-        response.raise_for_status()
+        audio_size = await post_audio(session, TTS_URL, output_file, timeout=120, json=payload)  # TTS 可能需要较长时间
 
         elapsed = time.time() - start_time
 
-        # 解析响应
-        data = response.json()
-        audio_b64 = data.get('audio_b64')
-        sample_rate = data.get('sample_rate', 24000)
-
-        if not audio_b64:
-            print(f"{Colors.RED}✗ 未收到音频数据{Colors.RESET}")
+        if not audio_size:
+            print(fail("未收到音频数据"))
             return False
 
-        # 解码音频
-        audio_bytes = base64.b64decode(audio_b64)
-
-        # 保存为 WAV 文件
-        with open(output_file, 'wb') as f:
-            f.write(audio_bytes)
-
         # 获取音频信息
         with wave.open(output_file, 'rb') as wav_file:
             n_channels = wav_file.getnchannels()
@@ -115,9 +121,9 @@ def test_tts_synthesis(text: str, language: str = "en", output_file: str = "outp
             n_frames = wav_file.getnframes()
             duration = n_frames / framerate
 
-        print(f"\n{Colors.GREEN}✓ TTS 合成成功!{Colors.RESET}")
+        print("\n" + ok("TTS 合成成功!"))
         print(f"  耗时: {elapsed:.2f}秒")
-        print(f"  音频大小: {len(audio_bytes)} bytes")
+        print(f"  音频大小: {audio_size} bytes")
         print(f"  音频时长: {duration:.2f}秒")
         print(f"  采样率: {framerate}Hz")
         print(f"  声道: {n_channels}")
@@ -126,21 +132,22 @@ def test_tts_synthesis(text: str, language: str = "en", output_file: str = "outp
 
         return True
 
-    except requests.exceptions.Timeout:
-        print(f"{Colors.RED}✗ 请求超时 (GPU 可能正在冷启动，首次请求需要 40-60 秒){Colors.RESET}")
+    except asyncio.TimeoutError:
+        print(fail("请求超时 (GPU 可能正在冷启动，首次请求需要 40-60 秒)"))
         return False
     except Exception as e:
-        print(f"{Colors.RED}✗ TTS 合成失败: {e}{Colors.RESET}")
+        print(fail(f"TTS 合成失败: {e}"))
         import traceback
         traceback.print_exc()
         return False
 
 
-def test_voice_cloning(text: str, reference_audio: str, language: str = "en", output_file: str = "output_cloned.wav"):
+async def test_voice_cloning(session: aiohttp.ClientSession, text: str, reference_audio: str, language: str = "en", output_file: str = "output_cloned.wav"):
     """
     测试声音克隆
 
     Args:
+        session: 共享的 aiohttp 会话
         text: 要合成的文本
         reference_audio: 参考音频文件路径 (WAV)
         language: 语言代码
@@ -153,64 +160,49 @@ def test_voice_cloning(text: str, reference_audio: str, language: str = "en", ou
     print(f"  输出: {output_file}")
 
     try:
-        # 读取参考音频
-        with open(reference_audio, 'rb') as f:
-            reference_audio_bytes = f.read()
-
-        reference_audio_b64 = base64.b64encode(reference_audio_bytes).decode('utf-8')
-
-        print(f"  参考音频大小: {len(reference_audio_bytes)} bytes")
+        print(f"  参考音频大小: {os.path.getsize(reference_audio)} bytes")
 
-        # 发送 TTS 请求
+        # 发送 TTS 请求（参考音频以 multipart 原始字节上传，不做 Base64）
         start_time = time.time()
 
-        payload = {
-            "text": text,
-            "language": language,
-            "speaker_wav_b64": reference_audio_b64,
-        }
-
         print(f"\n{Colors.YELLOW}⏳ 发送声音克隆请求...{Colors.RESET}")
-        response = requests.post(TTS_URL, json=payload, timeout=180)
-        response.raise_for_status()
+        with open(reference_audio, 'rb') as f:
+            form = aiohttp.FormData()
+            form.add_field("text", text)
+            form.add_field("language", language)
+            form.add_field(
+                "reference_audio", f,
+                filename=os.path.basename(reference_audio),
+                content_type="audio/wav",
+            )
+            audio_size = await post_audio(session, CLONE_URL, output_file, timeout=180, data=form)
 
         elapsed = time.time() - start_time
 
-        # 解析响应
-        data = response.json()
-        audio_b64 = data.get('audio_b64')
-
-        if not audio_b64:
-            print(f"{Colors.RED}✗ 未收到音频数据{Colors.RESET}")
+        if not audio_size:
+            print(fail("未收到音频数据"))
             return False
 
-        # 解码音频
-        audio_bytes = base64.b64decode(audio_b64)
-
-        # 保存为 WAV 文件
-        with open(output_file, 'wb') as f:
-            f.write(audio_bytes)
-
         # 获取音频信息
         with wave.open(output_file, 'rb') as wav_file:
             duration = wav_file.getnframes() / wav_file.getframerate()
 
-        print(f"\n{Colors.GREEN}✓ 声音克隆成功!{Colors.RESET}")
+        print("\n" + ok("声音克隆成功!"))
         print(f"  耗时: {elapsed:.2f}秒")
-        print(f"  音频大小: {len(audio_bytes)} bytes")
+        print(f"  音频大小: {audio_size} bytes")
         print(f"  音频时长: {duration:.2f}秒")
         print(f"  已保存: {output_file}")
 
         return True
 
     except Exception as e:
-        print(f"{Colors.RED}✗ 声音克隆失败: {e}{Colors.RESET}")
+        print(fail(f"声音克隆失败: {e}"))
         import traceback
         traceback.print_exc()
         return False
 
 
-def run_comprehensive_tests():
+async def run_comprehensive_tests():
     """运行综合测试"""
     print("\n" + "=" * 70)
     print(f"{Colors.BOLD}{Colors.CYAN}🎙️  Modal XTTS-v2 TTS 综合测试{Colors.RESET}")
@@ -218,43 +210,41 @@ def run_comprehensive_tests():
     print(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 70)
 
-    results = []
-
-    # 测试 1: 健康检查
-    results.append(("健康检查", test_health_check()))
-
-    # 测试 2: 语言列表
-    results.append(("语言列表", test_list_languages()))
-
-    # 测试 3: 英文 TTS
-    results.append((
-        "英文 TTS",
-        test_tts_synthesis(
-            text="Hello! This is a test of the XTTS voice synthesis system. It can generate natural-sounding speech in multiple languages.",
-            language="en",
-            output_file="test_output_en.wav"
-        )
-    ))
-
-    # 测试 4: 中文 TTS
-    results.append((
-        "中文 TTS",
-        test_tts_synthesis(
-            text="你好！这是一个语音合成系统的测试。它可以生成多种语言的自然语音。",
-            language="zh-cn",
-            output_file="test_output_zh.wav"
-        )
-    ))
-
-    # 测试 5: 长文本 TTS
-    results.append((
-        "长文本 TTS",
-        test_tts_synthesis(
-            text="The quick brown fox jumps over the lazy dog. This is a pangram sentence that contains every letter of the English alphabet. It is commonly used for testing fonts, keyboards, and voice synthesis systems. The quality of text-to-speech systems has improved dramatically in recent years thanks to advances in deep learning.",
-            language="en",
-            output_file="test_output_long.wav"
-        )
-    ))
+    # 各测试互相独立，并发执行：总耗时接近最慢的一项而不是各项之和。
+    # 每个测试各自完成请求 → 写盘 → wave 解析，某个响应的落盘/解析
+    # 与其他请求的 GPU 合成重叠，不再串行排在下一个请求之前
+    # （共享同一个 aiohttp 会话/连接池；并发时各测试的输出会交错，摘要按原顺序汇总）
+    async with make_session() as session:
+        tests = [
+            # 测试 1: 健康检查
+            ("健康检查", test_health_check(session)),
+            # 测试 2: 语言列表
+            ("语言列表", test_list_languages(session)),
+            # 测试 3: 英文 TTS
+            ("英文 TTS", test_tts_synthesis(
+                session,
+                text="Hello! This is a test of the XTTS voice synthesis system. It can generate natural-sounding speech in multiple languages.",
+                language="en",
+                output_file="test_output_en.wav"
+            )),
+            # 测试 4: 中文 TTS
+            ("中文 TTS", test_tts_synthesis(
+                session,
+                text="你好！这是一个语音合成系统的测试。它可以生成多种语言的自然语音。",
+                language="zh-cn",
+                output_file="test_output_zh.wav"
+            )),
+            # 测试 5: 长文本 TTS
+            ("长文本 TTS", test_tts_synthesis(
+                session,
+                text="The quick brown fox jumps over the lazy dog. This is a pangram sentence that contains every letter of the English alphabet. It is commonly used for testing fonts, keyboards, and voice synthesis systems. The quality of text-to-speech systems has improved dramatically in recent years thanks to advances in deep learning.",
+                language="en",
+                output_file="test_output_long.wav"
+            )),
+        ]
+
+        outcomes = await asyncio.gather(*(test for _, test in tests))
+        results = [(name, outcome) for (name, _), outcome in zip(tests, outcomes)]
 
     # 打印测试摘要
     print("\n" + "=" * 70)
@@ -265,7 +255,7 @@ def run_comprehensive_tests():
     total = len(results)
 
     for test_name, result in results:
-        status = f"{Colors.GREEN}✓ 通过{Colors.RESET}" if result else f"{Colors.RED}✗ 失败{Colors.RESET}"
+        status = PASSED if result else FAILED
         print(f"{test_name}: {status}")
 
     print("=" * 70)
@@ -273,6 +263,12 @@ def run_comprehensive_tests():
     print("=" * 70)
 
 
+async def run_single(test, *args):
+    """命令行模式：在独立会话中运行单个测试"""
+    async with make_session() as session:
+        return await test(session, *args)
+
+
 if __name__ == "__main__":
     import sys
 
@@ -281,10 +277,10 @@ if __name__ == "__main__":
         mode = sys.argv[1]
 
         if mode == "health":
-            test_health_check()
+            asyncio.run(run_single(test_health_check))
 
         elif mode == "languages":
-            test_list_languages()
+            asyncio.run(run_single(test_list_languages))
 
         elif mode == "tts":
             # python test_tts.py tts "Your text here" [language] [output_file]
@@ -292,7 +288,7 @@ if __name__ == "__main__":
             language = sys.argv[3] if len(sys.argv) > 3 else "en"
             output = sys.argv[4] if len(sys.argv) > 4 else "output_tts.wav"
 
-            test_tts_synthesis(text, language, output)
+            asyncio.run(run_single(test_tts_synthesis, text, language, output))
 
         elif mode == "clone":
             # python test_tts.py clone "Your text here" reference.wav [language] [output_file]
@@ -305,7 +301,7 @@ if __name__ == "__main__":
             language = sys.argv[4] if len(sys.argv) > 4 else "en"
             output = sys.argv[5] if len(sys.argv) > 5 else "output_cloned.wav"
 
-            test_voice_cloning(text, reference, language, output)
+            asyncio.run(run_single(test_voice_cloning, text, reference, language, output))
 
         else:
             print(f"未知模式: {mode}")
@@ -317,4 +313,4 @@ if __name__ == "__main__":
 
     else:
         # 默认：运行综合测试
-        run_comprehensive_tests()
+        asyncio.run(run_comprehensive_tests())
@@ -5,24 +5,26 @@
 import asyncio
 import websockets
 import json
-import base64
-import wave
 import time
 from datetime import datetime
 from typing import Optional
 
+from audio_fixtures import load_pcm16
+from colors import Colors, ok
+
+# orjson 为可选依赖，解析更快；未安装时退回标准库
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
+
 # Modal WebSocket URL
 WS_URL = "wss://yuanbopang--whisper-stt-wrapper.modal.run/ws/stt"
 
-# ANSI 颜色代码
-class Colors:
-    GREEN = '\033[92m'
-    BLUE = '\033[94m'
-    YELLOW = '\033[93m'
-    RED = '\033[91m'
-    CYAN = '\033[96m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
+PROGRESS_INTERVAL = 1.0  # 发送进度最多每秒刷新一次
+
+# 会话配置：连接后以一个文本帧发送一次，之后的音频全部是原始 PCM 二进制帧
+SESSION_CONFIG = json.dumps({"config": {"sr": 16000, "encoding": "pcm_s16le"}})
 
 
 class WebSocketSTTClient:
@@ -40,11 +42,13 @@ class WebSocketSTTClient:
         print(f"{Colors.BLUE}🔌 连接到: {self.url}{Colors.RESET}")
         connect_start = time.time()
 
-        self.websocket = await websockets.connect(self.url)
+        # PCM 几乎无法压缩：关闭 permessage-deflate 省去每帧 zlib 开销；不限制接收消息大小
+        self.websocket = await websockets.connect(self.url, compression=None, max_size=None)
+        await self.websocket.send(SESSION_CONFIG)
         self.start_time = time.time()
 
         connect_time = time.time() - connect_start
-        print(f"{Colors.GREEN}✓ 连接成功 (耗时: {connect_time:.2f}秒){Colors.RESET}\n")
+        print(ok(f"连接成功 (耗时: {connect_time:.2f}秒)") + "\n")
 
     async def disconnect(self):
         """关闭连接"""
@@ -64,55 +68,58 @@ class WebSocketSTTClient:
         print(f"   文件: {audio_file}")
         print(f"   块大小: {chunk_duration_ms}ms\n")
 
-        # 读取音频文件
-        with wave.open(audio_file, 'rb') as wav_file:
-            sample_rate = wav_file.getframerate()
-            num_channels = wav_file.getnchannels()
-            sample_width = wav_file.getsampwidth()
+        # 读取音频文件（每次读取都校验 WAV 头，格式不符直接报错；采样走 .s16.npy 缓存）
+        samples = load_pcm16(audio_file)
+        sample_rate = 16000
 
-            # 检查格式
-            assert sample_rate == 16000, f"采样率必须是 16000Hz，当前为 {sample_rate}Hz"
-            assert num_channels == 1, f"必须是单声道，当前为 {num_channels}声道"
-            assert sample_width == 2, f"必须是 16-bit，当前为 {sample_width*8}-bit"
+        # 计算每个块的字节数
+        bytes_per_chunk = int(sample_rate * (chunk_duration_ms / 1000) * 2)  # 16-bit = 2 bytes
 
-            # 计算每个块的字节数
-            bytes_per_chunk = int(sample_rate * (chunk_duration_ms / 1000) * 2)  # 16-bit = 2 bytes
+        total_frames = len(samples)
+        total_duration = total_frames / sample_rate
 
-            total_frames = wav_file.getnframes()
-            total_duration = total_frames / sample_rate
+        print(f"   音频时长: {total_duration:.2f}秒")
+        print(f"   每块字节: {bytes_per_chunk} bytes\n")
 
-            print(f"   音频时长: {total_duration:.2f}秒")
-            print(f"   每块字节: {bytes_per_chunk} bytes\n")
+        # 发送前一次性切好所有块（字节 memoryview 切片，不复制，直接引用 memmap），
+        # 定时发送循环里只剩 send + 节拍等待
+        audio_view = memoryview(samples).cast('B')
+        chunks = [
+            audio_view[offset:offset + bytes_per_chunk]
+            for offset in range(0, len(audio_view), bytes_per_chunk)
+        ]
 
-            # 流式发送音频
-            chunk_count = 0
-            bytes_sent = 0
+        # 流式发送音频
+        chunk_count = 0
+        bytes_sent = 0
 
-            while True:
-                # 读取一个音频块
-                audio_chunk = wav_file.readframes(int(bytes_per_chunk / 2))
-                if not audio_chunk:
-                    break
+        # 按单调时钟的固定节拍发送：下一个截止时间累加，发送耗时不会累积成漂移
+        period = chunk_duration_ms / 1000
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        last_print = deadline
 
-                chunk_count += 1
-                bytes_sent += len(audio_chunk)
+        for audio_chunk in chunks:
+            chunk_count += 1
+            bytes_sent += len(audio_chunk)
 
-                # Base64 编码
-                audio_b64 = base64.b64encode(audio_chunk).decode('utf-8')
+            # 原始 PCM 直接作为二进制帧发送（无 Base64/JSON 封装）
+            await self.websocket.send(audio_chunk)
 
-                # 发送 JSON 消息
-                message = json.dumps({"audio_data": audio_b64})
-                await self.websocket.send(message)
-
-                # 显示进度
+            # 显示进度：按时间限频（最多每秒一次），不在每个发送节拍里同步刷终端
+            now = loop.time()
+            if now - last_print >= PROGRESS_INTERVAL:
+                last_print = now
                 progress = (bytes_sent / (total_frames * 2)) * 100
-                if chunk_count % 10 == 0:
-                    print(f"\r   {Colors.CYAN}发送进度: {progress:.1f}% ({chunk_count} 块){Colors.RESET}", end='', flush=True)
+                print(f"\r   {Colors.CYAN}发送进度: {progress:.1f}% ({chunk_count} 块){Colors.RESET}", end='', flush=True)
 
-                # 模拟实时采集延迟
-                await asyncio.sleep(chunk_duration_ms / 1000)
+            # 模拟实时采集节拍
+            deadline += period
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
 
-            print(f"\n{Colors.GREEN}✓ 音频发送完成 (共 {chunk_count} 块, {bytes_sent} bytes){Colors.RESET}\n")
+        print("\n" + ok(f"音频发送完成 (共 {chunk_count} 块, {bytes_sent} bytes)") + "\n")
 
     async def receive_results(self, timeout: float = 60.0):
         """
@@ -126,7 +133,7 @@ class WebSocketSTTClient:
         try:
             while True:
                 result = await asyncio.wait_for(self.websocket.recv(), timeout=timeout)
-                result_data = json.loads(result)
+                result_data = json_loads(result)
 
                 # 记录首个结果时间
                 if self.first_result_time is None:
@@ -159,7 +166,7 @@ class WebSocketSTTClient:
             if len(self.results_received) == 0:
                 print(f"{Colors.RED}⚠️  超时 ({timeout}秒) - 未收到任何结果{Colors.RESET}")
             else:
-                print(f"{Colors.GREEN}✓ 接收完成 (超时退出，共收到 {len(self.results_received)} 个结果){Colors.RESET}")
+                print(ok(f"接收完成 (超时退出，共收到 {len(self.results_received)} 个结果)"))
 
         except websockets.exceptions.ConnectionClosed:
             print(f"{Colors.YELLOW}🔌 连接已关闭{Colors.RESET}")
@@ -273,6 +280,13 @@ async def test_slow_streaming():
 if __name__ == "__main__":
     import sys
 
+    # uvloop 为可选依赖：基于 libuv 的事件循环，调度开销更低；未安装时使用默认循环
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     if len(sys.argv) > 1:
         mode = sys.argv[1]
         if mode == "rapid":
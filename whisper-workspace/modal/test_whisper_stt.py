@@ -3,33 +3,44 @@
 import asyncio
 import websockets
 import json
-import base64
-import wave
 import numpy as np
+from functools import lru_cache
+
+from audio_fixtures import load_pcm16
+
+# orjson 为可选依赖，解析更快；未安装时退回标准库
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
 
 # Modal WebSocket URL
 WS_URL = "wss://yuanbopang--whisper-stt-wrapper.modal.run/ws/stt"
+# PCM 几乎无法压缩：关闭 permessage-deflate 省去每帧 zlib 开销；不限制接收消息大小
+WS_CONNECT_KWARGS = {"compression": None, "max_size": None}
+
+
+@lru_cache(maxsize=8)
+def make_test_tone(freq: float, duration: float, sample_rate: int) -> bytes:
+    """生成正弦波测试音频 (16-bit PCM)，全程 float32 计算，相同参数只生成一次"""
+    num_samples = int(sample_rate * duration)
+    phases = np.arange(num_samples, dtype=np.float32) * np.float32(2 * np.pi * freq / sample_rate)
+    return np.rint(np.sin(phases) * np.float32(32767)).astype(np.int16).tobytes()
 
 async def test_websocket_stt():
     """测试 WebSocket STT 服务"""
     print(f"连接到 Whisper STT 服务: {WS_URL}")
 
     try:
-        async with websockets.connect(WS_URL) as websocket:
+        async with websockets.connect(WS_URL, **WS_CONNECT_KWARGS) as websocket:
             print("✓ WebSocket 连接成功")
 
             # 生成测试音频数据 (1秒静音 PCM 16-bit, 16kHz)
             sample_rate = 16000
             duration = 2  # 2秒
-            num_samples = sample_rate * duration
 
             # 生成简单的正弦波作为测试音频 (440 Hz, A音)
-            t = np.linspace(0, duration, num_samples, False)
-            audio_signal = np.sin(2 * np.pi * 440 * t)
-
-            # 转换为 16-bit PCM
-            audio_int16 = (audio_signal * 32767).astype(np.int16)
-            audio_bytes = audio_int16.tobytes()
+            audio_bytes = make_test_tone(440, duration, sample_rate)
 
             print(f"发送测试音频数据: {len(audio_bytes)} bytes ({duration}秒, {sample_rate}Hz)")
 
@@ -38,15 +49,8 @@ async def test_websocket_stt():
             for i in range(0, len(audio_bytes), chunk_size):
                 chunk = audio_bytes[i:i+chunk_size]
 
-                # Base64 编码
-                audio_b64 = base64.b64encode(chunk).decode('utf-8')
-
-                # 发送 JSON 消息
-                message = json.dumps({
-                    "audio_data": audio_b64
-                })
-
-                await websocket.send(message)
+                # 原始 PCM 直接作为二进制帧发送（无 Base64/JSON 封装）
+                await websocket.send(chunk)
                 print(f"  发送音频块 {i//chunk_size + 1}/{(len(audio_bytes) + chunk_size - 1)//chunk_size}")
 
                 # 模拟实时流，稍微延迟
@@ -57,7 +61,7 @@ async def test_websocket_stt():
             # 等待接收转录结果 (最多等待10秒)
             try:
                 result = await asyncio.wait_for(websocket.recv(), timeout=15.0)
-                result_data = json.loads(result)
+                result_data = json_loads(result)
 
                 print("\n✓ 收到转录结果:")
                 print(f"  类型: {result_data.get('message_type')}")
@@ -78,58 +82,44 @@ async def test_websocket_stt():
         traceback.print_exc()
 
 
-async def test_with_audio_file(audio_file_path: str):
-    """使用真实音频文件测试"""
+FAST_CHUNK_BYTES = 65536  # 非实时模式每帧字节数（~2 秒音频）
+
+
+async def test_with_audio_file(audio_file_path: str, realtime: bool = False):
+    """使用真实音频文件测试
+
+    realtime=True 时按 100ms 块节拍发送（模拟麦克风）；默认尽快以 64KB 大帧上传，
+    不做 sleep，服务端的 VAD 分段不受帧长影响
+    """
     print(f"连接到 Whisper STT 服务: {WS_URL}")
     print(f"音频文件: {audio_file_path}")
 
     try:
-        async with websockets.connect(WS_URL) as websocket:
+        async with websockets.connect(WS_URL, **WS_CONNECT_KWARGS) as websocket:
             print("✓ WebSocket 连接成功")
 
-            # 读取 WAV 文件
-            with wave.open(audio_file_path, 'rb') as wav_file:
-                sample_rate = wav_file.getframerate()
-                num_channels = wav_file.getnchannels()
-                sample_width = wav_file.getsampwidth()
-                num_frames = wav_file.getnframes()
-
-                print(f"音频参数: {sample_rate}Hz, {num_channels}通道, {sample_width*8}bit")
-
-                # 检查格式
-                if sample_rate != 16000:
-                    print(f"⚠️  警告: 采样率应为 16000Hz，当前为 {sample_rate}Hz")
-                if num_channels != 1:
-                    print(f"⚠️  警告: 应为单声道，当前为 {num_channels}声道")
-                if sample_width != 2:
-                    print(f"⚠️  警告: 应为 16-bit，当前为 {sample_width*8}-bit")
-
-                # 读取所有帧
-                audio_bytes = wav_file.readframes(num_frames)
+            # 读取 PCM（每次读取都校验 WAV 头，格式不符只打印警告；采样走 .s16.npy 缓存）
+            samples = load_pcm16(audio_file_path, strict=False)
+            audio_bytes = memoryview(samples).cast('B')
 
-                print(f"发送音频数据: {len(audio_bytes)} bytes ({num_frames/sample_rate:.2f}秒)")
+            print("音频参数: 16000Hz, 1通道, 16bit")
+            print(f"发送音频数据: {len(audio_bytes)} bytes ({len(samples)/16000:.2f}秒)")
 
             # 创建发送和接收任务
             async def send_audio():
                 """发送音频数据"""
-                chunk_size = 3200  # 100ms
+                chunk_size = 3200 if realtime else FAST_CHUNK_BYTES  # 100ms / 64KB
                 try:
                     for i in range(0, len(audio_bytes), chunk_size):
                         chunk = audio_bytes[i:i+chunk_size]
 
-                        # Base64 编码
-                        audio_b64 = base64.b64encode(chunk).decode('utf-8')
-
-                        # 发送 JSON 消息
-                        message = json.dumps({
-                            "audio_data": audio_b64
-                        })
-
-                        await websocket.send(message)
+                        # 原始 PCM 直接作为二进制帧发送（无 Base64/JSON 封装）
+                        await websocket.send(chunk)
                         if i % (chunk_size * 10) == 0:  # 每10个块打印一次
                             print(f"  发送音频块 {i//chunk_size + 1}/{(len(audio_bytes) + chunk_size - 1)//chunk_size}")
 
-                        await asyncio.sleep(0.05)
+                        if realtime:
+                            await asyncio.sleep(0.05)
                     print("✓ 所有音频数据已发送")
                 except Exception as e:
                     print(f"发送错误: {e}")
@@ -140,7 +130,7 @@ async def test_with_audio_file(audio_file_path: str):
                 try:
                     while True:
                         result = await asyncio.wait_for(websocket.recv(), timeout=45.0)
-                        result_data = json.loads(result)
+                        result_data = json_loads(result)
                         results_count += 1
 
                         print(f"\n✓ 收到转录结果 #{results_count}:")
@@ -176,17 +166,25 @@ async def test_with_audio_file(audio_file_path: str):
 if __name__ == "__main__":
     import sys
 
+    # uvloop 为可选依赖：基于 libuv 的事件循环，调度开销更低；未安装时使用默认循环
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     print("="*60)
     print("Modal Whisper STT WebSocket 测试")
     print("="*60)
 
     if len(sys.argv) > 1:
         # 使用提供的音频文件
+        # python test_whisper_stt.py <audio.wav> [--realtime]
         audio_file = sys.argv[1]
-        asyncio.run(test_with_audio_file(audio_file))
+        asyncio.run(test_with_audio_file(audio_file, realtime="--realtime" in sys.argv[2:]))
     else:
         # 使用合成音频测试
         print("使用合成音频测试（440Hz 正弦波）")
-        print("如需使用真实音频文件，请提供 WAV 文件路径作为参数")
+        print("如需使用真实音频文件，请提供 WAV 文件路径作为参数（加 --realtime 按实时速度发送）")
         print()
         asyncio.run(test_websocket_stt())
@@ -2,9 +2,8 @@
 from __future__ import annotations
 
 import asyncio
-import base64
-import os
-import tempfile
+import io
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from fastapi import HTTPException
@@ -14,11 +13,22 @@ try:
 except ImportError:  # pragma: no cover
     TTS = None
 
+try:  # SIMD-accelerated base64, falls back to the stdlib
+    from pybase64 import b64encode
+except ImportError:  # pragma: no cover
+    from base64 import b64encode
+
 from backend.config import config
 from backend.models import TTSResponse
 
 _local_tts_model: Optional[TTS] = None
 
+# The model is not thread-safe: all load/synthesis work runs on one dedicated
+# thread. The semaphore caps queued + running requests; callers past the cap
+# are rejected with 503 instead of piling up behind the executor.
+_tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-tts")
+_tts_slots = asyncio.Semaphore(config.LOCAL_TTS_CONCURRENCY)
+
 
 def _ensure_model() -> TTS:
     global _local_tts_model
@@ -44,35 +54,42 @@ def _ensure_model() -> TTS:
     return _local_tts_model
 
 
+async def warmup_local_tts() -> None:
+    """Load the local TTS model ahead of the first request (e.g. at app startup)."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_tts_executor, _ensure_model)
+
+
 async def synthesize_local_tts(text: str, voice: Optional[str] = None) -> TTSResponse:
     """Synthesize speech with a locally hosted model and return base64 audio."""
     if not text:
         raise HTTPException(status_code=400, detail="Missing text for local TTS")
 
-    model = _ensure_model()
+    if _tts_slots.locked():
+        raise HTTPException(status_code=503, detail="Local TTS is busy, retry shortly")
+
     speaker = voice or config.LOCAL_TTS_SPEAKER or None
     loop = asyncio.get_running_loop()
 
-    def _render() -> bytes:
-        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        tmp_path = tmp_file.name
-        tmp_file.close()
-        try:
-            model.tts_to_file(text=text, speaker=speaker, file_path=tmp_path)
-            with open(tmp_path, "rb") as fp:
-                return fp.read()
-        finally:
-            try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
+    def _render() -> str:
+        # A cold model load happens here too, never on the event loop
+        model = _ensure_model()
+        # Synthesize to a waveform and encode the WAV in memory (same peak
+        # normalisation as tts_to_file, without the temp-file round-trip).
+        wav = model.tts(text=text, speaker=speaker)
+        buffer = io.BytesIO()
+        model.synthesizer.save_wav(wav=wav, path=buffer)
+        # Base64 in the worker too, so multi-MB payloads never block the event loop
+        return b64encode(buffer.getvalue()).decode("ascii")
 
     try:
-        audio_bytes = await loop.run_in_executor(None, _render)
+        async with _tts_slots:
+            audio_b64 = await loop.run_in_executor(_tts_executor, _render)
+    except HTTPException:
+        raise
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Local TTS synthesis failed: {exc}")
 
-    audio_b64 = base64.b64encode(audio_bytes).decode("ascii")
     return TTSResponse(
         audio_base64=audio_b64,
         voice=speaker or "local",
@@ -5,14 +5,49 @@
 
 import asyncio
 import base64
+import functools
+import importlib.util
+import io
+import json
 import logging
-import re
+import os
 import subprocess
+import sys
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Awaitable, Optional
+
+try:
+    import onnxruntime
+    from piper import PiperVoice
+    from piper.config import PiperConfig
+except ImportError:  # pragma: no cover
+    PiperVoice = None
+
+try:  # 进程内 MP3 编码；未安装时回退到 FFmpeg 子进程
+    import lameenc
+except ImportError:  # pragma: no cover
+    lameenc = None
 
 logger = logging.getLogger(__name__)
 
+# 分句标点：句末标点 / 长句内的次级停顿标点
+_SENTENCE_ENDS = frozenset(".!?。！？")
+_SUBCLAUSE_BREAKS = frozenset(",，、;；:")
+
+CHUNK_SIZE = 4096  # 输出音频块大小（字节）
+PIPE_READ_SIZE = 65536  # 子进程管道单次读取上限：有多少读多少，积压时合并成大块
+PIPE_BUFFER_LIMIT = 1024 * 1024  # 子进程 StreamReader 缓冲上限
+
+# 短句音频缓存：常用短语（"好的"、"请稍等"）直接复用已编码的音频
+CACHE_MAX_CHARS = 40
+CACHE_MAX_ENTRIES = 256
+
+# 相邻短句合并为一组推理时，每组的最大字符数（与音素数大致相当）
+_GROUP_MAX_CHARS = 150
+
 
 class PiperTTS:
     """Piper TTS 流式引擎
@@ -21,22 +56,141 @@ class PiperTTS:
     - 真正的流式输出（句子级）
     - CPU 友好（无需 GPU）
     - 低延迟（首字节 < 500ms）
+    - 模型常驻：ONNX 模型只在初始化时加载一次，逐句合成不再重复启动 piper 进程
     """
 
-    def __init__(self, model_path: str, config_path: str, sample_rate: int = 22050):
+    def __init__(
+        self,
+        model_path: str,
+        config_path: str,
+        sample_rate: int = 22050,
+        quantize: bool = False,
+        use_cuda: bool = False,
+    ):
         """初始化 Piper TTS 引擎
 
         Args:
             model_path: ONNX 模型文件路径
             config_path: JSON 配置文件路径
             sample_rate: 输出采样率（Hz）
+            quantize: 使用 int8 动态量化后的模型（CPU 推理更快，音质略有损失）
+            use_cuda: 使用 CUDAExecutionProvider（需要 onnxruntime-gpu），不可用的算子回退 CPU
         """
         self.model_path = Path(model_path)
         self.config_path = Path(config_path)
         self.sample_rate = sample_rate
+        self.quantize = quantize
+        self.use_cuda = use_cuda
         self.validate_model()
+
+        if PiperVoice is None:
+            raise RuntimeError("Missing dependency: piper-tts. Please install it with `pip install piper-tts`.")
+        with open(self.config_path, "r", encoding="utf-8") as config_file:
+            voice_config = PiperConfig.from_dict(json.load(config_file))
+        self.voice = PiperVoice(config=voice_config, session=self._create_session())
+        self.native_rate = self.voice.config.sample_rate  # 模型原生输出采样率
+
+        # 输出采样率与模型一致时不重采样，编码器直接处理原生 PCM
+        self.needs_resample = self.sample_rate != self.native_rate
+
+        # FFmpeg 回退路径的命令行（PCM → MP3），参数固定，初始化时构建一次
+        self._ffmpeg_mp3_cmd = [
+            "ffmpeg",
+            "-f", "s16le",                  # 输入格式：PCM 16-bit LE
+            "-ar", str(self.native_rate),   # Piper 模型原生采样率
+            "-ac", "1",                     # 单声道
+            "-i", "pipe:0",                 # 从 stdin 读取
+            "-f", "mp3",                    # 输出 MP3
+            "-ab", "64k",                   # 比特率 64kbps
+        ]
+        if self.needs_resample:
+            self._ffmpeg_mp3_cmd += ["-ar", str(self.sample_rate)]  # 重采样
+        self._ffmpeg_mp3_cmd += [
+            "-loglevel", "error",           # 仅显示错误
+            "pipe:1"                        # 输出到 stdout
+        ]
+
+        # 推理会话不保证线程安全：所有合成在同一个专用线程上串行执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="piper-tts")
+        # 音素化（espeak-ng，全局状态非线程安全）在另一个专用线程上串行执行，
+        # 与 ONNX 推理（执行期间释放 GIL）重叠：合成第 N 组时提前音素化第 N+1 组
+        self._phonemizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="piper-phonemize")
+        # Windows 上 asyncio 子进程走 IOCP，逐块读取开销明显；FFmpeg 回退改用线程池 + 阻塞 subprocess
+        self._ffmpeg_pool = (
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix="piper-ffmpeg")
+            if sys.platform == "win32" else None
+        )
+
+        # (规范化文本, 输出格式, 采样率) -> 编码后的音频，按 LRU 淘汰
+        self._cache: OrderedDict[tuple[str, str, int], bytes] = OrderedDict()
         logger.info(f"Initialized Piper TTS: {self.model_path.name}")
 
+    def _create_session(self) -> "onnxruntime.InferenceSession":
+        """创建 ONNX Runtime 推理会话
+
+        PiperVoice.load 使用默认 SessionOptions；这里开启全部图优化、
+        内存模式复用与 CPU 内存池，并把算子内线程数限制为一半核心数。
+        """
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.enable_mem_pattern = True
+        options.enable_cpu_mem_arena = True
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+
+        providers: list = ["CPUExecutionProvider"]
+        if self.use_cuda:
+            # HEURISTIC 跳过 cuDNN 卷积算法穷举：每个新输入长度都会触发一次穷举，
+            # 短句（长度各不相同）在默认 EXHAUSTIVE 下反而比 CPU 慢得多
+            providers.insert(0, ("CUDAExecutionProvider", {
+                "cudnn_conv_algo_search": "HEURISTIC",
+                "arena_extend_strategy": "kSameAsRequested",
+            }))
+
+        model_path = self.model_path
+        if self.quantize:
+            if self.use_cuda:
+                # 动态量化算子（ConvInteger/MatMulInteger）在 CUDA 上大多不受支持
+                logger.warning("PIPER_QUANTIZE is ignored when running on CUDA")
+            else:
+                model_path = self._quantized_model_path()
+
+        return onnxruntime.InferenceSession(
+            os.fspath(model_path),
+            sess_options=options,
+            providers=providers,
+        )
+
+    def _quantized_model_path(self) -> Path:
+        """返回 int8 动态量化模型的路径，不存在或已过期时先生成
+
+        权重量化为 int8（激活保持浮点），生成结果缓存在原模型旁，
+        只在首次启动或原模型更新后转换一次。
+        """
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = self.model_path.with_suffix(".int8.onnx")
+        if (
+            not quantized_path.exists()
+            or quantized_path.stat().st_mtime < self.model_path.stat().st_mtime
+        ):
+            logger.info(f"Quantizing Piper model to int8: {quantized_path.name}")
+            quantize_dynamic(
+                os.fspath(self.model_path),
+                os.fspath(quantized_path),
+                weight_type=QuantType.QInt8,
+            )
+        return quantized_path
+
+    async def warmup(self) -> None:
+        """预热：合成一个短句并丢弃结果
+
+        首次推理要承担图初始化与冷缓存开销；启动时先跑一次，首个真实请求即可命中热路径。
+        """
+        loop = asyncio.get_running_loop()
+        phonemes = await loop.run_in_executor(self._phonemizer, self._phonemize, "Hello.")
+        await loop.run_in_executor(self._executor, self._synthesize_pcm, phonemes)
+        logger.info("Piper TTS warmup finished")
+
     def validate_model(self):
         """验证模型文件存在"""
         if not self.model_path.exists():
@@ -67,12 +221,45 @@ class PiperTTS:
         """
         # 文本预处理：分句
         sentences = self._split_sentences(text)
-        logger.info(f"Split text into {len(sentences)} sentences")
-
-        for i, sentence in enumerate(sentences):
-            logger.debug(f"Synthesizing sentence {i+1}/{len(sentences)}: {sentence[:50]}...")
-            async for chunk in self._synthesize_sentence(sentence, output_format):
-                yield chunk
+        groups = self._group_sentences(sentences)
+        logger.info(f"Split text into {len(sentences)} sentences ({len(groups)} groups)")
+
+        # 生产者提前合成后续句子，与调用方消费（发送）当前句的音频重叠；
+        # 队列有界（16 × 4KB，约一句多的 MP3），调用方变慢时生产者自然暂停
+        queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+
+        loop = asyncio.get_running_loop()
+
+        def phonemize(text: str) -> Awaitable[list[str]]:
+            return loop.run_in_executor(self._phonemizer, self._phonemize, text)
+
+        async def produce():
+            try:
+                upcoming = phonemize(groups[0]) if groups else None
+                for i, sentence in enumerate(groups):
+                    # 先提交下一组的音素化，再等待本组合成，两者并行
+                    phonemes = upcoming
+                    upcoming = phonemize(groups[i + 1]) if i + 1 < len(groups) else None
+                    logger.debug(f"Synthesizing group {i+1}/{len(groups)}: {sentence[:50]}...")
+                    async for chunk in self._synthesize_sentence(sentence, output_format, phonemes):
+                        await queue.put(chunk)
+                await queue.put(None)
+            except Exception as e:
+                # 把异常交给消费端重新抛出
+                await queue.put(e)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # 调用方提前退出（如客户端断开）时停止后续合成
+            producer.cancel()
 
     def _split_sentences(self, text: str, max_length: int = 150) -> list[str]:
         """将文本分句
@@ -89,177 +276,283 @@ class PiperTTS:
         Returns:
             句子列表
         """
-        if not text.strip():
-            return []
+        # 单次线性扫描：遇到句末标点切句；当前句超过 max_length 时
+        # 在最近的逗号类标点处切开。只记录下标，最后各切片一次
+        result = []
+        n = len(text)
+        start = 0       # 当前句起点
+        last_soft = -1  # 当前句内最近的逗号类标点位置
+        i = 0
+        while i < n:
+            ch = text[i]
+            if i == start and ch.isspace():
+                # 跳过句首空白，长度从第一个有效字符算起
+                start += 1
+                i += 1
+                continue
 
-        # 按主要标点分句
-        sentences = re.split(r'([.!?。！？]+)', text)
+            is_end = ch in _SENTENCE_ENDS
+            if is_end:
+                # 连续的句末标点（如 "?!"、"..."）归入同一句
+                while i + 1 < n and text[i + 1] in _SENTENCE_ENDS:
+                    i += 1
+
+            # 句子过长，在此前最近的逗号类标点处切开。长度按去掉尾部空白后的
+            # 片段计算：空白字符本身不会让片段变长，只在遇到有效字符时判断
+            if (
+                i + 1 - start > max_length
+                and last_soft >= start
+                and not ch.isspace()
+            ):
+                result.append(text[start:last_soft + 1].strip())
+                start = last_soft + 1
+                last_soft = -1
+
+            if is_end:
+                sentence = text[start:i + 1].strip()
+                if sentence:
+                    result.append(sentence)
+                start = i + 1
+                last_soft = -1
+            elif ch in _SUBCLAUSE_BREAKS:
+                last_soft = i
+            i += 1
+
+        tail = text[start:].strip()
+        if tail:
+            result.append(tail)
 
-        # 重新组合（标点附加到前一句）
-        result = []
-        for i in range(0, len(sentences), 2):
-            sentence = sentences[i]
-            if i + 1 < len(sentences):
-                sentence += sentences[i + 1]
+        return result
 
-            sentence = sentence.strip()
-            if not sentence:
-                continue
+    def _group_sentences(self, sentences: list[str], max_chars: int = _GROUP_MAX_CHARS) -> list[str]:
+        """把相邻短句合并成组，每组只做一次推理
+
+        首句单独成组，首包延迟不变；其余句子按顺序贪心合并，组内总长不超过 max_chars。
+
+        Args:
+            sentences: _split_sentences 的输出
+            max_chars: 每组最大字符数
 
-            # 如果句子过长，按逗号再分
-            if len(sentence) > max_length:
-                parts = re.split(r'([,，、;；:])', sentence)
-                temp = ""
-                for j in range(0, len(parts), 2):
-                    part = parts[j]
-                    if j + 1 < len(parts):
-                        part += parts[j + 1]
-
-                    if len(temp) + len(part) > max_length and temp:
-                        result.append(temp.strip())
-                        temp = part
-                    else:
-                        temp += part
-
-                if temp:
-                    result.append(temp.strip())
+        Returns:
+            分组后的文本列表
+        """
+        if not sentences:
+            return []
+
+        groups = [sentences[0]]
+        current = ""
+        for sentence in sentences[1:]:
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                groups.append(current)
+                current = sentence
             else:
-                result.append(sentence)
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            groups.append(current)
+        return groups
 
-        return result
+    def _phonemize(self, text: str) -> list[str]:
+        """把一组句子音素化为单个音素序列（阻塞，运行在音素化线程）
+
+        synthesize_stream_raw 会对每个句子各跑一次会话；这里把各句音素
+        （含句末标点带来的停顿）拼成一个序列，整组只做一次前向推理。
+        """
+        phonemes: list[str] = []
+        for sentence_phonemes in self.voice.phonemize(text):
+            if phonemes:
+                phonemes.append(" ")
+            phonemes.extend(sentence_phonemes)
+        return phonemes
+
+    def _synthesize_pcm(self, phonemes: list[str]) -> bytes:
+        """在常驻模型上合成音素序列，返回 16-bit 单声道 PCM（阻塞，运行在专用线程）"""
+        if not phonemes:
+            return b""
+        return self.voice.synthesize_ids_to_raw(self.voice.phonemes_to_ids(phonemes))
+
+    def _encode_mp3(self, pcm: bytes) -> bytes:
+        """用 lameenc 在进程内把 PCM 编码为 MP3（64kbps，阻塞，运行在专用线程）"""
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(64)
+        encoder.set_in_sample_rate(self.native_rate)
+        if self.needs_resample:
+            encoder.set_out_sample_rate(self.sample_rate)
+        encoder.set_channels(1)
+        encoder.set_quality(7)
+        return bytes(encoder.encode(pcm) + encoder.flush())
+
+    def _encode_mp3_ffmpeg(self, pcm: bytes) -> bytes:
+        """用阻塞的 FFmpeg 子进程把 PCM 编码为 MP3（Windows 回退路径，运行在线程池）"""
+        result = subprocess.run(
+            self._ffmpeg_mp3_cmd,
+            input=pcm,
+            capture_output=True,
+            bufsize=PIPE_READ_SIZE,
+        )
+        if result.returncode != 0:
+            logger.error(f"FFmpeg error: {result.stderr.decode('utf-8', errors='ignore')}")
+            raise RuntimeError(f"FFmpeg encoding failed: {result.stderr[:200]}")
+        return result.stdout
+
+    @staticmethod
+    def _pcm_memfd(pcm: bytes) -> int:
+        """把 PCM 写入匿名内存文件并回到开头，返回可直接作为子进程 stdin 的 fd（仅 Linux）"""
+        fd = os.memfd_create("piper-pcm", os.MFD_CLOEXEC)
+        try:
+            view = memoryview(pcm)
+            while view:
+                view = view[os.write(fd, view):]
+            os.lseek(fd, 0, os.SEEK_SET)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def _encode_wav(self, pcm: bytes) -> bytes:
+        """给 PCM 加上 WAV 头（模型原生采样率，不重采样）"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.native_rate)
+            wav_file.writeframes(pcm)
+        return buffer.getvalue()
+
+    def _cache_key(self, sentence: str, output_format: str) -> Optional[tuple[str, str, int]]:
+        """短句的缓存键；长句不缓存，返回 None"""
+        text = sentence.strip()
+        if len(text) > CACHE_MAX_CHARS:
+            return None
+        if text.isascii():
+            text = text.lower()
+        return (text, output_format, self.sample_rate)
+
+    def _cache_put(self, key: tuple[str, str, int], audio: bytes) -> None:
+        """写入缓存，超出容量时淘汰最久未用的条目"""
+        self._cache[key] = audio
+        self._cache.move_to_end(key)
+        if len(self._cache) > CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
 
     async def _synthesize_sentence(
         self,
         sentence: str,
         output_format: str,
+        phonemes: Optional[Awaitable[list[str]]] = None,
     ) -> AsyncGenerator[bytes, None]:
         """合成单个句子
 
-        使用 Piper 生成 PCM 音频，通过 FFmpeg 转码为 MP3。
+        使用常驻的 Piper 模型生成 PCM 音频，在进程内编码为 WAV / MP3
+        （MP3 需要 lameenc，未安装时通过 FFmpeg 转码）。
 
         Args:
             sentence: 要合成的句子
             output_format: 输出格式（mp3 或 wav）
+            phonemes: 已提交的音素化结果（由 synthesize_stream 预取）；为空时在此音素化
 
         Yields:
             bytes: 音频块
         """
+        cache_key = self._cache_key(sentence, output_format)
+        if cache_key is not None:
+            audio = self._cache.get(cache_key)
+            if audio is not None:
+                self._cache.move_to_end(cache_key)
+                for offset in range(0, len(audio), CHUNK_SIZE):
+                    yield audio[offset:offset + CHUNK_SIZE]
+                return
+
         try:
-            # Piper 命令（输出 WAV 到 stdout）
-            piper_cmd = [
-                "piper",
-                "--model", str(self.model_path),
-                "--config", str(self.config_path),
-                "--output-raw",  # 输出原始 PCM 到 stdout
-            ]
-
-            # FFmpeg 命令（PCM → MP3）
-            if output_format == "mp3":
-                ffmpeg_cmd = [
-                    "ffmpeg",
-                    "-f", "s16le",                  # 输入格式：PCM 16-bit LE
-                    "-ar", "22050",                 # Piper 默认采样率
-                    "-ac", "1",                     # 单声道
-                    "-i", "pipe:0",                 # 从 stdin 读取
-                    "-f", "mp3",                    # 输出 MP3
-                    "-ab", "64k",                   # 比特率 64kbps
-                    "-ar", str(self.sample_rate),   # 重采样
-                    "-loglevel", "error",           # 仅显示错误
-                    "pipe:1"                        # 输出到 stdout
-                ]
+            # 合成 PCM（阻塞的 ONNX 推理放到专用线程，不阻塞事件循环）
+            loop = asyncio.get_running_loop()
+            if phonemes is None:
+                phonemes = loop.run_in_executor(self._phonemizer, self._phonemize, sentence)
+            pcm = await loop.run_in_executor(self._executor, self._synthesize_pcm, await phonemes)
+
+            if output_format != "mp3":
+                audio = self._encode_wav(pcm)
+            elif lameenc is not None:
+                # 进程内编码，无需启动子进程
+                audio = await loop.run_in_executor(self._executor, self._encode_mp3, pcm)
+            elif self._ffmpeg_pool is not None:
+                # Windows：Proactor 事件循环的子进程管道开销大，改在线程里用阻塞的 subprocess
+                audio = await loop.run_in_executor(self._ffmpeg_pool, self._encode_mp3_ffmpeg, pcm)
             else:
-                # WAV 输出
-                ffmpeg_cmd = [
-                    "ffmpeg",
-                    "-f", "s16le",
-                    "-ar", "22050",
-                    "-ac", "1",
-                    "-i", "pipe:0",
-                    "-f", "wav",
-                    "-loglevel", "error",
-                    "pipe:1"
-                ]
-
-            # 启动 Piper 进程
-            piper_proc = await asyncio.create_subprocess_exec(
-                *piper_cmd,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            # 启动 FFmpeg 进程（链式处理）
-            ffmpeg_proc = await asyncio.create_subprocess_exec(
-                *ffmpeg_cmd,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            # 创建三个并发任务：
-            # 1. 写入文本到 Piper
-            # 2. 从 Piper 读取并写入 FFmpeg
-            # 3. 从 FFmpeg 读取并 yield 输出
-
-            async def write_to_piper():
-                """写入文本到 Piper"""
-                if piper_proc.stdin:
-                    piper_proc.stdin.write(sentence.encode("utf-8"))
-                    piper_proc.stdin.write(b"\n")
-                    await piper_proc.stdin.drain()
-                    piper_proc.stdin.close()
-
-            async def pipe_piper_to_ffmpeg():
-                """从 Piper 读取并写入 FFmpeg"""
-                if piper_proc.stdout and ffmpeg_proc.stdin:
+                audio = None
+
+            if audio is not None:
+                if cache_key is not None:
+                    self._cache_put(cache_key, audio)
+                for offset in range(0, len(audio), CHUNK_SIZE):
+                    yield audio[offset:offset + CHUNK_SIZE]
+                return
+
+            # Linux：PCM 先写入匿名内存文件（memfd），直接作为 FFmpeg 的 stdin，
+            # 不经过管道，也不需要事件循环里的写入任务；其他平台仍通过管道写入
+            pcm_fd = self._pcm_memfd(pcm) if hasattr(os, "memfd_create") else None
+
+            # 启动 FFmpeg 进程
+            try:
+                ffmpeg_proc = await asyncio.create_subprocess_exec(
+                    *self._ffmpeg_mp3_cmd,
+                    stdin=pcm_fd if pcm_fd is not None else asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=PIPE_BUFFER_LIMIT,
+                )
+            finally:
+                if pcm_fd is not None:
+                    os.close(pcm_fd)  # 子进程已持有副本
+
+            async def write_to_ffmpeg():
+                """写入 PCM 到 FFmpeg（整句一次写入、一次 drain；memfd 模式下无需写入）"""
+                if ffmpeg_proc.stdin:
                     try:
-                        while True:
-                            chunk = await piper_proc.stdout.read(4096)
-                            if not chunk:
-                                break
-                            ffmpeg_proc.stdin.write(chunk)
-                            await ffmpeg_proc.stdin.drain()
+                        ffmpeg_proc.stdin.write(pcm)
+                        await ffmpeg_proc.stdin.drain()
                     finally:
                         ffmpeg_proc.stdin.close()
 
-            async def read_from_ffmpeg():
-                """从 FFmpeg 读取完整输出"""
-                if ffmpeg_proc.stdout:
-                    return await ffmpeg_proc.stdout.read()
-                return b""
-            # 启动所有任务
-            write_task = asyncio.create_task(write_to_piper())
-            pipe_task = asyncio.create_task(pipe_piper_to_ffmpeg())
-            read_task = asyncio.create_task(read_from_ffmpeg())
-
-            # 等待所有任务完成
-            await write_task
-            await pipe_task
-            audio_bytes = await read_task
-
-            # 等待进程结束
-            await piper_proc.wait()
-            await ffmpeg_proc.wait()
+            # 后台写入 PCM，同时边读 FFmpeg 输出边 yield：
+            # 第一块编码结果出来就发给调用方，不必等整句编码完成。
+            # 背压链路：只有调用方取走上一块才会再次 read；未读数据超过
+            # StreamReader 的 limit 时暂停读取管道，FFmpeg 写满管道后自然阻塞；
+            # synthesize_stream 的有界队列再限制生产者与调用方之间的积压
+            write_task = asyncio.create_task(write_to_ffmpeg())
+            encoded = bytearray() if cache_key is not None else None
+            try:
+                while True:
+                    # read(n) 不会等满 n 字节，首块延迟不变；积压的数据一次取走，减少唤醒次数
+                    chunk = await ffmpeg_proc.stdout.read(PIPE_READ_SIZE)
+                    if not chunk:
+                        break
+                    if encoded is not None:
+                        encoded += chunk
+                    yield chunk
+
+                # 等待写入完成与进程结束
+                await write_task
+                await ffmpeg_proc.wait()
+            finally:
+                # 调用方提前关闭生成器或出错时，不留下孤儿进程
+                if ffmpeg_proc.returncode is None:
+                    write_task.cancel()
+                    ffmpeg_proc.kill()
+                    await ffmpeg_proc.wait()
 
             # 检查错误
-            if piper_proc.returncode != 0:
-                stderr = await piper_proc.stderr.read() if piper_proc.stderr else b""
-                logger.error(f"Piper error: {stderr.decode('utf-8', errors='ignore')}")
-                raise RuntimeError(f"Piper synthesis failed: {stderr[:200]}")
-
             if ffmpeg_proc.returncode != 0:
                 stderr = await ffmpeg_proc.stderr.read() if ffmpeg_proc.stderr else b""
                 logger.error(f"FFmpeg error: {stderr.decode('utf-8', errors='ignore')}")
                 raise RuntimeError(f"FFmpeg encoding failed: {stderr[:200]}")
 
-            # Yield 所有音频块
-            if audio_bytes:
-                yield audio_bytes
+            if encoded is not None:
+                self._cache_put(cache_key, bytes(encoded))
 
         except FileNotFoundError as e:
             logger.error(f"Command not found: {e}")
             raise RuntimeError(
-                f"Missing dependency: {e}. Please install Piper and FFmpeg."
+                f"Missing dependency: {e}. Please install FFmpeg."
             )
         except Exception as e:
             logger.error(f"TTS synthesis error: {e}")
@@ -284,39 +577,51 @@ def get_tts_engine(config) -> PiperTTS:
         model_path = config.PIPER_MODEL_PATH
         config_path = config.PIPER_CONFIG_PATH
         sample_rate = config.PIPER_SAMPLE_RATE
-        _tts_engine = PiperTTS(model_path, config_path, sample_rate)
+        _tts_engine = PiperTTS(
+            model_path,
+            config_path,
+            sample_rate,
+            quantize=config.PIPER_QUANTIZE,
+            use_cuda=config.PIPER_USE_CUDA,
+        )
         logger.info("Created global PiperTTS instance")
     return _tts_engine
 
 
+@functools.lru_cache(maxsize=1)
+def _probe_dependencies() -> tuple[str, ...]:
+    """探测缺失的依赖（进程生命周期内结果不变，只探测一次）"""
+    missing = []
+
+    # 检查 Piper（进程内加载，只需 piper-tts 包可导入）
+    if importlib.util.find_spec("piper") is None:
+        missing.append("piper")
+
+    # 检查 FFmpeg（仅在没有 lameenc、需要子进程编码 MP3 时使用）
+    if lameenc is None:
+        try:
+            subprocess.run(
+                ["ffmpeg", "-version"],
+                capture_output=True,
+                check=True,
+                timeout=5
+            )
+        except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            missing.append("ffmpeg")
+
+    return tuple(missing)
+
+
 def check_dependencies() -> tuple[bool, list[str]]:
-    """检查 Piper 和 FFmpeg 是否安装
+    """检查 Piper 和 FFmpeg 是否安装（结果缓存，首次调用后不再启动子进程）
 
     Returns:
         (是否全部安装, 缺失的依赖列表)
     """
-    missing = []
-
-    # 检查 Piper
-    try:
-        subprocess.run(
-            ["piper", "--version"],
-            capture_output=True,
-            check=True,
-            timeout=5
-        )
-    except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
-        missing.append("piper")
+    missing = _probe_dependencies()
+    return (len(missing) == 0, list(missing))
 
-    # 检查 FFmpeg
-    try:
-        subprocess.run(
-            ["ffmpeg", "-version"],
-            capture_output=True,
-            check=True,
-            timeout=5
-        )
-    except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
-        missing.append("ffmpeg")
 
-    return (len(missing) == 0, missing)
+async def check_dependencies_async() -> tuple[bool, list[str]]:
+    """check_dependencies 的异步版本：首次探测在线程中执行，不阻塞事件循环"""
+    return await asyncio.to_thread(check_dependencies)